@@ -0,0 +1,68 @@
+"""
+Measures the startup cost of gisthub and guards against heavy dependencies
+creeping back into module import.
+
+	python benchmarks/bench_import.py
+	python benchmarks/bench_import.py --runs 20 --max-ms 150
+
+Exits with a non-zero status if `import gisthub` loads any of the heavy
+dependencies, or if a median exceeds `--max-ms`.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ['github', 'phonenumbers', 'requests', 'bs4', 'tldextract']
+
+CASES = [
+	('python -c pass', ['-c', 'pass']),
+	('import gisthub', ['-c', 'import gisthub']),
+	('gisthub.py --help', ['gisthub.py', '--help']),
+	('gisthub.py user --help', ['gisthub.py', 'user', '--help']),
+	('import phonenumbers', ['-c', 'import phonenumbers']),
+	('import github', ['-c', 'import github']),
+]
+
+def run_case(args, runs):
+	timings = []
+	for _ in range(runs):
+		t1 = time.perf_counter()
+		subprocess.run([sys.executable] + args, cwd=ROOT_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+		t2 = time.perf_counter()
+		timings.append((t2 - t1) * 1000)
+	return statistics.median(timings)
+
+def get_loaded_heavy_modules():
+	code = "import sys, gisthub; print(' '.join(m for m in %r if m in sys.modules))"%(HEAVY_MODULES)
+	output = subprocess.run([sys.executable, '-c', code], cwd=ROOT_DIR, capture_output=True, text=True, check=True).stdout
+	return output.split()
+
+def main():
+	parser = argparse.ArgumentParser(description='Measures the startup time of gisthub.')
+	parser.add_argument('--runs', '-r', type=int, default=10, metavar='INTEGER', help='specify the number of runs per case. Default is 10.')
+	parser.add_argument('--max-ms', type=float, metavar='FLOAT', dest='max_ms', help='specify the largest acceptable median for the gisthub cases, in milliseconds.')
+	args = parser.parse_args()
+
+	failed = False
+
+	loaded = get_loaded_heavy_modules()
+	if loaded:
+		print("[-] 'import gisthub' loaded heavy modules: %s"%(', '.join(loaded)))
+		failed = True
+
+	for name, case_args in CASES:
+		median = run_case(case_args, args.runs)
+		print("[+] %-26s %8.1f ms"%(name, median))
+		if args.max_ms and 'gisthub' in name and median > args.max_ms:
+			print("[-] '%s' exceeded %s ms."%(name, args.max_ms))
+			failed = True
+
+	return 1 if failed else 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,245 @@
+"""
+Measures the throughput and latency of every stage of the crawl pipeline
+offline, replaying fixtures through a local server standing in for GitHub.
+
+	python benchmarks/bench_pipeline.py
+	python benchmarks/bench_pipeline.py --users 50 --gists-per-user 40 --file-size 16384 --json results.json
+	python benchmarks/bench_pipeline.py --fixtures recorded/ --latency-ms 50 --baseline results.json
+
+By default a synthetic corpus is generated, see corpus.py; `--fixtures` replays
+a fixture directory instead, e.g. one recorded with fixtures.py. Results can
+be saved with `--json` and compared against an earlier run with `--baseline`.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from corpus import build_fixtures
+from fixtures import FixtureServer, FixtureSet
+
+from concurrency import map_concurrently
+from gisthub import (Gist, download_gist, extract_artifacts, extract_urls, normalize_urls,
+                     parse_gist_html, parse_search_page, process_urls)
+
+STAGES = ['search_parse', 'gist_html_parse', 'search', 'user_listing', 'gist_fetch', 'file_download', 'extraction', 'process_urls', 'normalize_urls']
+
+class StageResult:
+	def __init__(self, name):
+		self.name = name
+		self.latencies = []
+		self.bytes = 0
+		self.seconds = 0.0
+		self.errors = 0
+
+	def summary(self):
+		latencies = sorted(self.latencies)
+		count = len(latencies)
+		return {
+			'items': count,
+			'errors': self.errors,
+			'seconds': self.seconds,
+			'items_per_second': count / self.seconds if self.seconds else None,
+			'mb_per_second': self.bytes / self.seconds / 1e6 if self.seconds and self.bytes else None,
+			'p50_ms': statistics.median(latencies) * 1000 if latencies else None,
+			'p95_ms': latencies[min(count - 1, int(count * 0.95))] * 1000 if latencies else None,
+			'max_ms': latencies[-1] * 1000 if latencies else None,
+		}
+
+def run_stage(name, func, items, size=None, concurrency=1, warmup=False):
+	"""
+	Calls `func` on every item, timing each call, from `concurrency` threads.
+	`size` returns the number of bytes an item stands for. With `warmup` set,
+	`func` is called once on the first item beforehand, so that lazy imports
+	are not timed. Returns the StageResult and the results of the calls.
+	"""
+	result = StageResult(name)
+
+	if warmup and items:
+		with contextlib.redirect_stdout(io.StringIO()):
+			func(items[0])
+
+	def timed(item):
+		t1 = time.perf_counter()
+		value = func(item)
+		result.latencies.append(time.perf_counter() - t1)
+		return value
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		t1 = time.perf_counter()
+		outcomes = list(map_concurrently(timed, items, concurrency))
+		result.seconds = time.perf_counter() - t1
+
+	values = []
+	for item, value, e in outcomes:
+		if e is not None:
+			result.errors += 1
+			continue
+		if size is not None:
+			result.bytes += size(item)
+		values.append(value)
+	return result, values
+
+def infer_manifest(fixtures):
+	"""
+	Returns the manifest of a recorded fixture set: its users, gists, search
+	query and pages, and the texts of its raw files.
+	"""
+	manifest = {'usernames': [], 'gists_id': [], 'query': None, 'pages': 0, 'texts': []}
+	for key, (status, headers, body) in sorted(fixtures.responses.items()):
+		path = key.split(' ', 1)[1]
+		parts = urlsplit(path)
+		segments = [segment for segment in parts.path.split('/') if segment]
+
+		if status != 200:
+			continue
+		if parts.path == '/search':
+			params = dict(parse_qsl(parts.query))
+			manifest['query'] = params.get('q')
+			manifest['pages'] = max(manifest['pages'], int(params.get('p', 1)))
+		elif len(segments) == 3 and segments[0] == 'users' and segments[2] == 'gists':
+			if segments[1] not in manifest['usernames']:
+				manifest['usernames'].append(segments[1])
+		elif len(segments) == 2 and segments[0] == 'gists':
+			manifest['gists_id'].append(segments[1])
+		elif 'raw' in segments:
+			manifest['texts'].append(body.decode('utf-8', errors='replace'))
+	return manifest
+
+def get_bodies(fixtures, predicate):
+	return [body for key, (status, headers, body) in sorted(fixtures.responses.items()) if status == 200 and predicate(key.split(' ', 1)[1])]
+
+def benchmark(fixtures, manifest, stages, concurrency=8, latency=0.0):
+	results = []
+
+	def text_size(text):
+		return len(text.encode('utf-8'))
+
+	with FixtureServer(fixtures, latency) as server:
+		g = Gist(api_url=server.url, max_concurrency=concurrency)
+		g.gist_search_url = server.url
+		session = g.create_session()
+
+		if 'search_parse' in stages:
+			pages = [body.decode('utf-8') for body in get_bodies(fixtures, lambda path: urlsplit(path).path == '/search')]
+			results.append(run_stage('search_parse', parse_search_page, pages, text_size, warmup=True)[0])
+
+		if 'gist_html_parse' in stages:
+			divs = [json.loads(body).get('div') or '' for body in get_bodies(fixtures, lambda path: path.endswith('.json') and '/raw/' not in path)]
+			results.append(run_stage('gist_html_parse', parse_gist_html, divs, text_size, warmup=True)[0])
+
+		if 'search' in stages and manifest['query']:
+			def search(page):
+				gist_store, _, _ = g.search(manifest['query'], page, max_pages=1, max_gists=None)
+				return len(gist_store)
+			results.append(run_stage('search', search, list(range(1, manifest['pages'] + 1)))[0])
+
+		if 'user_listing' in stages:
+			results.append(run_stage('user_listing', g.get_gists, manifest['usernames'], concurrency=concurrency)[0])
+
+		gists = []
+		if 'gist_fetch' in stages or 'file_download' in stages:
+			result, gists = run_stage('gist_fetch', g.get_gist, manifest['gists_id'], concurrency=concurrency)
+			if 'gist_fetch' in stages:
+				results.append(result)
+
+		if 'file_download' in stages:
+			def gist_size(gist):
+				return sum(file.size or 0 for file in gist.files.values())
+			results.append(run_stage('file_download', lambda gist: download_gist(gist, session), gists, gist_size, concurrency)[0])
+
+		if server.missing:
+			print("[-] %s request(s) had no fixture, e.g. '%s'."%(len(server.missing), server.missing[0]))
+
+	texts = manifest['texts']
+	if 'extraction' in stages:
+		results.append(run_stage('extraction', lambda text: extract_artifacts([text]), texts, text_size, warmup=True)[0])
+	if 'process_urls' in stages:
+		results.append(run_stage('process_urls', lambda text: process_urls(extract_urls(text)), texts, text_size, warmup=True)[0])
+	if 'normalize_urls' in stages:
+		results.append(run_stage('normalize_urls', lambda text: normalize_urls(extract_urls(text)), texts, text_size, warmup=True)[0])
+
+	return results
+
+def format_number(value, pattern):
+	return pattern%(value) if value is not None else '-'
+
+def print_results(results, baseline=None):
+	print("%-16s %7s %6s %9s %10s %8s %9s %9s %9s%s"%('stage', 'items', 'errors', 'seconds', 'items/s', 'MB/s', 'p50 ms', 'p95 ms', 'max ms', '  vs baseline' if baseline else ''))
+	for name, summary in results.items():
+		line = "%-16s %7s %6s %9.3f %10s %8s %9s %9s %9s"%(name, summary['items'], summary['errors'], summary['seconds'],
+			format_number(summary['items_per_second'], '%.1f'), format_number(summary['mb_per_second'], '%.2f'),
+			format_number(summary['p50_ms'], '%.2f'), format_number(summary['p95_ms'], '%.2f'), format_number(summary['max_ms'], '%.2f'))
+
+		previous = (baseline or {}).get(name)
+		if previous and previous.get('items_per_second') and summary['items_per_second']:
+			change = (summary['items_per_second'] / previous['items_per_second'] - 1) * 100
+			line += "  %+6.1f%%"%(change)
+		print(line)
+
+def main():
+	parser = argparse.ArgumentParser(description='Measures the throughput and latency of the crawl pipeline offline.')
+	parser.add_argument('--fixtures', '-f', metavar='DIRECTORY', help='specify a fixture directory to replay instead of generating a synthetic corpus.')
+	parser.add_argument('--users', type=int, default=10, metavar='INTEGER', help='specify the number of synthetic users. Default is 10.')
+	parser.add_argument('--gists-per-user', type=int, default=10, metavar='INTEGER', dest='gists_per_user', help='specify the number of gists per synthetic user. Default is 10.')
+	parser.add_argument('--files-per-gist', type=int, default=3, metavar='INTEGER', dest='files_per_gist', help='specify the number of files per synthetic gist. Default is 3.')
+	parser.add_argument('--file-size', type=int, default=4096, metavar='INTEGER', dest='file_size', help='specify the size of the synthetic files in characters. Default is 4096.')
+	parser.add_argument('--density', type=float, default=0.05, metavar='FLOAT', help='specify the share of lines mentioning an artifact. Default is 0.05.')
+	parser.add_argument('--seed', type=int, default=0, metavar='INTEGER', help='specify the seed of the synthetic corpus. Default is 0.')
+	parser.add_argument('--save-fixtures', metavar='DIRECTORY', dest='save_fixtures', help='specify a directory to save the synthetic fixtures to.')
+	parser.add_argument('--stage', '-s', action='append', choices=STAGES, dest='stages', help='specify a stage to run. Repeat the flag to run several. Default is all stages.')
+	parser.add_argument('--concurrency', '-c', type=int, default=8, metavar='INTEGER', help='specify the number of threads of the network stages. Default is 8.')
+	parser.add_argument('--latency-ms', type=float, default=0, metavar='FLOAT', dest='latency_ms', help='specify the latency the fixture server adds to every response, in milliseconds. Default is 0.')
+	parser.add_argument('--json', metavar='FILE', dest='json', help='specify the file to save the results to.')
+	parser.add_argument('--baseline', metavar='FILE', help='specify the results of an earlier run to compare the throughput against.')
+	args = parser.parse_args()
+
+	if args.fixtures:
+		fixtures = FixtureSet.load(args.fixtures)
+		manifest = infer_manifest(fixtures)
+	else:
+		fixtures, manifest = build_fixtures(args.users, args.gists_per_user, args.files_per_gist, args.file_size, args.density, seed=args.seed)
+		if args.save_fixtures:
+			fixtures.save(args.save_fixtures)
+
+	print("[+] %s fixture(s), %.1f MB: %s user(s), %s gist(s), %s search page(s), %s file(s)."%(len(fixtures), fixtures.size / 1e6,
+		len(manifest['usernames']), len(manifest['gists_id']), manifest['pages'], len(manifest['texts'])))
+	print()
+
+	stages = args.stages or STAGES
+	results = {result.name: result.summary() for result in benchmark(fixtures, manifest, stages, args.concurrency, args.latency_ms / 1000)}
+
+	baseline = None
+	if args.baseline:
+		with open(args.baseline, 'rt', encoding='utf-8') as f:
+			baseline = json.load(f).get('stages')
+
+	print_results(results, baseline)
+
+	if args.json:
+		report = {
+			'timestamp': time.time(),
+			'python': platform.python_version(),
+			'platform': platform.platform(),
+			'config': {key: value for key, value in vars(args).items() if key not in ('json', 'baseline')},
+			'stages': results,
+		}
+		with open(args.json, 'wt', encoding='utf-8') as f:
+			json.dump(report, f, indent=2)
+		print()
+		print("[+] Results saved to '%s'."%(args.json))
+
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,182 @@
+"""
+Synthetic corpora for the benchmarks: gist texts seeded with emails, phone
+numbers and urls, and fixture sets standing in for GitHub at any scale. The
+same seed always gives the same corpus, so results can be compared release
+to release.
+"""
+import random
+import string
+from datetime import datetime, timedelta
+from html import escape
+
+from fixtures import FixtureSet
+
+WORDS = ['config', 'server', 'token', 'deploy', 'cache', 'user', 'value', 'result', 'request', 'handler',
+	'index', 'build', 'script', 'path', 'client', 'session', 'record', 'query', 'buffer', 'stream']
+
+NAMES = ['alice', 'bob', 'carol', 'dave', 'erin', 'frank', 'grace', 'heidi', 'ivan', 'judy', 'mallory', 'oscar']
+
+DOMAINS = ['example.com', 'example.org', 'mail.example.net', 'corp.example.io', 'api.example.dev', 'shop.example.co.uk']
+
+PHONE_FORMATS = ['+1 415-555-%04d', '(212) 555-%04d', '+44 20 7946 %04d', '+49 30 901820%02d', '+234 803 555 %04d']
+
+FILE_TYPES = [
+	('main.py', 'application/x-python', 'Python'),
+	('notes.md', 'text/markdown', 'Markdown'),
+	('.bashrc', 'application/octet-stream', 'Shell'),
+	('config.json', 'application/json', 'JSON'),
+	('index.html', 'text/html', 'HTML'),
+	('data.csv', 'text/csv', 'CSV'),
+]
+
+def make_email(rng):
+	return '%s.%s%s@%s'%(rng.choice(NAMES), rng.choice(WORDS), rng.randint(1, 99), rng.choice(DOMAINS))
+
+def make_phone_number(rng):
+	return rng.choice(PHONE_FORMATS)%(rng.randint(0, 99))
+
+def make_url(rng):
+	scheme = rng.choice(['http://', 'https://', 'https://', ''])
+	return '%s%s/%s/%s?id=%s'%(scheme, rng.choice(DOMAINS), rng.choice(WORDS), rng.choice(WORDS), rng.randint(1, 9999))
+
+def make_line(rng, density):
+	words = [rng.choice(WORDS) for _ in range(rng.randint(3, 10))]
+	line = '%s = %s(%s)'%(words[0], words[1], ', '.join(words[2:]))
+
+	if rng.random() < density:
+		artifact = rng.choice([make_email, make_phone_number, make_url])(rng)
+		line += '  # %s'%(artifact)
+	return line
+
+def make_text(rng, size, density=0.05):
+	"""
+	Returns a code-like text of about `size` characters in which a `density`
+	share of the lines mention an email, phone number or url.
+	"""
+	lines = []
+	length = 0
+	while length < size:
+		line = make_line(rng, density)
+		lines.append(line)
+		length += len(line) + 1
+	return '\n'.join(lines)
+
+def make_corpus(count, size, density=0.05, seed=0):
+	"""
+	Returns `count` texts of about `size` characters each.
+	"""
+	rng = random.Random(seed)
+	return [make_text(rng, size, density) for _ in range(count)]
+
+def make_gist_id(rng):
+	return ''.join(rng.choice('0123456789abcdef') for _ in range(32))
+
+def make_timestamp(rng):
+	moment = datetime(2020, 1, 1) + timedelta(seconds=rng.randint(0, 3 * 365 * 24 * 3600))
+	return moment.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def make_gist(rng, owner, files_per_gist, file_size, density):
+	"""
+	Returns the API representation of a gist and the texts of its files by raw url.
+	"""
+	gist_id = make_gist_id(rng)
+	files = {}
+	texts = {}
+
+	for filename, mime_type, language in rng.sample(FILE_TYPES, min(files_per_gist, len(FILE_TYPES))):
+		sha = ''.join(rng.choice(string.hexdigits.lower()) for _ in range(40))
+		raw_url = 'https://gist.githubusercontent.com/%s/%s/raw/%s/%s'%(owner, gist_id, sha, filename)
+		text = make_text(rng, file_size, density)
+		files[filename] = {'filename': filename, 'type': mime_type, 'language': language, 'raw_url': raw_url, 'size': len(text.encode('utf-8'))}
+		texts[raw_url] = text
+
+	created_at = make_timestamp(rng)
+	gist = {
+		'id': gist_id,
+		'url': 'https://api.github.com/gists/%s'%(gist_id),
+		'html_url': 'https://gist.github.com/%s/%s'%(owner, gist_id),
+		'public': True,
+		'created_at': created_at,
+		'updated_at': created_at,
+		'description': ' '.join(rng.choice(WORDS) for _ in range(5)),
+		'owner': {'login': owner, 'id': rng.randint(1, 10 ** 8), 'type': 'User'},
+		'files': files,
+	}
+	return gist, texts
+
+def make_search_page(links, total):
+	"""
+	Returns a search results page with the markup `parse_search_page()` expects.
+	"""
+	snippets = ''.join('<div class="gist-snippet"><div class="gist-snippet-meta"><ul><li class="d-inline-block">'
+		'<a href="%s">%s</a></li></ul></div></div>'%(escape(link), escape(link)) for link in links)
+	return ('<html><body><div><main><div><div class="repository-content"><div class="gutter">'
+		'<div><div><h3><div class="d-flex"><h3>%s gist results</h3></div></h3></div></div>'
+		'<div>%s</div></div></div></div></main></div></body></html>'%(total, snippets))
+
+def make_gist_div(gist, texts):
+	"""
+	Returns the `div` of a gist's .json view with the markup `parse_gist_html()` expects.
+	"""
+	parts = ['<div class="gist">']
+	for file in gist['files'].values():
+		parts.append('<div class="gist-file"><div class="gist-data"><div class="file">%s</div></div>'
+			'<div class="gist-meta"><a href="%s">view raw</a></div></div>'%(escape(texts[file['raw_url']]), escape(file['raw_url'])))
+	parts.append('</div>')
+	return ''.join(parts)
+
+def build_fixtures(users=10, gists_per_user=10, files_per_gist=3, file_size=4096, density=0.05, per_page=10, query='bench', seed=0):
+	"""
+	Returns a FixtureSet standing in for GitHub and a manifest of what it holds.
+	Every user has `gists_per_user` gists of `files_per_gist` files of about
+	`file_size` characters, served by the API (user listings and single
+	gists), as raw files, and as search results for `query`, `per_page` to a page.
+	"""
+	rng = random.Random(seed)
+	fixtures = FixtureSet()
+
+	usernames = ['%s%s'%(rng.choice(NAMES), index) for index in range(users)]
+	gists = []
+
+	for username in usernames:
+		user_gists = []
+		for _ in range(gists_per_user):
+			gist, texts = make_gist(rng, username, files_per_gist, file_size, density)
+			user_gists.append(gist)
+			gists.append((gist, texts))
+
+			fixtures.add_json('https://api.github.com/gists/%s'%(gist['id']), dict(gist, history=[{'version': make_gist_id(rng)}]))
+			for raw_url, text in texts.items():
+				fixtures.add(raw_url, text, headers={'Content-Type': 'text/plain; charset=utf-8'})
+
+		for page in range(1, (len(user_gists) + 99) // 100 + 2):
+			fixtures.add_json('https://api.github.com/users/%s/gists?per_page=100&page=%s'%(username, page), user_gists[(page - 1) * 100:page * 100])
+
+	pages = max(1, (len(gists) + per_page - 1) // per_page)
+	for page in range(1, pages + 1):
+		links = []
+		for gist, texts in gists[(page - 1) * per_page:page * per_page]:
+			link = '/%s/%s'%(gist['owner']['login'], gist['id'])
+			links.append(link)
+
+			fixtures.add_json('https://gist.github.com%s.json'%(link), {
+				'owner': gist['owner']['login'],
+				'public': gist['public'],
+				'created_at': gist['created_at'],
+				'files': list(gist['files']),
+				'div': make_gist_div(gist, texts),
+			})
+
+		html = make_search_page(links, len(gists))
+		fixtures.add('https://gist.github.com/search?ref=searchresults&q=%s&p=%s'%(query, page), html, headers={'Content-Type': 'text/html; charset=utf-8'})
+		if page == 1:
+			fixtures.add('https://gist.github.com/search?ref=searchresults&q=%s'%(query), html, headers={'Content-Type': 'text/html; charset=utf-8'})
+
+	manifest = {
+		'usernames': usernames,
+		'gists_id': [gist['id'] for gist, _ in gists],
+		'query': query,
+		'pages': pages,
+		'texts': [text for _, texts in gists for text in texts.values()],
+	}
+	return fixtures, manifest
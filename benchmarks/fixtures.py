@@ -0,0 +1,224 @@
+"""
+Recorded HTTP fixtures and a local server replaying them, so benchmarks can
+run the real request paths without touching GitHub.
+
+A fixture set is a directory holding `index.json`, which maps request keys
+(`GET /path?sorted-query`) to a status, headers and a body file under
+`bodies/`. Sets are either generated, see corpus.py, or recorded from GitHub:
+
+	python benchmarks/fixtures.py record --out fixtures --query cat --username defunkt --gist aa5a315d61ae9438b18d
+
+Bodies keep GitHub's urls; the server rewrites them to its own address when
+replaying, so one server stands in for the API, the gist site and raw files.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The GitHub origins served by the fixture server, longest first so that
+# gist.githubusercontent.com is not rewritten as gist.github.com.
+GITHUB_ORIGINS = ['https://gist.githubusercontent.com', 'https://api.github.com', 'https://gist.github.com']
+
+def make_key(method, url):
+	"""
+	Returns the fixture key of a request: the method, path and sorted query.
+	"""
+	parts = urlsplit(url)
+	query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+	return '%s %s%s'%(method.upper(), parts.path or '/', '?' + query if query else '')
+
+class FixtureSet:
+	"""
+	Responses by request key, loaded from and saved to a fixture directory.
+	"""
+	def __init__(self):
+		self.responses = {}
+
+	def add(self, url, body, status=200, headers=None, method='GET'):
+		if isinstance(body, str):
+			body = body.encode('utf-8')
+		self.responses[make_key(method, url)] = (status, headers or {}, body)
+
+	def add_json(self, url, data, status=200, headers=None):
+		headers = dict(headers or {})
+		headers.setdefault('Content-Type', 'application/json; charset=utf-8')
+		self.add(url, json.dumps(data, separators=(',', ':')), status, headers)
+
+	def __len__(self):
+		return len(self.responses)
+
+	@property
+	def size(self):
+		return sum(len(body) for _, _, body in self.responses.values())
+
+	def save(self, path):
+		os.makedirs(os.path.join(path, 'bodies'), exist_ok=True)
+		index = {}
+		for number, (key, (status, headers, body)) in enumerate(sorted(self.responses.items()), 1):
+			name = 'bodies/%06d'%(number)
+			with open(os.path.join(path, name), 'wb') as f:
+				f.write(body)
+			index[key] = {'status': status, 'headers': headers, 'body': name}
+
+		with open(os.path.join(path, 'index.json'), 'wt', encoding='utf-8') as f:
+			json.dump(index, f, indent=2, sort_keys=True)
+
+	@classmethod
+	def load(cls, path):
+		fixtures = cls()
+		with open(os.path.join(path, 'index.json'), 'rt', encoding='utf-8') as f:
+			index = json.load(f)
+
+		for key, entry in index.items():
+			with open(os.path.join(path, entry['body']), 'rb') as f:
+				fixtures.responses[key] = (entry['status'], entry['headers'], f.read())
+		return fixtures
+
+class FixtureServer:
+	"""
+	Serves a FixtureSet on a local port, optionally adding `latency` seconds to
+	every response. Requests without a fixture get a 404 and are counted in
+	`missing`, so a benchmark can tell when its fixtures are incomplete.
+	"""
+	def __init__(self, fixtures, latency=0.0, host='127.0.0.1', port=0):
+		self.latency = latency
+		self.missing = []
+		self.requests = 0
+
+		server = self
+
+		class Handler(BaseHTTPRequestHandler):
+			protocol_version = 'HTTP/1.1'
+			# Headers and body go out in separate writes; with Nagle's algorithm
+			# each keep-alive response would wait for a delayed ACK.
+			disable_nagle_algorithm = True
+
+			def log_message(self, *args):
+				pass
+
+			def do_GET(self):
+				server.requests += 1
+				if server.latency:
+					time.sleep(server.latency)
+
+				response = server.responses.get(make_key('GET', self.path))
+				if response is None:
+					server.missing.append(self.path)
+					response = (404, {'Content-Type': 'application/json'}, b'{"message":"Not Found"}')
+
+				status, headers, body = response
+				self.send_response(status)
+				for name, value in headers.items():
+					if name.lower() not in ('content-length', 'transfer-encoding', 'content-encoding', 'connection'):
+						self.send_header(name, value)
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+		ThreadingHTTPServer.request_queue_size = 128
+		self.httpd = ThreadingHTTPServer((host, port), Handler)
+		self.httpd.daemon_threads = True
+		self.url = 'http://%s:%s'%(host, self.httpd.server_port)
+
+		self.responses = {}
+		for key, (status, headers, body) in fixtures.responses.items():
+			for origin in GITHUB_ORIGINS:
+				body = body.replace(origin.encode('ascii'), self.url.encode('ascii'))
+			self.responses[key] = (status, headers, body)
+
+		self.thread = None
+
+	def __enter__(self):
+		self.start()
+		return self
+
+	def __exit__(self, *exc):
+		self.stop()
+
+	def start(self):
+		self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+		self.thread.start()
+
+	def stop(self):
+		self.httpd.shutdown()
+		self.httpd.server_close()
+
+def record(out, queries=(), usernames=(), gists_id=(), max_pages=1, token=None):
+	"""
+	Records the responses behind searching for `queries` and retrieving the
+	gists of `usernames` and `gists_id`, raw files included, into `out`.
+	"""
+	import requests
+
+	sys.path.insert(0, ROOT_DIR)
+	from gisthub import API_URL, parse_search_page
+
+	fixtures = FixtureSet()
+	session = requests.Session()
+	api_headers = {'Authorization': 'token %s'%(token)} if token else {}
+
+	def get(url, params=None, headers=None):
+		with session.get(url, params=params, headers=headers, timeout=30) as response:
+			fixtures.add(response.url, response.content, response.status_code, {'Content-Type': response.headers.get('Content-Type', '')})
+			print("[+] Recorded %s %s"%(response.status_code, response.url))
+			return response
+
+	def record_gist_json(gist):
+		for file in (gist.get('files') or {}).values():
+			if file.get('raw_url'):
+				get(file['raw_url'])
+
+	for query in queries:
+		for page in range(1, max_pages + 1):
+			response = get('https://gist.github.com/search', {'ref': 'searchresults', 'q': query, 'p': page})
+			_, links = parse_search_page(response.text)
+			for link in links or []:
+				get('https://gist.github.com' + link + '.json')
+
+	for username in usernames:
+		page = 1
+		while True:
+			response = get(API_URL + '/users/%s/gists'%(username), {'per_page': 100, 'page': page}, api_headers)
+			data = response.json() if response.status_code == 200 else []
+			for gist in data:
+				record_gist_json(gist)
+			if not data:
+				break
+			page += 1
+
+	for gist_id in gists_id:
+		response = get(API_URL + '/gists/%s'%(gist_id), headers=api_headers)
+		if response.status_code == 200:
+			record_gist_json(response.json())
+
+	fixtures.save(out)
+	print("[+] %s response(s) saved to '%s'."%(len(fixtures), out))
+
+def main():
+	parser = argparse.ArgumentParser(description='Records HTTP fixtures for the benchmarks.')
+	subparsers = parser.add_subparsers(dest='command')
+	record_parser = subparsers.add_parser('record', description='Records the responses of GitHub for later replay.')
+	record_parser.add_argument('--out', '-o', required=True, metavar='DIRECTORY', help='specify the fixture directory to write.')
+	record_parser.add_argument('--query', '-q', action='append', default=[], metavar='QUERY', dest='queries', help='specify a search query to record. Repeat the flag to add multiple queries.')
+	record_parser.add_argument('--max-pages', '-M', type=int, default=1, metavar='INTEGER', dest='max_pages', help='specify the number of search pages recorded per query. Default is 1.')
+	record_parser.add_argument('--username', '-u', action='append', default=[], metavar='USERNAME', dest='usernames', help='specify a user whose gists should be recorded. Repeat the flag to add multiple usernames.')
+	record_parser.add_argument('--gist', '-g', action='append', default=[], metavar='GIST_ID', dest='gists_id', help='specify a gist to record. Repeat the flag to add multiple ids.')
+	record_parser.add_argument('--token', '-t', metavar='TOKEN', default=os.environ.get('GITHUB_TOKEN'), help='specify the GitHub token used for API requests. Default is the GITHUB_TOKEN environment variable.')
+	args = parser.parse_args()
+
+	if args.command != 'record':
+		parser.print_usage()
+		return 1
+
+	record(args.out, args.queries, args.usernames, args.gists_id, args.max_pages, args.token)
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
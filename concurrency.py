@@ -0,0 +1,177 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from http_helpers import classify_status
+from metrics import CONCURRENCY_LIMIT
+
+class AIMDController:
+	"""
+	Limits the number of requests in flight to a host and adapts the limit with
+	additive increase, multiplicative decrease (AIMD). Every `limit` healthy
+	completions raise the limit by `increase`; a throttling response (429, 403),
+	a retryable failure or a p95 latency above `latency_factor` times the best
+	p95 seen so far cuts it by `decrease`. Decreases are at most once per
+	`cooldown` seconds, so one burst of failures only counts once.
+
+	The current limit is exposed as `limit`, in `snapshot()` and as the
+	gisthub_concurrency_limit gauge.
+	"""
+	def __init__(self, name='', initial=4, minimum=1, maximum=32, increase=1, decrease=0.5, window=50, latency_factor=2.0, cooldown=1.0):
+		self.name = name
+		self.minimum = minimum
+		self.maximum = maximum
+		self.increase = increase
+		self.decrease = decrease
+		self.latency_factor = latency_factor
+		self.cooldown = cooldown
+		self.window = window
+
+		self._limit = float(max(minimum, min(initial, maximum)))
+		self.in_flight = 0
+		self.successes = 0
+		self.latencies = deque(maxlen=window)
+		self.baseline = None
+		self.last_decrease = 0.0
+
+		self.increases = 0
+		self.decreases = 0
+
+		self.condition = threading.Condition()
+		CONCURRENCY_LIMIT.set(self.limit, host=name)
+
+	@property
+	def limit(self):
+		return int(self._limit)
+
+	def acquire(self):
+		"""
+		Blocks until a request may be made. Returns the start time to pass to `release()`.
+		"""
+		with self.condition:
+			while self.in_flight >= int(self._limit):
+				self.condition.wait()
+			self.in_flight += 1
+		return time.monotonic()
+
+	def release(self, start, status=None, failed=False):
+		"""
+		Records the outcome of a request started at `start` and frees its slot.
+		"""
+		latency = time.monotonic() - start
+
+		with self.condition:
+			self.in_flight -= 1
+			self.latencies.append(latency)
+
+			throttled = status in (403, 429)
+			if failed or throttled or classify_status(status) == 'retry':
+				self._decrease()
+			elif self._latency_degraded():
+				self._decrease()
+			else:
+				self.successes += 1
+				if self.successes >= int(self._limit):
+					self.successes = 0
+					if self._limit < self.maximum:
+						self._limit = min(self.maximum, self._limit + self.increase)
+						self.increases += 1
+						CONCURRENCY_LIMIT.set(self.limit, host=self.name)
+
+			self.condition.notify_all()
+
+	def _latency_degraded(self):
+		if len(self.latencies) < self.window // 2:
+			return False
+
+		p95 = self.p95()
+		if self.baseline is None or p95 < self.baseline:
+			self.baseline = p95
+			return False
+		return p95 > self.baseline * self.latency_factor
+
+	def _decrease(self):
+		now = time.monotonic()
+		self.successes = 0
+		if now - self.last_decrease < self.cooldown:
+			return
+
+		self.last_decrease = now
+		self._limit = max(self.minimum, self._limit * self.decrease)
+		self.decreases += 1
+		CONCURRENCY_LIMIT.set(self.limit, host=self.name)
+		# Latencies measured at the old limit no longer say anything about the new one.
+		self.latencies.clear()
+
+	def p95(self):
+		if not self.latencies:
+			return None
+		ordered = sorted(self.latencies)
+		return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+	def snapshot(self):
+		with self.condition:
+			return {
+				'limit': self.limit,
+				'in_flight': self.in_flight,
+				'p95': self.p95(),
+				'increases': self.increases,
+				'decreases': self.decreases,
+			}
+
+class ConcurrencyControllers:
+	"""
+	One AIMD controller per host, created on first use, so the API, the gist
+	website and raw file downloads each find their own limit.
+	"""
+	def __init__(self, initial=4, maximum=32):
+		self.initial = initial
+		self.maximum = maximum
+		self.controllers = {}
+		self.lock = threading.Lock()
+
+	def get(self, host):
+		controller = self.controllers.get(host)
+		if controller is None:
+			with self.lock:
+				controller = self.controllers.setdefault(host, AIMDController(host, min(self.initial, self.maximum), maximum=self.maximum))
+		return controller
+
+	def for_url(self, url):
+		return self.get(urlsplit(url).hostname or '')
+
+	def snapshot(self):
+		return {host: controller.snapshot() for host, controller in list(self.controllers.items())}
+
+def map_concurrently(func, items, max_workers):
+	"""
+	Calls `func` on every item in `items` from up to `max_workers` threads.
+	Yields (item, result, exception) tuples in the order of `items` as they
+	complete, so results can be consumed while later items are still being
+	worked on. At most twice `max_workers` calls run ahead of the consumer,
+	which keeps the results held in memory bounded. The controllers in front
+	of each request decide how many of the threads actually have a request
+	in flight.
+	"""
+	items = list(items)
+	if max_workers <= 1 or len(items) <= 1:
+		for item in items:
+			yield _call(func, item)
+		return
+
+	with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+		futures = deque()
+		for item in items:
+			futures.append(executor.submit(_call, func, item))
+			if len(futures) >= max_workers * 2:
+				yield futures.popleft().result()
+		while futures:
+			yield futures.popleft().result()
+
+def _call(func, item):
+	try:
+		return item, func(item), None
+	except Exception as e:
+		return item, None, e
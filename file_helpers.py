@@ -0,0 +1,236 @@
+import os
+from urllib.parse import urlsplit
+
+from metrics import DOWNLOADED_BYTES
+
+# Files larger than this are never downloaded; credentials and urls live in
+# small config/script files, not in multi-megabyte dumps.
+MAX_FILE_SIZE = 5 * 1024 * 1024
+
+# Number of bytes sniffed before deciding whether a download is text.
+SNIFF_SIZE = 1024
+
+# Number of bytes read at a time once a download was found to be text.
+READ_SIZE = 64 * 1024
+
+TEXT_EXTENSIONS = {
+	'.txt', '.text', '.md', '.markdown', '.rst', '.csv', '.tsv', '.log',
+	'.json', '.jsonl', '.ndjson', '.geojson', '.yaml', '.yml', '.toml', '.ini', '.cfg', '.conf',
+	'.config', '.env', '.properties', '.xml', '.plist', '.html', '.htm', '.xhtml',
+	'.css', '.scss', '.sass', '.less', '.js', '.mjs', '.cjs', '.jsx', '.ts', '.tsx',
+	'.vue', '.svelte', '.py', '.pyw', '.ipynb', '.rb', '.php', '.pl', '.pm', '.lua',
+	'.java', '.kt', '.kts', '.scala', '.groovy', '.gradle', '.go', '.rs', '.c', '.h',
+	'.cc', '.cpp', '.cxx', '.hpp', '.cs', '.fs', '.swift', '.m', '.r', '.jl', '.dart',
+	'.ex', '.exs', '.erl', '.hs', '.clj', '.elm', '.sql', '.graphql', '.gql',
+	'.sh', '.bash', '.zsh', '.fish', '.ksh', '.ps1', '.psm1', '.bat', '.cmd',
+	'.vim', '.el', '.tf', '.tfvars', '.hcl', '.nix', '.dockerfile', '.mk', '.cmake',
+	'.gitignore', '.gitconfig', '.npmrc', '.netrc', '.htaccess', '.bashrc', '.zshrc',
+	'.profile', '.pem', '.crt', '.key', '.pub', '.asc', '.srt', '.vtt', '.tex', '.bib',
+	'.diff', '.patch', '.svg',
+}
+
+BINARY_EXTENSIONS = {
+	'.png', '.jpg', '.jpeg', '.gif', '.bmp', '.ico', '.webp', '.tif', '.tiff', '.psd',
+	'.heic', '.avif', '.mp3', '.wav', '.ogg', '.flac', '.m4a', '.aac', '.mp4', '.m4v',
+	'.mov', '.avi', '.mkv', '.webm', '.wmv', '.flv', '.zip', '.gz', '.tgz', '.bz2',
+	'.xz', '.zst', '.7z', '.rar', '.tar', '.jar', '.war', '.apk', '.ipa', '.dmg',
+	'.iso', '.img', '.exe', '.dll', '.so', '.dylib', '.o', '.a', '.lib', '.class',
+	'.pyc', '.pyo', '.wasm', '.bin', '.dat', '.db', '.sqlite', '.sqlite3', '.pdf',
+	'.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', '.odt', '.ods', '.odp',
+	'.ttf', '.otf', '.woff', '.woff2', '.eot', '.swf', '.pickle', '.pkl', '.npy',
+	'.npz', '.h5', '.parquet', '.avro', '.onnx', '.pt', '.pth',
+}
+
+TEXT_TYPES = (
+	'text/', 'application/json', 'application/ld+json', 'application/xml',
+	'application/javascript', 'application/x-javascript', 'application/ecmascript',
+	'application/x-sh', 'application/x-shellscript', 'application/x-yaml', 'application/yaml',
+	'application/toml', 'application/x-httpd-php', 'application/x-python',
+	'application/x-ruby', 'application/x-perl', 'application/sql', 'application/graphql',
+	'application/x-ipynb+json', 'application/x-x509-ca-cert', 'application/pgp-keys',
+	'image/svg+xml',
+)
+
+BINARY_TYPES = (
+	'image/', 'audio/', 'video/', 'font/', 'application/zip', 'application/gzip',
+	'application/x-gzip', 'application/x-tar', 'application/x-bzip2', 'application/x-xz',
+	'application/x-7z-compressed', 'application/x-rar', 'application/vnd.rar',
+	'application/pdf', 'application/octet-stream', 'application/x-executable',
+	'application/x-sharedlib', 'application/x-mach-binary', 'application/x-msdownload',
+	'application/java-archive', 'application/wasm', 'application/vnd.',
+	'application/msword', 'application/x-sqlite3',
+)
+
+# Leading bytes of common binary formats.
+MAGIC_SIGNATURES = (
+	b'\x89PNG\r\n\x1a\n', b'\xff\xd8\xff', b'GIF87a', b'GIF89a', b'II*\x00',
+	b'MM\x00*', b'RIFF', b'OggS', b'fLaC', b'ID3', b'\x00\x00\x00\x18ftyp',
+	b'\x00\x00\x00\x20ftyp', b'\x1aE\xdf\xa3', b'PK\x03\x04', b'PK\x05\x06', b'\x1f\x8b',
+	b'BZh', b'\xfd7zXZ\x00', b'(\xb5/\xfd', b"7z\xbc\xaf'\x1c", b'Rar!\x1a\x07',
+	b'%PDF-', b'\x7fELF', b'MZ', b'\xca\xfe\xba\xbe', b'\xcf\xfa\xed\xfe',
+	b'\xce\xfa\xed\xfe', b'\x00asm', b'SQLite format 3\x00', b'wOFF', b'wOF2',
+	b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1',
+)
+
+# Byte-order marks which identify a text file regardless of later content.
+TEXT_BOMS = (b'\xef\xbb\xbf', b'\xff\xfe', b'\xfe\xff')
+
+_CONTROL_BYTES = bytes(set(range(32)) - {7, 8, 9, 10, 12, 13, 27})
+
+def get_extension(filename):
+	"""
+	Returns the lowercased extension of `filename`. Dotfiles such as `.bashrc`
+	are treated as their own extension.
+	@param filename: the name of the file
+	@type filename: str
+	@rtype str
+	"""
+	if not filename:
+		return ''
+
+	filename = filename.lower()
+	root, ext = os.path.splitext(filename)
+	if not ext and root.startswith('.'):
+		ext = root
+	return ext
+
+def is_text_type(ftype):
+	"""
+	Returns True if the mime type `ftype` is text-like, False if it is binary and None if unknown.
+	@param ftype: the mime type of the file
+	@type ftype: str
+	@rtype bool
+	"""
+	if not ftype:
+		return None
+
+	ftype = ftype.split(';', 1)[0].strip().lower()
+	if ftype.startswith(TEXT_TYPES) or ftype.endswith(('+json', '+xml')):
+		return True
+	elif ftype.startswith(BINARY_TYPES):
+		return False
+	return None
+
+def is_text_candidate(filename=None, ftype=None, language=None, size=None, strict=True, max_size=MAX_FILE_SIZE):
+	"""
+	Returns True if the gist file described by the metadata is worth downloading, otherwise False.
+	A file is a candidate when its size is within `max_size` and its language, extension or,
+	failing those, its mime type marks it as text. With `strict` set to False, files with no
+	conclusive metadata are also accepted and left to `looks_binary()` to reject.
+	@param filename: the name of the file
+	@type filename: str
+	@param ftype: the mime type reported for the file
+	@type ftype: str
+	@param language: the language reported for the file
+	@type language: str
+	@param size: the size of the file in bytes
+	@type size: int
+	@param strict: specifies if files with unknown metadata should be skipped. The default is True
+	@type strict: bool
+	@param max_size: the largest file size to accept
+	@type max_size: int
+	@rtype bool
+	"""
+	if size is not None and max_size and size > max_size:
+		return False
+
+	ext = get_extension(filename)
+	if ext in BINARY_EXTENSIONS:
+		return False
+
+	if language or ext in TEXT_EXTENSIONS:
+		return True
+
+	text_type = is_text_type(ftype)
+	if text_type is None:
+		return not strict
+	return text_type
+
+def looks_binary(chunk):
+	"""
+	Returns True if the leading bytes in `chunk` belong to a binary file, otherwise False.
+	@param chunk: the first bytes of the file
+	@type chunk: bytes
+	@rtype bool
+	"""
+	if not chunk:
+		return False
+
+	if chunk.startswith(TEXT_BOMS):
+		return False
+
+	if chunk.startswith(MAGIC_SIGNATURES):
+		return True
+
+	if b'\x00' in chunk:
+		return True
+
+	control = len(chunk) - len(chunk.translate(None, _CONTROL_BYTES))
+	return control * 10 > len(chunk)
+
+class DownloadError(Exception):
+	"""
+	Raised when a file could not be downloaded, as opposed to being skipped as
+	binary or too large.
+	"""
+	def __init__(self, url, status):
+		super().__init__("Downloading '%s' failed with status %s."%(url, status))
+		self.url = url
+		self.status = status
+
+def download_text(session, url, timeout=None, max_size=MAX_FILE_SIZE, chunk_size=SNIFF_SIZE):
+	"""
+	Returns the content at `url` as text, or None if it is binary or larger than `max_size`.
+	Raises DownloadError if the response is not a 200 once retries are exhausted. The
+	response is streamed and the connection dropped as soon as the first chunk is found to
+	be binary. The bytes read, kept or not, are counted in the gisthub_downloaded_bytes_total
+	metric.
+	@param session: the session to make the request with
+	@type session: requests.Session
+	@param url: the url of the raw file
+	@type url: str
+	@param timeout: the request timeout in seconds
+	@type timeout: float
+	@param max_size: the largest number of bytes to read
+	@type max_size: int
+	@param chunk_size: the number of bytes sniffed for binary content
+	@type chunk_size: int
+	@rtype str
+	"""
+	with session.get(url, timeout=timeout, stream=True) as response:
+		if response.status_code != 200:
+			raise DownloadError(url, response.status_code)
+
+		if is_text_type(response.headers.get('Content-Type')) is False:
+			return None
+
+		length = response.headers.get('Content-Length')
+		if max_size and length and length.isdigit() and int(length) > max_size:
+			return None
+
+		# Only `chunk_size` bytes are read until the content was sniffed, so
+		# binaries are dropped after the first chunk rather than a full read.
+		data = bytearray()
+		sniffed = False
+		try:
+			while True:
+				chunk = response.raw.read(READ_SIZE if sniffed else chunk_size - len(data), decode_content=True)
+				if not chunk:
+					break
+				data.extend(chunk)
+				if not sniffed and len(data) >= chunk_size:
+					if looks_binary(bytes(data[:chunk_size])):
+						return None
+					sniffed = True
+				if max_size and len(data) > max_size:
+					return None
+		finally:
+			DOWNLOADED_BYTES.inc(len(data), host=urlsplit(url).hostname or '')
+
+		if not sniffed and looks_binary(bytes(data)):
+			return None
+
+		encoding = 'utf-8'
+		if 'charset=' in response.headers.get('Content-Type', ''):
+			encoding = response.encoding or encoding
+		return data.decode(encoding, errors='replace')
@@ -2,17 +2,32 @@ import argparse
 import json
 import os
 import re
+import threading
 import time
-from urllib.parse import urlparse
-
-import github
-import phonenumbers
-import requests
-from bs4 import BeautifulSoup as BS
-
+from functools import lru_cache
+from urllib.parse import urlparse, urlsplit
+
+# github, phonenumbers, requests and bs4 are imported where they are first
+# needed, so that --help, query and other light runs start quickly.
+
+from concurrency import ConcurrencyControllers, map_concurrently
+from file_helpers import MAX_FILE_SIZE, download_text, is_text_candidate
+from graphql_helpers import GRAPHQL_ENDPOINT, GraphQLGistFetcher, split_gist_id
+from http_helpers import CircuitBreakers, RetryPolicy, create_session, record_rate_limit
+from io_helpers import COMPRESSIONS, batched, open_output, read_batches, save_json
+from metrics import (CACHE_LOOKUPS, DOWNLOADED_BYTES, EXTRACT_SECONDS, ITEMS, REGISTRY,
+                     REQUESTS, STAGE_SECONDS, MetricsWriter)
+from profiling import Profiler, profile_stage, set_profiler
+from progress import ProgressReporter
+from records import GistRecord, encode_record
+from seen_set import SeenWindow, open_seen_set
+from sinks import CollectSink, JsonLinesSink
+from storage import ArtifactStore
+from work_queue import decode_search_shard, encode_search_shard, get_worker_id, open_queue
 from web_helpers import (get_protocol, get_url_info, is_domain, is_ip,
-                         is_subdomain, is_valid_domain)
+                         is_subdomain, is_valid_domain, normalize_url)
 
+API_URL = "https://api.github.com"
 
 def extract_emails(text):
 	
@@ -30,6 +45,8 @@ def extract_emails(text):
 	return list(set(result))
 
 def extract_phonenumbers(text, region=None):
+	import phonenumbers
+
 	phone_numbers = set()
 
 	for match in phonenumbers.PhoneNumberMatcher(text, region, leniency=0):
@@ -80,43 +97,92 @@ def canonicalize_urls(urls, default_scheme='http'):
 		if not url:
 			continue
 
-		if url.startswith('//'):
-			url = default_scheme + ':' + url
-		elif url.startswith('://'):
-			url = default_scheme + url
-		elif urlparse(url).scheme:
-			pass
-		else:
-			url = default_scheme + ':' + '//' + url
+		url = normalize_url(url, default_scheme)
+		if url:
+			_urls.add(url)
+
+	return list(_urls)
+
+@lru_cache(maxsize=65536)
+def is_valid_host(host):
+	"""
+	Returns True if `host` is an ip address or a domain with a valid TLD.
+	Results are cached since the same hosts recur across files.
+	"""
+	if is_ip(host):
+		return True
+	return bool(is_domain(host) and is_valid_domain(host))
+
+def normalize_urls(urls, default_scheme='http'):
+	"""
+	Returns the distinct normalized forms of the candidates in `urls`, as found by
+	`extract_urls()`, whose host is an ip address or a valid domain. This does the
+	work of `process_urls()` and `canonicalize_urls()` in a single pass, and
+	variants of a url which only differ in case, default port, trailing dots or
+	percent-encoding collapse to one entry.
+	"""
+	_urls = set()
+	for url in urls:
+		if not url:
+			continue
+
+		url = normalize_url(url.strip().strip('.'), default_scheme)
+		if not url or url in _urls:
+			continue
 
-		_urls.add(url)
+		host = urlsplit(url).hostname
+		if host and is_valid_host(host):
+			_urls.add(url)
 
 	return list(_urls)
 
 def get_cmd_args():
 
-	subcommands = ['user', 'gist', 'search']
+	subcommands = ['user', 'gist', 'search', 'query', 'coordinator', 'worker', 'watch']
 	parser = argparse.ArgumentParser()
 	subparsers = parser.add_subparsers(title="subcommands", description="The available subcommands are listed below.", metavar=", ".join(subcommands), dest="subcommand")
 
 	#========start user_parser ============
 	user_parser = subparsers.add_parser('user', description='This subcommands performs user-related activities.')
 	user_parser.add_argument('--username', '-u', action='append', default=[], metavar='USERNAME', dest='usernames', help='specify the username of the users whose gists should be retrieved. Repeat the flag to add multiple usernames.')
-	user_parser.add_argument('--username-list', '-L', metavar='USERNAMES_FILE', help='specify the file containing usernames.', dest='username_file')
+	user_parser.add_argument('--username-list', '-L', metavar='USERNAMES_FILE', help='specify the file containing usernames. The file may be gzipped, use - to read from stdin.', dest='username_file')
+	user_parser.add_argument('--batch-size', metavar='INTEGER', type=int, default=100, dest='batch_size', help='specify the number of usernames read from the file per batch. Default is 100.')
 	user_parser.add_argument('--maximum', '-m', metavar='INTEGER', type=int, dest='maximum', default=100, help='specify the maximum number of gists to retrieve. Default is 100.')
 	user_parser.add_argument('--save', '-s', metavar='FILE', dest='save', help='specify the file to save the retrieved gists. Format is JSON.')
 	user_parser.add_argument('--save-id', metavar='FILE', dest='save_id', help='specify the file(flat) to save the ids(s) only. Format is TXT')
 	user_parser.add_argument('--save-metadata', '-S', metavar='FILE', dest='save_metadata', help='specify the file to save the metadata of the gists. Format is JSON')
+	user_parser.add_argument('--compression', '-z', metavar='CODEC', choices=COMPRESSIONS, default='auto', dest='compression', help='specify the compression of the saved files, one of %s. Default is auto, which picks gzip for .gz and zstd for .zst files.'%(', '.join(COMPRESSIONS)))
+	user_parser.add_argument('--pretty', action='store_true', dest='pretty', help='specify that saved JSON should be indented rather than compact.')
+	user_parser.add_argument('--store', metavar='FILE', dest='store', help='specify the SQLite file to write the gists and extracted artifacts to as they are retrieved. Existing stores are appended to.')
+	user_parser.add_argument('--seen', metavar='FILE', dest='seen', help='specify the file, or a redis:// url shared by several nodes, recording the gists processed by previous runs. Gists found in it are skipped and processed gists are added to it.')
+	user_parser.add_argument('--max-concurrency', metavar='INTEGER', type=int, default=16, dest='max_concurrency', help='specify the highest number of requests in flight to one host. The actual number adapts to the host\'s latency and errors. Default is 16.')
+	user_parser.add_argument('--metrics', metavar='FILE', dest='metrics', help='specify the file to write metrics to: request counts and latencies by host, bytes downloaded, cache hits and time per stage and extractor. Written as Prometheus text for .prom files, as JSON otherwise.')
+	user_parser.add_argument('--metrics-interval', metavar='SECONDS', type=float, default=60, dest='metrics_interval', help='specify the seconds between metrics writes. Default is 60, 0 writes them once on exit.')
+	user_parser.add_argument('--profile', metavar='FILE', dest='profile', help='specify the file to write a profile of the run to: CPU profiles, wall and CPU time of every stage and the memory peak. Format is JSON, compare two with profiling.py. Slows the run down.')
+	user_parser.add_argument('--progress', action='store_true', dest='progress', help='specify that progress should be reported on stderr: users done, gists and bytes per second, requests in flight, rate limit left and ETA. Shown as a status line on a terminal, as a log line every 30 seconds otherwise.')
 	user_parser.add_argument('--verbose','-v',default=0, action='count',help='specify the verbosity of the program.', dest='verbosity')
 	#========end user_parser ============
 	
 	#========start gist_parser ============
 	gist_parser = subparsers.add_parser('gist', description='This subcommands performs gist-related activities.')
-	gist_parser.add_argument('--gists', '-g', action='append', default=[], metavar='GIST_ID', dest='gists_id', help='specify the gist ids of the gist that should be retrieved. Repeat the flag to add multiple ids.')
-	gist_parser.add_argument('--gist-list', '-L', metavar='GISTS_FILE', help='specify the file containing gist ids.', dest='gist_file')
+	gist_parser.add_argument('--gists', '-g', action='append', default=[], metavar='GIST_ID', dest='gists_id', help='specify the gist ids of the gist that should be retrieved, optionally as OWNER/GIST_ID. Repeat the flag to add multiple ids.')
+	gist_parser.add_argument('--gist-list', '-L', metavar='GISTS_FILE', help='specify the file containing gist ids, optionally as OWNER/GIST_ID. The file may be gzipped, use - to read from stdin.', dest='gist_file')
+	gist_parser.add_argument('--graphql', action='store_true', dest='graphql', help='specify that OWNER/GIST_ID entries should be fetched in batches over the GraphQL API, with the contents of small files. Other entries and large files are fetched over REST. Requires a token.')
+	gist_parser.add_argument('--graphql-endpoint', metavar='URL', default=GRAPHQL_ENDPOINT, dest='graphql_endpoint', help='specify the GraphQL endpoint. Default is %s.'%(GRAPHQL_ENDPOINT))
+	gist_parser.add_argument('--token', '-t', metavar='TOKEN', default=os.environ.get('GITHUB_TOKEN'), dest='token', help='specify the GitHub token used for API requests. Default is the GITHUB_TOKEN environment variable.')
+	gist_parser.add_argument('--batch-size', metavar='INTEGER', type=int, default=100, dest='batch_size', help='specify the number of gist ids read from the file per batch. Default is 100.')
 	gist_parser.add_argument('--maximum', '-m', metavar='INTEGER', type=int, default=0, dest='maximum', help='specify the maximum number of gists to retrieve. Default is 0(which means all gists in the user\'s timeline).')
 	gist_parser.add_argument('--save', '-s', metavar='FILE', dest='save', help='specify the file to save the retrieved gists. Format is JSON.')
 	gist_parser.add_argument('--save-metadata', metavar='FILE', dest='save_metadata', help='specify the file to save the metadata. Format is JSON')
+	gist_parser.add_argument('--compression', '-z', metavar='CODEC', choices=COMPRESSIONS, default='auto', dest='compression', help='specify the compression of the saved files, one of %s. Default is auto, which picks gzip for .gz and zstd for .zst files.'%(', '.join(COMPRESSIONS)))
+	gist_parser.add_argument('--pretty', action='store_true', dest='pretty', help='specify that saved JSON should be indented rather than compact.')
+	gist_parser.add_argument('--store', metavar='FILE', dest='store', help='specify the SQLite file to write the gists and extracted artifacts to as they are retrieved. Existing stores are appended to.')
+	gist_parser.add_argument('--seen', metavar='FILE', dest='seen', help='specify the file, or a redis:// url shared by several nodes, recording the gists processed by previous runs. Gists found in it are skipped and processed gists are added to it.')
+	gist_parser.add_argument('--max-concurrency', metavar='INTEGER', type=int, default=16, dest='max_concurrency', help='specify the highest number of requests in flight to one host. The actual number adapts to the host\'s latency and errors. Default is 16.')
+	gist_parser.add_argument('--metrics', metavar='FILE', dest='metrics', help='specify the file to write metrics to: request counts and latencies by host, bytes downloaded, cache hits and time per stage and extractor. Written as Prometheus text for .prom files, as JSON otherwise.')
+	gist_parser.add_argument('--metrics-interval', metavar='SECONDS', type=float, default=60, dest='metrics_interval', help='specify the seconds between metrics writes. Default is 60, 0 writes them once on exit.')
+	gist_parser.add_argument('--profile', metavar='FILE', dest='profile', help='specify the file to write a profile of the run to: CPU profiles, wall and CPU time of every stage and the memory peak. Format is JSON, compare two with profiling.py. Slows the run down.')
+	gist_parser.add_argument('--progress', action='store_true', dest='progress', help='specify that progress should be reported on stderr: gists done, gists and bytes per second, requests in flight, rate limit left and ETA. Shown as a status line on a terminal, as a log line every 30 seconds otherwise.')
 	gist_parser.add_argument('--verbose','-v', default=0, action='count',help='specify the verbosity of the program.',dest='verbosity')
 	#========end gist_parser ============
 
@@ -133,31 +199,236 @@ def get_cmd_args():
 	search_parser.add_argument('--save', '-s', metavar='FILE', dest='save', help='specify the file to save the retrieved gists. Format is JSON.')
 	search_parser.add_argument('--save-usernames', metavar='FILE', dest='save_usernames', help='specify the file(flat) to save the usernames of users who authored the gists. Format is TXT.')
 	search_parser.add_argument('--save-metadata', '-S', metavar='FILE', dest='save_metadata', help='specify the file to save the metadata. Format is JSON.')
+	search_parser.add_argument('--compression', '-z', metavar='CODEC', choices=COMPRESSIONS, default='auto', dest='compression', help='specify the compression of the saved files, one of %s. Default is auto, which picks gzip for .gz and zstd for .zst files.'%(', '.join(COMPRESSIONS)))
+	search_parser.add_argument('--pretty', action='store_true', dest='pretty', help='specify that saved JSON should be indented rather than compact.')
+	search_parser.add_argument('--store', metavar='FILE', dest='store', help='specify the SQLite file to write the gists and extracted artifacts to as they are retrieved. Existing stores are appended to.')
+	search_parser.add_argument('--seen', metavar='FILE', dest='seen', help='specify the file, or a redis:// url shared by several nodes, recording the gists processed by previous runs. Gists found in it are skipped and processed gists are added to it.')
+	search_parser.add_argument('--max-concurrency', metavar='INTEGER', type=int, default=16, dest='max_concurrency', help='specify the highest number of requests in flight to one host. The actual number adapts to the host\'s latency and errors. Default is 16.')
+	search_parser.add_argument('--metrics', metavar='FILE', dest='metrics', help='specify the file to write metrics to: request counts and latencies by host, bytes downloaded, cache hits and time per stage and extractor. Written as Prometheus text for .prom files, as JSON otherwise.')
+	search_parser.add_argument('--metrics-interval', metavar='SECONDS', type=float, default=60, dest='metrics_interval', help='specify the seconds between metrics writes. Default is 60, 0 writes them once on exit.')
+	search_parser.add_argument('--profile', metavar='FILE', dest='profile', help='specify the file to write a profile of the run to: CPU profiles, wall and CPU time of every stage and the memory peak. Format is JSON, compare two with profiling.py. Slows the run down.')
 	search_parser.add_argument('--verbose','-v', default=0, action='count', help='specify the verbosity of the program.',dest='verbosity')
 	#========end search_parser ============
 
+	#========start query_parser ============
+	query_parser = subparsers.add_parser('query', description='This subcommands looks up artifacts in a store written by the other subcommands.')
+	query_parser.add_argument('--store', required=True, metavar='FILE', dest='store', help='specify the SQLite store to query.')
+	query_group = query_parser.add_mutually_exclusive_group(required=True)
+	query_group.add_argument('--email', '-e', metavar='EMAIL', dest='email', help='find gists mentioning an email address, or any address at a domain e.g. @example.com or *.example.com.')
+	query_group.add_argument('--url', '-U', metavar='HOST', dest='url', help='find gists mentioning urls on a host e.g. example.com, or *.example.com to include subdomains.')
+	query_group.add_argument('--phone', '-P', metavar='PHONE_NUMBER', dest='phone', help='find gists mentioning a phone number.')
+	query_group.add_argument('--owner', '-O', metavar='USERNAME', dest='owner', help='list the artifacts found in the gists of a user.')
+	query_parser.add_argument('--verbose','-v', default=0, action='count', help='specify the verbosity of the program.',dest='verbosity')
+	#========end query_parser ============
+
+	#========start coordinator_parser ============
+	coordinator_parser = subparsers.add_parser('coordinator', description='This subcommands loads usernames, gist ids or search pages into a work queue shared by workers.')
+	coordinator_parser.add_argument('--queue', '-Q', required=True, metavar='QUEUE', dest='queue', help='specify the queue, either a SQLite file or a redis:// url.')
+	coordinator_parser.add_argument('--username', '-u', action='append', default=[], metavar='USERNAME', dest='usernames', help='specify a username to queue. Repeat the flag to add multiple usernames.')
+	coordinator_parser.add_argument('--username-list', metavar='USERNAMES_FILE', dest='username_file', help='specify the file containing usernames to queue. The file may be gzipped, use - to read from stdin.')
+	coordinator_parser.add_argument('--gists', '-g', action='append', default=[], metavar='GIST_ID', dest='gists_id', help='specify a gist id to queue. Repeat the flag to add multiple ids.')
+	coordinator_parser.add_argument('--gist-list', metavar='GISTS_FILE', dest='gist_file', help='specify the file containing gist ids to queue. The file may be gzipped, use - to read from stdin.')
+	coordinator_parser.add_argument('--query', '-q', metavar='QUERY', dest='query', help='specify a search query to queue, one item per results page.')
+	coordinator_parser.add_argument('--language', '-l', metavar='LANGUAGE', dest='language', help='specify the language of the searched gists.')
+	coordinator_parser.add_argument('--sort', '-x', metavar='SORT', dest='sort', choices=['stars', 'forks', 'updated'], help='specify the way to sort the search result.')
+	coordinator_parser.add_argument('--order', '-o', metavar='ORDER', dest='order', choices=['asc', 'desc'], help='specify the order of the sort.')
+	coordinator_parser.add_argument('--page', '-p', metavar='INTEGER', type=int, default=1, dest='page', help='specify the first search page to queue. Default is 1.')
+	coordinator_parser.add_argument('--max-pages', '-M', metavar='INTEGER', type=int, default=100, dest='maximum_pages', help='specify the number of search pages to queue. Default is 100.')
+	coordinator_parser.add_argument('--batch-size', metavar='INTEGER', type=int, default=1000, dest='batch_size', help='specify the number of entries read from the files per batch. Default is 1000.')
+	coordinator_parser.add_argument('--verbose','-v', default=0, action='count', help='specify the verbosity of the program.',dest='verbosity')
+	#========end coordinator_parser ============
+
+	#========start worker_parser ============
+	worker_parser = subparsers.add_parser('worker', description='This subcommands processes items from a work queue filled by a coordinator.')
+	worker_parser.add_argument('--queue', '-Q', required=True, metavar='QUEUE', dest='queue', help='specify the queue, either a SQLite file or a redis:// url.')
+	worker_parser.add_argument('--lease', metavar='SECONDS', type=int, default=300, dest='lease', help='specify how long an item is leased before it is handed to another worker. Default is 300.')
+	worker_parser.add_argument('--batch-size', metavar='INTEGER', type=int, default=10, dest='batch_size', help='specify the number of items leased at once. Default is 10.')
+	worker_parser.add_argument('--max-attempts', metavar='INTEGER', type=int, default=5, dest='max_attempts', help='specify the number of times an item is attempted before it is marked as failed. Default is 5.')
+	worker_parser.add_argument('--retry-delay', metavar='SECONDS', type=int, default=30, dest='retry_delay', help='specify how long a failed item waits before it is retried, doubled on every attempt. Default is 30.')
+	worker_parser.add_argument('--maximum', '-m', metavar='INTEGER', type=int, dest='maximum', default=100, help='specify the maximum number of gists to retrieve per user. Default is 100.')
+	worker_parser.add_argument('--wait', '-w', action='store_true', dest='wait', help='specify that the worker should keep polling for new items once the queue is drained.')
+	worker_parser.add_argument('--save-metadata', '-S', metavar='FILE', dest='save_metadata', help='specify the file to save the metadata of the processed gists. Format is JSON.')
+	worker_parser.add_argument('--compression', '-z', metavar='CODEC', choices=COMPRESSIONS, default='auto', dest='compression', help='specify the compression of the saved files, one of %s. Default is auto, which picks gzip for .gz and zstd for .zst files.'%(', '.join(COMPRESSIONS)))
+	worker_parser.add_argument('--pretty', action='store_true', dest='pretty', help='specify that saved JSON should be indented rather than compact.')
+	worker_parser.add_argument('--store', metavar='FILE', dest='store', help='specify the SQLite file to write the gists and extracted artifacts to as they are retrieved. Existing stores are appended to.')
+	worker_parser.add_argument('--seen', metavar='FILE', dest='seen', help='specify the file, or a redis:// url shared by several nodes, recording the gists processed by previous runs. Gists found in it are skipped and processed gists are added to it.')
+	worker_parser.add_argument('--max-concurrency', metavar='INTEGER', type=int, default=16, dest='max_concurrency', help='specify the highest number of requests in flight to one host. The actual number adapts to the host\'s latency and errors. Default is 16.')
+	worker_parser.add_argument('--metrics', metavar='FILE', dest='metrics', help='specify the file to write metrics to: request counts and latencies by host, bytes downloaded, cache hits and time per stage and extractor. Written as Prometheus text for .prom files, as JSON otherwise.')
+	worker_parser.add_argument('--metrics-interval', metavar='SECONDS', type=float, default=60, dest='metrics_interval', help='specify the seconds between metrics writes. Default is 60, 0 writes them once on exit.')
+	worker_parser.add_argument('--profile', metavar='FILE', dest='profile', help='specify the file to write a profile of the run to: CPU profiles, wall and CPU time of every stage and the memory peak. Format is JSON, compare two with profiling.py. Slows the run down.')
+	worker_parser.add_argument('--progress', action='store_true', dest='progress', help='specify that progress should be reported on stderr: items done, gists and bytes per second, requests in flight, rate limit left. Shown as a status line on a terminal, as a log line every 30 seconds otherwise.')
+	worker_parser.add_argument('--verbose','-v', default=0, action='count', help='specify the verbosity of the program.',dest='verbosity')
+	#========end worker_parser ============
+
+	#========start watch_parser ============
+	watch_parser = subparsers.add_parser('watch', description='This subcommands polls the public gists, and optionally the gists of some users, and processes new gists as they appear.')
+	watch_parser.add_argument('--username', '-u', action='append', default=[], metavar='USERNAME', dest='usernames', help='specify a user whose gists should be watched as well. Repeat the flag to add multiple usernames.')
+	watch_parser.add_argument('--username-list', '-L', metavar='USERNAMES_FILE', dest='username_file', help='specify the file containing the usernames to watch. The file may be gzipped, use - to read from stdin.')
+	watch_parser.add_argument('--no-public', action='store_false', dest='public', help='specify that the public gists should not be watched, only the given users.')
+	watch_parser.add_argument('--interval', '-i', metavar='SECONDS', type=float, default=60, dest='interval', help='specify the seconds between polls, unless the API asks for longer. Default is 60.')
+	watch_parser.add_argument('--max-pages', '-M', metavar='INTEGER', type=int, default=3, dest='maximum_pages', help='specify the number of pages read per poll to catch up when every gist on a page is new. Default is 3.')
+	watch_parser.add_argument('--window', metavar='INTEGER', type=int, default=10000, dest='window', help='specify the number of recently processed gists remembered to drop repeats between polls. Default is 10000.')
+	watch_parser.add_argument('--max-polls', metavar='INTEGER', type=int, default=0, dest='max_polls', help='specify the number of polls after which to stop. Default is 0(which means watch until interrupted).')
+	watch_parser.add_argument('--output', '-o', metavar='FILE', dest='output', help='specify the file to append the metadata of every processed gist to, one JSON object per line.')
+	watch_parser.add_argument('--compression', '-z', metavar='CODEC', choices=COMPRESSIONS, default='auto', dest='compression', help='specify the compression of the output file, one of %s. Default is auto, which picks gzip for .gz and zstd for .zst files.'%(', '.join(COMPRESSIONS)))
+	watch_parser.add_argument('--store', metavar='FILE', dest='store', help='specify the SQLite file to write the gists and extracted artifacts to as they are retrieved. Existing stores are appended to.')
+	watch_parser.add_argument('--seen', metavar='FILE', dest='seen', help='specify the file, or a redis:// url shared by several nodes, recording the gists processed by previous runs. Gists found in it are skipped and processed gists are added to it.')
+	watch_parser.add_argument('--token', '-t', metavar='TOKEN', default=os.environ.get('GITHUB_TOKEN'), dest='token', help='specify the GitHub token used for API requests. Default is the GITHUB_TOKEN environment variable.')
+	watch_parser.add_argument('--api-url', metavar='URL', default=API_URL, dest='api_url', help='specify the base url of the API. Default is %s.'%(API_URL))
+	watch_parser.add_argument('--max-concurrency', metavar='INTEGER', type=int, default=16, dest='max_concurrency', help='specify the highest number of requests in flight to one host. The actual number adapts to the host\'s latency and errors. Default is 16.')
+	watch_parser.add_argument('--metrics', metavar='FILE', dest='metrics', help='specify the file to write metrics to: request counts and latencies by host, bytes downloaded, cache hits and time per stage and extractor. Written as Prometheus text for .prom files, as JSON otherwise.')
+	watch_parser.add_argument('--metrics-interval', metavar='SECONDS', type=float, default=60, dest='metrics_interval', help='specify the seconds between metrics writes. Default is 60, 0 writes them once on exit.')
+	watch_parser.add_argument('--profile', metavar='FILE', dest='profile', help='specify the file to write a profile of the run to: CPU profiles, wall and CPU time of every stage and the memory peak. Format is JSON, compare two with profiling.py. Slows the run down.')
+	watch_parser.add_argument('--progress', action='store_true', dest='progress', help='specify that progress should be reported on stderr: polls done, gists and bytes per second, requests in flight, rate limit left. Shown as a status line on a terminal, as a log line every 30 seconds otherwise.')
+	watch_parser.add_argument('--verbose','-v', default=0, action='count', help='specify the verbosity of the program.',dest='verbosity')
+	#========end watch_parser ============
+
 	args = parser.parse_args()
 	return parser, args
 
-class GGist(github.Gist.Gist):
-	def __init__(self, *args, **kwargs):
-		super().__init__(*args, **kwargs)
+def parse_search_page(html):
+	"""
+	Parses a gist search results page. Returns the number of results, or None
+	for a page without results, and the links of the gists on the page, or None
+	if the results count was not numeric.
+	"""
+	from bs4 import BeautifulSoup as BS
+
+	soup = BS(html, features='html.parser')
+	info_text = soup.select_one('div.gutter div div h3 div.d-flex h3')
+	if not info_text:
+		return None, None
+
+	sections = info_text.text.strip().split(" ")
+	if not (sections and sections[0].isnumeric()):
+		return 0, None
+
+	links = []
+	for gist in soup.select("div main div div.repository-content div.gutter div .gist-snippet"):
+		gist_link = gist.select_one("div.gist-snippet-meta ul li.d-inline-block a")
+		if gist_link:
+			gist_link = gist_link.attrs.get('href')
+			if gist_link:
+				links.append(gist_link)
+	return int(sections[0]), links
+
+def parse_gist_html(html):
+	"""
+	Parses the `div` of a gist's .json view. Returns the texts of its files and
+	the links to them.
+	"""
+	from bs4 import BeautifulSoup as BS
+
+	soup = BS(html, features='html.parser')
+
+	texts = []
+	for content in soup.select("div.gist div.gist-file div.gist-data"):
+		content_data = content.select_one('div.file')
+		if content_data:
+			texts.append(content_data.text)
+
+	links = []
+	for m in soup.select('div.gist-meta'):
+		file_link = m.select_one('a')
+		if file_link:
+			links.append(file_link.attrs.get('href'))
+	return texts, links
 
 class Gist:
-	def __init__(self, timeout=10):
-		
-		self.g = github.Github()
+	def __init__(self, timeout=10, policy=None, max_concurrency=16, token=None, api_url=API_URL):
+		import github
+
+		# Every request path shares one retry policy and one set of per-host circuit breakers.
+		self.policy = policy or RetryPolicy(timeout=timeout)
+		self.breakers = CircuitBreakers()
+		self.api_breaker = self.breakers.for_url(api_url)
+
+		# Requests in flight to each host are limited by an adaptive controller.
+		self.max_concurrency = max(1, max_concurrency)
+		self.controllers = ConcurrencyControllers(maximum=self.max_concurrency)
+		self.api_controller = self.controllers.for_url(api_url)
+
+		self.token = token
+		self.api_url = api_url.rstrip('/')
 		self.gist_search_url = "https://gist.github.com"
 		
-		self.session = requests.Session()
-		self.session.headers.update({'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0.3729.169 Safari/537.36'})
+		self.session = create_session(self.policy, self.breakers, 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0.3729.169 Safari/537.36',
+			self.max_concurrency, self.controllers)
+
+		self.api_session = create_session(self.policy, self.breakers, pool_size=self.max_concurrency, controllers=self.controllers)
 
 		self.timeout = timeout
 
-		self.requester = github.Requester.Requester(None, None, None, "https://api.github.com", 15, "PyGithub/Python", 30, True, None, None)
+		# A Requester keeps the request it is making on its connection, so
+		# threads calling the API concurrently each need their own.
+		self.local = threading.local()
 
-	def search(self, query=None, page=None, language=None, sort=None, order=None, max_gists=None, max_pages=None, verbosity=0):
+	@property
+	def requester(self):
+		"""
+		The PyGithub Requester of the calling thread.
+		"""
+		requester = getattr(self.local, 'requester', None)
+		if requester is None:
+			import github
+			requester = self.local.requester = github.Requester.Requester(self.token, None, None, self.api_url, 15, "PyGithub/Python", 30, True, self.policy.urllib3_retry(), None)
+		return requester
+
+	def create_session(self):
+		"""
+		Returns a new session for raw file downloads, sharing the retry policy,
+		circuit breakers and concurrency controllers.
 		"""
+		return create_session(self.policy, self.breakers, pool_size=self.max_concurrency, controllers=self.controllers)
+
+	def create_progress(self, total=None, unit='items'):
+		"""
+		Returns a ProgressReporter following this client's requests in flight
+		and API rate limit.
+		"""
+		return ProgressReporter(total, unit, self.controllers, self.api_breaker.host)
+
+	def map(self, func, items):
+		"""
+		Calls `func` on every item in `items` concurrently, see `map_concurrently()`.
+		"""
+		return map_concurrently(func, items, self.max_concurrency)
+
+	def create_graphql_fetcher(self, endpoint=GRAPHQL_ENDPOINT, batch_size=50):
+		"""
+		Returns a GraphQLGistFetcher sharing the retry policy, circuit breakers and
+		concurrency controllers.
+		"""
+		return GraphQLGistFetcher(self.create_session(), self.token, endpoint, self.policy, batch_size)
+
+	def search(self, query=None, page=None, language=None, sort=None, order=None, max_gists=None, max_pages=None, verbosity=0, store=None, seen=None, on_error=None):
+		"""
+		Searches gists, see `get_search_links()` for the parameters and
+		`iter_search()` for `on_error`. Returns the records of the gists merged
+		by owner, the .json views of the gists and their owners. Use
+		`iter_search()` to stream the records instead.
+		"""
+		collected = CollectSink()
+		gist_store = {}
+		gists_authors = set()
+
+		for record in iter_search(self, query, page, language, sort, order, max_gists, max_pages, store, seen, [collected], verbosity, on_error):
+			if not record.owner in gist_store:
+				gist_store[record.owner] = GistRecord(owner=record.owner, url=record.url + '.json', is_public=record.is_public)
+
+			gists_authors.add(record.owner)
+			gist_store[record.owner].add_files(record.files)
+			gist_store[record.owner].update(record.emails, record.phone_numbers, record.urls)
+
+		return gist_store, collected.data, list(gists_authors)
+
+	def get_search_links(self, query=None, page=None, language=None, sort=None, order=None, max_gists=None, max_pages=None, verbosity=0, on_error=None):
+		"""
+		Returns the links of the gists found for `query`, reading results from
+		`page` on until `max_pages` pages were read or `max_gists` links found.
+		A page failing three times in a row ends the search; its last error is
+		passed to `on_error` with the query, see `report_error()`.
+
 		language:
 			Markdown
 			CSV
@@ -214,7 +485,8 @@ class Gist:
 			params['o'] = order
 
 
-		gist_links = set()
+		# A dict keeps the links in the order they were found.
+		gist_links = {}
 
 		total_pages = 0
 		error_count = 0
@@ -231,173 +503,87 @@ class Gist:
 			print("[+} Max Gists: ", max_gists)
 			print()
 
-		t1 = time.time()
-		print("[+] Extracting the gists links from search results.")
-		print()
+		if verbosity > 0:
+			print("[+] Extracting the gists links from search results.")
+			print()
 
+		next_page = page or 1
+		last_error = None
 		while True:
-			gists_returned = 0
+			finished = False
+			t1 = time.perf_counter()
 			try:
 				# self.session.cookies.clear()
-				print("[+] Requesting for page %s."%(total_pages + 1))
+				if verbosity > 0:
+					print("[+] Requesting for page %s."%(next_page))
 				with self.session.get(full_url, params=params, timeout=self.timeout) as response:
 					if response.status_code == 200:
-						html = response.text
-						soup = BS(html, features='html.parser')
-						info_text = soup.select_one('div.gutter div div h3 div.d-flex h3')
-
-						if info_text:
-							info_text = info_text.text
-							sections = info_text.strip().split(" ")
-
-							if sections and sections[0].isnumeric():
-								num_results = int(sections[0])
-								if verbosity and not looped_once:
-									print("[+] %s gist(s) was returned."%(num_results))
-									print()
-									looped_once = True
-
-								gists = soup.select("div main div div.repository-content div.gutter div .gist-snippet")
-								if gists:
-									gists_returned = len(gists)
-									for gist in gists:
-										gist_link = gist.select_one("div.gist-snippet-meta ul li.d-inline-block a")
-										if gist_link:
-											gist_link = gist_link.attrs.get('href')
-											if gist_link:
-							
-												gist_links.add(gist_link)
-						else:
-							if total_pages > 1:
-								print("[*] It seems we have reached the end.")
+						with STAGE_SECONDS.time(stage='search_parse'), profile_stage('search_parse'):
+							num_results, links = parse_search_page(response.text)
+
+						if num_results is not None:
+							if verbosity and not looped_once:
+								print("[+] %s gist(s) was returned."%(num_results))
+								print()
+								looped_once = True
+
+							error_count = 0
+							if links:
+								gist_links.update(dict.fromkeys(links))
 							else:
-								print("[+] The search query returned no results.")
-
-							error_count += 1
+								finished = True
+						else:
+							if verbosity > 0:
+								if total_pages > 0:
+									print("[*] It seems we have reached the end.")
+								else:
+									print("[+] The search query returned no results.")
+							finished = True
 
 					else:
-						if verbosity > 0:
-							print("[-] Recieved a non-200 status code of %s."%(response.status_code))
-						error_count += 1
+						import requests
+						raise requests.HTTPError("Recieved a non-200 status code of %s."%(response.status_code), response=response)
 
 			except Exception as e:
-				print("[-] An error occurred while making request: ", e)
+				if verbosity > 0:
+					print("[-] An error occurred while making request: ", e)
+				last_error = e
 				error_count += 1
 
+			STAGE_SECONDS.observe(time.perf_counter() - t1, stage='search_page')
 			total_pages += 1
 
-			params['p'] = total_pages + 1
+			if finished:
+				break
 
 			if error_count >= 3:
-				if verbosity > 0:
-					print("[-] Page iteration stopped due to consecutive errors.")
-					break
-
-			if ( max_gists and max_gists >= len(gist_links) ) or (max_pages and max_pages >= total_pages):
+				report_error(on_error, query, last_error, "[-] Page iteration stopped due to consecutive errors: ")
 				break
-			else:
-				if max_gists and len(gist_links) >= max_gists:
-					break
-				elif max_pages and max_pages >= total_pages:
-					break
+			elif error_count:
+				# The same page is requested again.
+				time.sleep(self.policy.backoff(error_count))
+				continue
 
-			#uncomment to break when less gists are returned.
-			# if gists_returned < 50:
-			# 	break
-
-		t2 = time.time()
-		print()
-		print("[+] %s links were extracted."%(len(gist_links)))
-		print("[+] Link extraction took %s seconds before completion."%(t2-t1))
-
-		gist_links = list(gist_links)
-
-		gist_store = {}
-		gists_collection = []
-		gists_authors = set()
-
-		_gist_links = set()
-
-		t1 = time.time()
-		print()
-		print("[+] Retrieving gists from the search results.")
-
-		for index, gist_link in enumerate(gist_links, 1):
-			
-			gist_url = self.gist_search_url + gist_link + '.json'			
-
-			print("[+] Retrieving gist with url '%s'."%(gist_url))
-
-			try:
-				with self.session.get(gist_url, timeout=self.timeout) as response:
-					if response.status_code == 200:
+			if max_gists and len(gist_links) >= max_gists:
+				break
+			if max_pages and total_pages >= max_pages:
+				break
 
-						data = response.json()
-						owner = data.get('owner')
-						is_public = data.get('public') or False
-						files = data.get('files')
-
-						if not owner in gist_store:
-							gist_store[owner] = {
-								'owner': owner,
-								'url':gist_url,
-								'is_public':is_public,
-								'files': [],
-								'emails': [],
-								'phone_numbers': [],
-								'urls': [],
-							}
-
-						if not gist_link in _gist_links:
-							gists_collection.append(data)
-							gists_authors.add(owner)
-
-						_gist_links.add(gist_link)
-
-						html = data.get('div')
-						soup = BS(html, features='html.parser')
-
-						contents = soup.select("div.gist div.gist-file div.gist-data")
-						for content in contents:
-							content_data = content.select_one('div.file')
-							if content_data:
-								content_data = content_data.text
-								phone_numbers = extract_phonenumbers(content_data)
-								emails = extract_emails(content_data)
-								urls = extract_urls(content_data)
-								urls = process_urls(urls)
-								urls = canonicalize_urls(urls)
-
-								gist_store[owner].get('emails').extend(emails)
-								gist_store[owner].get('urls').extend(urls)
-								gist_store[owner].get('phone_numbers').extend(phone_numbers)
-
-						metadata = soup.select('div.gist-meta')
-
-						_files = []
-
-						for m in metadata:
-							file_link = m.select_one('a')
-							if file_link:
-								file_link = file_link.attrs.get('href')
-								_files.append(file_link)
-						
-						print("[+] Gist contains %s files."%(len(_files)))
-						gist_store[owner]['files'].extend(_files)
-			except Exception as e:
-				print("[-] An exception occurred while retrieving gist: ", e)
+			next_page += 1
+			params['p'] = next_page
 
+		if verbosity > 0:
 			print()
+			print("[+] %s links were extracted."%(len(gist_links)))
 
-			if max_gists and max_gists >= index:
-				break
-
-		t2 = time.time()
-		print("[+] Gists extraction took %s seconds before completion."%(t2-t1))
-
-		return gist_store, gists_collection, list(gists_authors)
+		gist_links = list(gist_links)
+		if max_gists:
+			gist_links = gist_links[:max_gists]
+		return gist_links
 
 	def get_gists(self, username, maximum=1000, page=1, per_page=100):
+		import github
+
 		endpoint = '/users/%s/gists'%(username)
 
 		url_parameters = {'per_page':per_page, 'page': page}
@@ -406,7 +592,13 @@ class Gist:
 		current_page = page
 
 		while True:
-			headers, data = self.requester.requestJsonAndCheck("GET", endpoint, parameters=url_parameters)
+			with STAGE_SECONDS.time(stage='user_listing'), profile_stage('user_listing'):
+				headers, data = self.policy.call(self.api_breaker, self.requester.requestJsonAndCheck, "GET", endpoint,
+					parameters=url_parameters, controller=self.api_controller)
+			self.record_rate_limit()
+			if not data:
+				break
+
 			for gist in data:
 				gg = github.Gist.Gist(self.requester, headers, gist, completed=True)
 				results.append(gg)
@@ -423,82 +615,681 @@ class Gist:
 
 		return results
 
+	def poll_gists(self, endpoint, etag=None, page=1, per_page=100):
+		"""
+		Requests a page of gists from `endpoint`, e.g. `/gists/public`, as a
+		conditional request when `etag` is given. Returns the gists, or None if
+		the page is unchanged, with the page's ETag and the poll interval the API
+		asked for, if any. Unchanged pages do not count against the rate limit.
+		"""
+		import github
+
+		headers = {'Accept': 'application/vnd.github+json'}
+		if etag:
+			headers['If-None-Match'] = etag
+		if self.token:
+			headers['Authorization'] = 'token %s'%(self.token)
+
+		with self.api_session.get(self.api_url + endpoint, params={'per_page': per_page, 'page': page}, headers=headers) as response:
+			poll_interval = response.headers.get('X-Poll-Interval')
+			poll_interval = int(poll_interval) if poll_interval and poll_interval.isdigit() else None
+
+			if response.status_code == 304:
+				return None, etag, poll_interval
+			response.raise_for_status()
+
+			gists = [github.Gist.Gist(self.requester, dict(response.headers), gist, completed=True) for gist in response.json()]
+			return gists, response.headers.get('ETag'), poll_interval
+
 	def get_gist(self, id):
-		return self.g.get_gist(id)
+		import github
+
+		with STAGE_SECONDS.time(stage='gist_fetch'), profile_stage('gist_fetch'):
+			headers, data = self.policy.call(self.api_breaker, self.requester.requestJsonAndCheck, "GET", "/gists/%s"%(id),
+				controller=self.api_controller)
+		self.record_rate_limit()
+		return github.Gist.Gist(self.requester, headers, data, completed=True)
+
+	def record_rate_limit(self):
+		"""
+		Records the rate limit the last API response reported, see `record_rate_limit()`.
+		"""
+		remaining, limit = self.requester.rate_limiting
+		record_rate_limit(self.api_breaker.host, remaining, limit)
 
 def get_gists_id(args):
 	"""
-	TODO:
-	Optimize for streaming.
+	Yields batches of distinct gist ids from the command line and the gist file,
+	which may be gzipped or `-` for stdin.
 	"""
-	gists_id = set(args.gists_id)
+	return read_batches(args.gists_id, args.gist_file, args.batch_size)
 
-	if args.gist_file:
-		with open(args.gist_file, 'rt', encoding='utf-8') as f:
-			while True:
-				while len(gists_id) >= 100:
-					gists_id = list(gists_id)
-					yield gists_id[:100]
-					gists_id = set(gists_id[100:])
+def get_usernames(args):
+	"""
+	Yields batches of distinct usernames from the command line and the username
+	file, which may be gzipped or `-` for stdin.
+	"""
+	return read_batches(args.usernames, args.username_file, args.batch_size)
 
-				line = f.readline()
-				line = line.strip()
-				if not line:
-					break
+def get_files_info(files):
+	"""
+	Returns the metadata of the gist files in `files` as dicts.
+	"""
+	return [{
+		'filename': file.filename,
+		'raw_url': file.raw_url,
+		'type': file.type,
+		'language': file.language,
+		'size': file.size,
+	} for file in files]
+
+def download_files(files, session, strict=True, max_size=MAX_FILE_SIZE, timeout=None):
+	"""
+	Downloads the text-like files in `files`. Returns a dict mapping the name of
+	every file in `files` that was retrieved to its text, or to None for files
+	that are not text, and a dict mapping the name of every file that could not
+	be downloaded to the exception it failed with. The language, type,
+	extension and size metadata decide which files are requested; the first
+	chunk of every download is sniffed so that binaries slipping past the
+	metadata are aborted early. With `strict` set to False, files without
+	conclusive metadata are also tried. Without a `timeout`, the session's
+	default applies. Files whose `text` came with the gist, as over GraphQL,
+	are not downloaded again.
+	"""
+	texts = {}
+	errors = {}
 
-				if line and not (line.startswith('#') or line.startswith("//")):
-					gists_id.add(line)
+	for file in files:
+		text = getattr(file, 'text', None)
+		if text is None and is_text_candidate(file.filename, file.type, file.language, file.size, strict, max_size):
+			try:
+				text = download_text(session, file.raw_url, timeout=timeout, max_size=max_size)
+			except Exception as e:
+				errors[file.filename] = e
+				continue
+		texts[file.filename] = text
 
-	yield gists_id
+	return texts, errors
 
-def get_usernames(args):
+def get_files(files, session, strict=True, max_size=MAX_FILE_SIZE, timeout=None):
 	"""
-	TODO:
-	Optimize for streaming.
+	Downloads the text-like files in `files` and returns their texts, see `download_files()`.
 	"""
-	usernames = set(args.usernames)
+	texts, _ = download_files(files, session, strict, max_size, timeout)
+	return [text for text in texts.values() if text is not None]
 
+def extract_artifacts(contents):
+	"""
+	Returns the (emails, phone_numbers, urls) sets found in the texts in `contents`.
+	The time each extractor takes is recorded in the gisthub_extract_seconds metric.
+	"""
+	urls = set()
+	emails = set()
+	phone_numbers = set()
 
-	if args.username_file:
-		with open(args.username_file, 'rt', encoding='utf-8') as f:
-			while True:
-				while len(usernames) >= 100:
-					usernames = list(usernames)
-					yield usernames[:100]
-					usernames = set(usernames[100:])
+	for content in contents:
+		content_data = content
+		with EXTRACT_SECONDS.time(extractor='phone_numbers'), profile_stage('extract_phone_numbers'):
+			phone_numbers.update( extract_phonenumbers(content_data) )
+		with EXTRACT_SECONDS.time(extractor='emails'), profile_stage('extract_emails'):
+			emails.update( extract_emails(content_data) )
+		with EXTRACT_SECONDS.time(extractor='urls'), profile_stage('extract_urls'):
+			urls.update( normalize_urls(extract_urls(content_data)) )
 
-				line = f.readline()
-				line = line.strip()
-				if not line:
-					break
+	return emails, phone_numbers, urls
 
-				if line and not (line.startswith('#') or line.startswith("//")):
-					usernames.add(line)
+def get_gist_version(gist):
+	"""
+	Returns the latest history version of `gist`, or None where the response
+	carried no history, as in user listings.
+	"""
+	history = gist.raw_data.get('history') if isinstance(gist.raw_data, dict) else None
+	if history:
+		return history[0].get('version')
+	return None
 
-	yield usernames
+def get_file_revision(raw_url):
+	"""
+	Returns the file revision in the raw url of a gist file, or None for raw
+	urls without one, such as those of gists fetched over GraphQL.
+	"""
+	match = re.search(r'/raw/([0-9a-f]{40})/', raw_url or '')
+	return match.group(1) if match else None
 
-def get_files(files, session, strict=True):
-	content = []
+def get_changed_files(gist, revision):
+	"""
+	Returns the names of the files of `gist` which must be downloaded given the
+	`revision` a store recorded for it (see `ArtifactStore.get_revision()`), or
+	None for all of them. A gist with the same `updated_at` and history version
+	only needs the files whose artifacts were never recorded; otherwise a file is
+	downloaded again when its raw url, which carries the file revision, or its
+	size changed, or when its raw url carries no revision to compare. Files
+	whose text came with the gist are always re-extracted.
+	Reused and changed files count as hits and misses of the `revision` cache.
+	"""
+	if revision is None:
+		CACHE_LOOKUPS.inc(len(gist.files), cache='revision', result='miss')
+		return None
+
+	version = get_gist_version(gist)
+	unchanged = revision['updated_at'] == str(gist.updated_at) and (version is None or revision['version'] in (None, version))
+
+	changed = []
+	for name, file in gist.files.items():
+		raw_url, size, extracted = revision['files'].get(name, (None, None, False))
+		if not extracted or getattr(file, 'text', None) is not None:
+			changed.append(name)
+		elif not unchanged and (raw_url != file.raw_url or size != file.size or get_file_revision(file.raw_url) is None):
+			changed.append(name)
+
+	CACHE_LOOKUPS.inc(len(gist.files) - len(changed), cache='revision', result='hit')
+	CACHE_LOOKUPS.inc(len(changed), cache='revision', result='miss')
+	return changed
+
+def download_gist(gist, session, changed=None):
+	"""
+	Downloads the files of `gist` named in `changed`, or all of them. Returns
+	the texts of the files retrieved and the errors of the others by filename,
+	see `download_files()`. Safe to call from several threads at once.
+	"""
+	files = gist.files.values() if changed is None else [gist.files[name] for name in changed]
+	with STAGE_SECONDS.time(stage='file_download'), profile_stage('file_download'):
+		texts, errors = download_files(files, session)
 
-	for file in files:
-		ftype = file.type
-		raw_url = file.raw_url
-		if strict:
-			if ftype and 'plain' in ftype:
-				with session.get(raw_url) as response:
-					if response.status_code == 200:
-						content.append(response.text)
+	ITEMS.inc(stage='file_download', outcome='error' if errors else 'ok')
+	return texts, errors
 
-	return content
+def record_gist(gist, texts, complete, store=None, seen=None):
+	"""
+	Extracts the artifacts from the downloaded `texts` of `gist` and records the
+	gist in `store` and `seen` when given. Files missing from `texts` were not
+	downloaded again, or failed to download, their artifacts are taken from the
+	store. Returns the GistRecord of the gist. A gist whose files could not all
+	be downloaded is not added to `seen`, and its failed files are not marked
+	extracted, so that a later run retries them.
+	"""
+	owner = gist.owner
+	gist_url = "https://gist.github.com" + "/" + owner.login + "/" + gist.id
+	is_public = gist.public
+	files = gist.files
+
+	with STAGE_SECONDS.time(stage='record'), profile_stage('record'):
+		file_artifacts = {}
+		for name, text in texts.items():
+			file_artifacts[name] = extract_artifacts([text] if text is not None else [])
+
+		emails, phone_numbers, urls = set(), set(), set()
+		for file_emails, file_phone_numbers, file_urls in file_artifacts.values():
+			emails.update(file_emails)
+			phone_numbers.update(file_phone_numbers)
+			urls.update(file_urls)
+
+		if store is not None:
+			reused = [name for name in files if name not in texts]
+			if reused:
+				prior_emails, prior_phone_numbers, prior_urls = store.get_file_artifacts(gist.id, reused)
+				emails.update(prior_emails)
+				phone_numbers.update(prior_phone_numbers)
+				urls.update(prior_urls)
+
+			store.add_gist(gist.id, owner.login, gist_url, is_public, get_files_info(files.values()),
+				emails, phone_numbers, urls, gist.created_at, gist.updated_at, get_gist_version(gist), file_artifacts)
+
+		if seen is not None and complete:
+			seen.add(gist.id, gist.updated_at)
+
+	ITEMS.inc(stage='record', outcome='complete' if complete else 'incomplete')
+	return GistRecord(gist.id, owner.login, gist_url, is_public, files, emails, phone_numbers, urls)
+
+def report_error(on_error, item, e, message, not_found=None):
+	"""
+	Passes the exception `e` raised for `item`, e.g. a username or a gist id,
+	to `on_error` when given. Otherwise prints `message` with the exception,
+	and `not_found` as well for 404s.
+	"""
+	if on_error is not None:
+		on_error(item, e)
+		return
+
+	print(message, e)
+	if not_found and getattr(e, 'status', None) == 404:
+		print(not_found)
+
+def print_unchanged_files(gist, changed, verbosity=1):
+	if verbosity > 0 and changed is not None and len(changed) < len(gist.files):
+		print("[*] %s of %s file(s) are unchanged since the last run and were not downloaded."%(len(gist.files) - len(changed), len(gist.files)))
+
+def process_gists(client, pending, session=None, store=None, seen=None, sinks=(), progress=None, verbosity=0, on_error=None):
+	"""
+	Downloads the changed files of the gists in `pending` concurrently and
+	records them in order, yielding their GistRecords. `pending` holds
+	(gist_id, gist) pairs; a gist given as None is fetched by id first, in the
+	same thread as its files. Revisions are looked up before the downloads
+	start since the store is not shared across threads. Every recorded gist is
+	passed to `sinks` and every gist, recorded or not, counts towards `progress`.
+
+	Gists that cannot be fetched are skipped and files that cannot be
+	downloaded leave their gist incomplete; either way the gist id and the
+	exception are passed to `on_error`, or printed without it. Callbacks and
+	sinks are called from the thread consuming the records.
+	"""
+	pending = list(pending)
+	session = session or client.create_session()
+	revisions = {gist_id: store.get_revision(gist_id) for gist_id, _ in pending} if store is not None else {}
+
+	def fetch(item):
+		gist_id, gist = item
+		if gist is None:
+			gist = client.get_gist(gist_id)
+		changed = get_changed_files(gist, revisions.get(gist_id))
+		return gist, changed, download_gist(gist, session, changed)
+
+	for (gist_id, _), result, e in client.map(fetch, pending):
+		if progress is not None:
+			progress.advance()
+
+		if e is not None:
+			report_error(on_error, gist_id, e, "[-] An exception occurred while retrieving gist: ",
+				"[-] The gist with id '%s' probably doesn't exist."%(gist_id))
+			continue
+
+		gist, changed, (texts, errors) = result
+		if verbosity > 0:
+			print("[+] Got gist: Gist(owner'=%s' id=%s created_at=%s, files='%s')"%(gist.owner.login, gist.id, gist.created_at, '|'.join(gist.files.keys())))
+		print_unchanged_files(gist, changed, verbosity)
+		for name, e in errors.items():
+			report_error(on_error, gist.id, e, "[-] An exception occurred while retrieving gist file '%s': "%(name))
+
+		record = record_gist(gist, texts, not errors, store, seen)
+		for sink in sinks:
+			sink.add(record, gist.raw_data)
+		yield record
+
+def iter_user_gists(client, usernames, session=None, maximum=100, store=None, seen=None, sinks=(), batch_size=100, progress=None, verbosity=0, on_error=None):
+	"""
+	Yields the GistRecords of up to `maximum` gists of every user in
+	`usernames`, see `process_gists()`. The users of a batch of `batch_size`,
+	and then all of their gists, are fetched concurrently with `client`, a Gist
+	instance. Gists found in `seen` at their current revision are skipped. Every
+	user counts towards `progress`. Users whose gists cannot be listed are
+	passed to `on_error` with the exception.
+	"""
+	session = session or client.create_session()
+
+	for batch in batched(usernames, batch_size):
+		pending = []
+		for username, gists, e in client.map(lambda username: client.get_gists(username, maximum), batch):
+			if progress is not None:
+				progress.advance()
+			if verbosity > 0:
+				print("[+] Retrieving gists for user '%s'."%(username))
+				print()
+
+			if e is not None:
+				report_error(on_error, username, e, "[-] An exception occurred while retrieving gists: ",
+					"[-] The username '%s' probably doesn't exist."%(username))
+				continue
+
+			if verbosity > 0:
+				print("[+] Retrieved %s gist(s)."%(len(gists)))
+				print()
+			for gist in gists:
+				if seen is not None and seen.contains(gist.id, gist.updated_at):
+					if verbosity > 0:
+						print("[*] Skipping gist with id '%s' as it is unchanged since it was processed."%(gist.id))
+					continue
+				pending.append((gist.id, gist))
+
+		yield from process_gists(client, pending, session, store, seen, sinks, verbosity=verbosity, on_error=on_error)
+
+def iter_gists(client, gists_id, session=None, store=None, seen=None, sinks=(), fetcher=None, batch_size=100, progress=None, verbosity=0, on_error=None):
+	"""
+	Yields the GistRecords of the gists in `gists_id`, given as ids,
+	`owner/gist_id` or urls, see `process_gists()`. Gists found in `seen` are
+	skipped. With a GraphQLGistFetcher as `fetcher`, the `owner/gist_id` entries
+	of every batch of `batch_size` are fetched in a few GraphQL queries first;
+	the others, and gists the queries did not return, are fetched over REST.
+	"""
+	session = session or client.create_session()
+
+	for batch in batched(gists_id, batch_size):
+		pending = []
+		for entry in batch:
+			gist_id = split_gist_id(entry)[1]
+			if seen is not None and seen.contains(gist_id):
+				if verbosity > 0:
+					print("[*] Skipping gist with id '%s' as it was processed before."%(gist_id))
+				if progress is not None:
+					progress.advance()
+				continue
+			pending.append((entry, gist_id))
+
+		graphql_gists = {}
+		if fetcher is not None:
+			try:
+				graphql_gists = {split_gist_id(entry)[1]: gist for entry, gist in fetcher.fetch([entry for entry, _ in pending]).items() if gist}
+			except Exception as e:
+				if verbosity > 0:
+					print("[-] An exception occurred while querying GraphQL, falling back to REST: ", e)
+
+		yield from process_gists(client, [(gist_id, graphql_gists.get(gist_id)) for _, gist_id in pending], session, store, seen, sinks, progress, verbosity, on_error)
+
+def iter_search(client, query, page=None, language=None, sort=None, order=None, max_gists=None, max_pages=None, store=None, seen=None, sinks=(), verbosity=0, on_error=None):
+	"""
+	Yields the GistRecords of the gists found for `query`, see
+	`Gist.get_search_links()` for the parameters. Gists are read from their
+	.json view on the gist website, fetched concurrently and recorded in order;
+	the views are what `sinks` receive. Gists found in `seen` are skipped, and
+	gists that cannot be retrieved are passed to `on_error` by link.
+	"""
+	gist_links = client.get_search_links(query, page, language, sort, order, max_gists, max_pages, verbosity, on_error)
+
+	if verbosity > 0:
+		print()
+		print("[+] Retrieving gists from the search results.")
+
+	pending = []
+	for gist_link in gist_links:
+		gist_id = gist_link.rstrip('/').rsplit('/', 1)[-1]
+
+		if seen is not None and seen.contains(gist_id):
+			ITEMS.inc(stage='search_gist', outcome='skipped')
+			if verbosity > 0:
+				print("[*] Skipping gist with url '%s' as it was processed before."%(client.gist_search_url + gist_link + '.json'))
+			continue
+
+		pending.append(gist_link)
+
+	def fetch(gist_link):
+		with STAGE_SECONDS.time(stage='search_gist'), profile_stage('search_gist'):
+			with client.session.get(client.gist_search_url + gist_link + '.json', timeout=client.timeout) as response:
+				response.raise_for_status()
+				return response.json()
+
+	for gist_link, result, e in client.map(fetch, pending):
+		gist_id = gist_link.rstrip('/').rsplit('/', 1)[-1]
+
+		if verbosity > 0:
+			print("[+] Retrieving gist with url '%s'."%(client.gist_search_url + gist_link + '.json'))
+
+		if e is not None:
+			ITEMS.inc(stage='search_gist', outcome='error')
+			report_error(on_error, gist_link, e, "[-] An exception occurred while retrieving gist: ")
+			continue
+
+		data = result
+		try:
+			owner = data.get('owner')
+			is_public = data.get('public') or False
+
+			with STAGE_SECONDS.time(stage='gist_html_parse'), profile_stage('gist_html_parse'):
+				texts, files = parse_gist_html(data.get('div'))
+
+			record = GistRecord(gist_id, owner, client.gist_search_url + gist_link, is_public, files)
+			record.update(*extract_artifacts(texts))
+
+			if verbosity > 0:
+				print("[+] Gist contains %s files."%(len(files)))
+
+			if store is not None:
+				store.add_gist(gist_id, owner, record.url, is_public, data.get('files') or files,
+					record.emails, record.phone_numbers, record.urls, created_at=data.get('created_at'))
+
+			if seen is not None:
+				seen.add(gist_id)
+		except Exception as e:
+			ITEMS.inc(stage='search_gist', outcome='error')
+			report_error(on_error, gist_link, e, "[-] An exception occurred while retrieving gist: ")
+			continue
+
+		ITEMS.inc(stage='search_gist', outcome='ok')
+		for sink in sinks:
+			sink.add(record, data)
+		yield record
+
+def run_worker(g, queue, session, worker_id, maximum=100, batch_size=10, store=None, seen=None, wait=False, poll_interval=5, verbosity=0, progress=None,
+	max_attempts=5, retry_delay=30):
+	"""
+	Leases items from `queue` and processes them until the queue is drained, or
+	forever with `wait` set. Items are acknowledged once processed. An item
+	whose processing fails, or any search page, gist or file it leads to, is
+	released back to the queue, leased again after `retry_delay` seconds,
+	doubled on every attempt, and marked as failed once it has been attempted
+	`max_attempts` times. Acknowledged and failed items
+	count towards `progress`, when given. Returns the records of the processed
+	gists by id.
+	"""
+	gists_store = {}
+
+	while True:
+		items = queue.lease(worker_id, batch_size)
+		if not items:
+			if wait:
+				time.sleep(poll_interval)
+				continue
+
+			stats = queue.stats()
+			if stats['leased'] or stats['pending']:
+				# Other workers hold leases which may yet expire and come back,
+				# or released items wait for their retry delay.
+				time.sleep(poll_interval)
+				continue
+			break
+
+		for item in items:
+			if verbosity > 0:
+				print("[+] Processing %s item '%s' (attempt %s)."%(item.kind, item.value, item.attempts))
+
+			# Search pages, gists and files which fail while the item is processed
+			# are collected here, so that the item is retried rather than acknowledged.
+			errors = []
+			def collect_error(entry, e):
+				status = getattr(e, 'status', None) or getattr(getattr(e, 'response', None), 'status_code', None)
+				if status != 404:
+					print("[-] An exception occurred while processing '%s': "%(entry), e)
+					errors.append(e)
+			try:
+				if item.kind == 'user':
+					gists = g.get_gists(item.value, maximum)
+				elif item.kind == 'gist':
+					# Entries may be `owner/gist_id` or gist urls, as in gist lists.
+					gist_id = split_gist_id(item.value)[1]
+					gists = [] if seen is not None and seen.contains(gist_id) else [g.get_gist(gist_id)]
+				else:
+					shard = decode_search_shard(item.value)
+					for record in iter_search(g, shard['query'], shard['page'], shard.get('language'), shard.get('sort'), shard.get('order'),
+						max_pages=1, store=store, seen=seen, verbosity=verbosity, on_error=collect_error):
+						gists_store[record.id] = record
+					gists = []
+
+				if seen is not None:
+					gists = [gist for gist in gists if not seen.contains(gist.id, gist.updated_at)]
+
+				for record in process_gists(g, [(gist.id, gist) for gist in gists], session, store, seen, verbosity=verbosity, on_error=collect_error):
+					gists_store[record.id] = record
+
+				if store is not None:
+					store.commit()
+				if seen is not None:
+					seen.commit()
+
+				if errors:
+					# The gists recorded meanwhile are skipped on the next attempt.
+					raise errors[0]
+
+			except Exception as e:
+				print("[-] An exception occurred while processing %s item '%s': "%(item.kind, item.value), e)
+				if hasattr(e, 'status') and e.status == 404:
+					queue.ack(worker_id, item)
+				elif item.attempts >= max_attempts:
+					print("[-] Giving up on %s item '%s' after %s attempt(s)."%(item.kind, item.value, item.attempts))
+					queue.fail(worker_id, item)
+				else:
+					queue.release(worker_id, item, retry_delay * 2 ** (item.attempts - 1))
+					continue
+
+				if progress is not None:
+					progress.advance()
+				continue
+
+			if not queue.ack(worker_id, item):
+				print("[*] The lease on %s item '%s' expired before it was acknowledged."%(item.kind, item.value))
+			if progress is not None:
+				progress.advance()
+
+	return gists_store
+
+def poll_feed(g, endpoint, etags, window, max_pages=3, per_page=100):
+	"""
+	Returns the gists of the feed at `endpoint` which are not in `window`,
+	oldest first. The first page is requested conditionally on the ETag kept in
+	`etags`; as long as every gist on a page is new, up to `max_pages` pages are
+	read to catch up. Also returns the poll interval the API asked for, if any.
+	"""
+	gists, etags[endpoint], poll_interval = g.poll_gists(endpoint, etags.get(endpoint), per_page=per_page)
+	if gists is None:
+		return [], poll_interval
+
+	new = []
+	page = 1
+	while True:
+		fresh = [gist for gist in gists if gist.owner is not None and (gist.id, str(gist.updated_at)) not in window]
+		new.extend(fresh)
+
+		if len(fresh) < len(gists) or len(gists) < per_page or page >= max_pages:
+			break
+		page += 1
+		gists, _, _ = g.poll_gists(endpoint, page=page, per_page=per_page)
+
+	new.reverse()
+	return new, poll_interval
+
+def run_watch(g, session, usernames=(), public=True, interval=60, window_size=10000, max_pages=3, store=None, seen=None, output=None, max_polls=0, verbosity=0, progress=None):
+	"""
+	Polls the public gists and the gists of `usernames`, processing every new
+	gist or new revision of a gist as it appears, until interrupted or for
+	`max_polls` polls. Gists are remembered in a window of `window_size`, not
+	collected, so memory stays flat however long the watch runs; their records
+	are appended to `output` as JSON lines instead. Every poll counts towards
+	`progress`, when given. Returns the number of processed gists.
+	"""
+	endpoints = (['/gists/public'] if public else []) + ['/users/%s/gists'%(username) for username in usernames]
+	sinks = [JsonLinesSink(output)] if output is not None else []
+	window = SeenWindow(window_size)
+	etags = {}
+
+	polls = 0
+	processed = 0
+
+	while True:
+		t1 = time.monotonic()
+		polls += 1
+		wait = interval
+
+		new = []
+		for endpoint in endpoints:
+			try:
+				gists, poll_interval = poll_feed(g, endpoint, etags, window, max_pages)
+			except Exception as e:
+				print("[-] An exception occurred while polling '%s': "%(endpoint), e)
+				continue
+
+			if poll_interval:
+				wait = max(wait, poll_interval)
+			new.extend(gists)
+
+		pending = []
+		for gist in new:
+			if not window.add((gist.id, str(gist.updated_at))):
+				CACHE_LOOKUPS.inc(cache='window', result='hit')
+				continue
+			CACHE_LOOKUPS.inc(cache='window', result='miss')
+			if seen is not None and seen.contains(gist.id, gist.updated_at):
+				continue
+			pending.append((gist.id, gist))
+
+		for record in process_gists(g, pending, session, store, seen, sinks, verbosity=verbosity):
+			processed += 1
+
+		if store is not None:
+			store.commit()
+		if seen is not None:
+			seen.commit()
+		for sink in sinks:
+			sink.flush()
+
+		elapsed = time.monotonic() - t1
+		if progress is not None:
+			progress.advance()
+		if verbosity > 0:
+			print("[+] Poll %s: %s new gist(s), %s processed in %.1f seconds."%(polls, len(new), len(pending), elapsed))
+
+		if max_polls and polls >= max_polls:
+			break
+		time.sleep(max(0, wait - elapsed))
+
+	return processed
+
+def print_concurrency(controllers):
+	"""
+	Prints the concurrency limit each host settled on, with its p95 latency and
+	the number of times the limit was raised and cut.
+	"""
+	print("[+] Concurrency limits:")
+	for host, snapshot in sorted(controllers.snapshot().items()):
+		p95 = '%.3fs'%(snapshot['p95']) if snapshot['p95'] is not None else '-'
+		print("\t%s: limit=%s p95=%s increases=%s decreases=%s"%(host or '-', snapshot['limit'], p95, snapshot['increases'], snapshot['decreases']))
+	print()
+
+def print_metrics():
+	"""
+	Prints the time spent in each stage, the requests made to each host and
+	the bytes downloaded, from the metrics recorded so far.
+	"""
+	print("[+] Stages:")
+	for labels, value in STAGE_SECONDS.samples():
+		mean = value['sum'] / value['count'] * 1000 if value['count'] else 0
+		print("\t%s: %s call(s), %.2f seconds, %.1f ms on average"%(labels['stage'], value['count'], value['sum'], mean))
+	print()
+
+	print("[+] Requests:")
+	for labels, value in REQUESTS.samples():
+		print("\t%s %s: %s"%(labels['host'] or '-', labels['status'], value))
+	downloaded = sum(value for _, value in DOWNLOADED_BYTES.samples())
+	print("\t%.1f MB of files downloaded"%(downloaded / 1e6))
+	print()
 
 if __name__ == '__main__':
 	parser, args = get_cmd_args()
 	
 	defined_subcommands = ["user", "gist", 'search']
 	
-	g = Gist()
+	g = None
+	if args.subcommand in ('user', 'gist', 'search', 'worker', 'watch'):
+		g = Gist(max_concurrency=args.max_concurrency, token=getattr(args, 'token', None), api_url=getattr(args, 'api_url', API_URL))
+
+	store = None
+	seen = None
+	metrics_writer = None
+	profiler = None
+	progress = None
 
 	try:
+		if getattr(args, 'profile', None):
+			profiler = Profiler()
+			set_profiler(profiler)
+			profiler.start()
+
+		if getattr(args, 'metrics', None):
+			metrics_writer = MetricsWriter(REGISTRY, args.metrics, args.metrics_interval)
+			metrics_writer.start()
+
+		if getattr(args, 'store', None) and args.subcommand != 'query':
+			store = ArtifactStore(args.store)
+
+		if getattr(args, 'seen', None):
+			seen = open_seen_set(args.seen)
+
 		if args.subcommand == 'user':
 
 			verbosity = args.verbosity
@@ -511,7 +1302,7 @@ if __name__ == '__main__':
 			save_id = args.save_id
 			save_metadata = args.save_metadata
 
-			session = requests.Session()
+			session = g.create_session()
 
 			if verbosity > 0:
 				print("[+] Retrieving the gists of user's that match any of the specified username(s) from gist.gisthub.")
@@ -520,83 +1311,32 @@ if __name__ == '__main__':
 			if not usernames and not username_file:
 				parser.error("either of the following arguments are required: --username/-u, --username-list/-L")
 
-			if username_file and not (os.path.exists(username_file) and os.path.isfile(username_file)):
+			if username_file and username_file != '-' and not (os.path.exists(username_file) and os.path.isfile(username_file)):
 				exit("[-] Username file '%s' does not exists."%(username_file))
 
-			usernames = get_usernames(args) 
+			batches = get_usernames(args)
+			if args.progress:
+				progress = g.create_progress(None, 'users')
+				batches = progress.count(batches)
+				progress.start()
 
 			gists_id = set()
-
 			gists_store = {}
-			gists_collection = []
+			# Only keep the full data of every gist when it is to be saved.
+			sinks = [CollectSink()] if save else []
+
+			usernames = (username for batch in batches for username in batch)
+			for record in iter_user_gists(g, usernames, session, maximum, store, seen, sinks, args.batch_size, progress, verbosity):
+				gists_store.setdefault(record.owner, []).append(record)
+				gists_id.add(record.id)
 
-			for _usernames in usernames:
-				for username in _usernames:
-					print("[+] Retrieving gists for user '%s'."%(username))
-					print()
-					try:
-						gists = g.get_gists(username, maximum)
-					except Exception as e:
-						print("[-] An exception occurred while retrieving gists: ", e)
-						if hasattr(e, 'status') and e.status == 404:
-							print("[-] The username '%s' probably doesn't exist."%(username))
-						
-						continue
-
-					print("[+] Retrieved %s tweets."%(len(gists)))
-					print()
-					for gist in gists:
-						print("[+] Got gist: Gist(owner'=%s' id=%s created_at=%s, files='%s')"%(gist.owner.login, gist.id, gist.created_at, '|'.join(gist.files.keys())))
-						
-						if not username in gists_store:
-							gists_store[username] = []
-
-						if not gist.id in gists_id:
-							gists_collection.append(gist.raw_data)
-
-						gists_id.add(gist.id)
-
-						owner = gist.owner
-						gist_url = "https://gist.github.com" + "/" + owner.login + "/" + gist.id
-						is_public = gist.public
-						files = gist.files
-
-						try:
-							contents = get_files(files.values(), session)
-						except Exception as e:
-							print("[-] An exception occurred while retrieving gist files: ", e)
-
-						urls = set()
-						emails = set()
-						phone_numbers = set()
-
-						for content in contents:
-							content_data = content
-							phone_numbers.update( extract_phonenumbers(content_data) )
-							emails.update( extract_emails(content_data) )
-							urls.update( extract_urls(content_data) )
-							urls.update( process_urls(urls) )
-							urls.update( canonicalize_urls(urls) )
-
-						gists_store[username].append({
-							'id':gist.id,
-							'owner': owner,
-							'url':gist_url,
-							'is_public':is_public,
-							'files': [file for file in files],
-							'emails': list(emails),
-							'phone_numbers': list(phone_numbers),
-							'urls': list(urls),
-						})
-
-			gists_id = set(gists_id)
 			if save_id:
 				try:
-					print("[+] Saving Gist IDs to file '%s'."%(save_ids))
-					with open(save_id, 'wt', encoding='utf-8') as f:
+					print("[+] Saving Gist IDs to file '%s'."%(save_id))
+					with open_output(save_id, 'w', args.compression) as f:
 						for _id in gists_id:
 							f.write(str(_id)+'\n')
-					print("[+] Gist IDs successfully saved to file '%s'."%(save_ids))
+					print("[+] Gist IDs successfully saved to file '%s'."%(save_id))
 					print()
 				except Exception as e:
 					print("[-] An exception occurred while writing gist ids to file: ", e)
@@ -604,8 +1344,7 @@ if __name__ == '__main__':
 			if save_metadata:
 				try:
 					print("[+] Saving metadata to file '%s'."%(save_metadata))
-					with open(save_metadata, 'wt', encoding='utf-8') as f:
-						json.dump(gists_store, f, indent=2)
+					save_json(save_metadata, gists_store, args.compression, args.pretty, encode_record)
 					print("[+] Gist Metadata successfully saved to file '%s'."%(save_metadata))
 					print()
 				except Exception as e:
@@ -614,8 +1353,7 @@ if __name__ == '__main__':
 			if save:
 				try:
 					print("[+] Saving gist to file '%s'."%(save))
-					with open(save, 'wt', encoding='utf-8') as f:
-						json.dump(gists_collection, f, indent=2)
+					save_json(save, sinks[0].data, args.compression, args.pretty)
 					print("[+] Gist successfully saved to file '%s'."%(save))
 					print()
 				except Exception as e:
@@ -624,7 +1362,7 @@ if __name__ == '__main__':
 			if verbosity >= 2:
 				print("[+] Metadata: ")
 				print()
-				print(json.dumps(gists_store, indent=2))
+				print(json.dumps(gists_store, indent=2, default=encode_record))
 
 		elif args.subcommand == 'gist':
 
@@ -637,7 +1375,7 @@ if __name__ == '__main__':
 			save = args.save
 			save_metadata = args.save_metadata
 
-			session = requests.Session()
+			session = g.create_session()
 
 			if verbosity > 0:
 				print("[+] Retrieving the specified gists.")
@@ -646,75 +1384,35 @@ if __name__ == '__main__':
 			if not gists_id and not gist_file:
 				parser.error("either of the following arguments are required: --gist/-g, --gist-list/-L")
 
-			if gist_file and not (os.path.exists(gist_file) and os.path.isfile(gist_file)):
+			if args.graphql and not args.token:
+				parser.error("--graphql requires a token, pass --token/-t or set GITHUB_TOKEN")
+
+			if gist_file and gist_file != '-' and not (os.path.exists(gist_file) and os.path.isfile(gist_file)):
 				exit("[-] Gist file '%s' does not exists."%(gist_file))
 
-			gists_id = get_gists_id(args) 
+			batches = get_gists_id(args)
+			if args.progress:
+				progress = g.create_progress(None, 'gists')
+				batches = progress.count(batches)
+				progress.start()
+
 			gists_store = {}
+			# Only keep the full data of every gist when it is to be saved.
+			sinks = [CollectSink()] if save else []
+			fetcher = g.create_graphql_fetcher(args.graphql_endpoint) if args.graphql else None
 
-			gists_ids = set()
-
-			gists_collection = []
-
-			for _gists_id in gists_id:
-				for gist_id in _gists_id:
-					_gist_id = gist_id
-					print("[+] Retrieving gist with id '%s'."%(_gist_id))
-					
-					try:
-						gist = g.get_gist(_gist_id)
-					except Exception as e:
-						print("[-] An exception occurred while retrieving gist: ", e)
-						if hasattr(e, 'status') and e.status == 404:
-							print("[-] The gist with id '%s' probably doesn't exist."%(_gist_id))
-
-						print()
-						continue
-
-					print("[+] Got gist: Gist(owner'=%s' id=%s created_at=%s, files='%s')"%(gist.owner.login, gist.id, gist.created_at, '|'.join(gist.files.keys())))
-
-					if not gist.id in gists_ids:
-						gists_collection.append(gist.raw_data)
-
-					gists_ids.add(gist.id)
-
-					owner = gist.owner
-					gist_url = "https://gist.github.com" + "/" + owner.login + "/" + gist.id
-					is_public = gist.public
-					files = gist.files
-
-					contents = get_files(files.values(), session)
-
-					urls = set()
-					emails = set()
-					phone_numbers = set()
-
-					for content in contents:
-						content_data = content
-						phone_numbers.update( extract_phonenumbers(content_data) )
-						emails.update( extract_emails(content_data) )
-						urls.update( extract_urls(content_data) )
-						urls.update( process_urls(urls) )
-						urls.update( canonicalize_urls(urls) )
-
-					gists_store[str(_gist_id)] = {
-						'id':gist.id,
-						'owner': owner,
-						'url':gist_url,
-						'is_public':is_public,
-						'files': [file for file in files],
-						'emails': list(emails),
-						'phone_numbers': list(phone_numbers),
-						'urls': list(urls),
-					}
+			gists_id = (gist_id for batch in batches for gist_id in batch)
+			for record in iter_gists(g, gists_id, session, store, seen, sinks, fetcher, args.batch_size, progress, verbosity):
+				gists_store[str(record.id)] = record
 
-					print()
+			if fetcher is not None and verbosity > 0:
+				print("[+] %s gist(s) were fetched over GraphQL in %s request(s)."%(fetcher.fetched, fetcher.requests))
+				print()
 
 			if save_metadata:
 				try:
 					print("[+] Saving metadata to file '%s'."%(save_metadata))
-					with open(save_metadata, 'wt', encoding='utf-8') as f:
-						json.dump(gists_store, f, indent=2)
+					save_json(save_metadata, gists_store, args.compression, args.pretty, encode_record)
 					print("[+] Gist Metadata successfully saved to file '%s'."%(save_metadata))
 					print()
 				except Exception as e:
@@ -723,8 +1421,7 @@ if __name__ == '__main__':
 			if save:
 				try:
 					print("[+] Saving gist to file '%s'."%(save))
-					with open(save, 'wt', encoding='utf-8') as f:
-						json.dump(gists_collection, f, indent=2)
+					save_json(save, sinks[0].data, args.compression, args.pretty)
 					print("[+] Gist successfully saved to file '%s'."%(save))
 					print()
 				except Exception as e:
@@ -732,7 +1429,7 @@ if __name__ == '__main__':
 
 			if verbosity >= 2:
 				print("[+] Metadata: ")
-				print(json.dumps(gists_store, indent=2))
+				print(json.dumps(gists_store, indent=2, default=encode_record))
 
 		elif args.subcommand == 'search':
 			verbosity = args.verbosity
@@ -752,7 +1449,7 @@ if __name__ == '__main__':
 				max_gists = None
 				max_pages = None
 			
-			gists_store, gists_collection, gists_authors = g.search(query, page, language, sort, order, max_gists, max_pages, verbosity)
+			gists_store, gists_collection, gists_authors = g.search(query, page, language, sort, order, max_gists, max_pages, verbosity, store, seen)
 
 
 			save = args.save
@@ -762,8 +1459,7 @@ if __name__ == '__main__':
 			if save_metadata:
 				try:
 					print("[+] Saving metadata to file '%s'."%(save_metadata))
-					with open(save_metadata, 'wt', encoding='utf-8') as f:
-						json.dump(gists_store, f, indent=2)
+					save_json(save_metadata, gists_store, args.compression, args.pretty, encode_record)
 					print("[+] Gist Metadata successfully saved to file '%s'."%(save_metadata))
 					print()
 				except Exception as e:
@@ -772,7 +1468,7 @@ if __name__ == '__main__':
 			if save_usernames:
 				try:
 					print("[+] Saving username(s) to file '%s'."%(save_usernames))
-					with open(save_usernames, 'wt', encoding='utf-8') as f:
+					with open_output(save_usernames, 'w', args.compression) as f:
 						for username in gists_authors:
 							f.write(username + '\n')
 					print("[+] %s username(s) written successfully to file '%s'."%(len(gists_authors), save_usernames))
@@ -782,8 +1478,7 @@ if __name__ == '__main__':
 			if save:
 				try:
 					print("[+] Saving gist(s) to file '%s'."%(save))
-					with open(save, 'wt', encoding='utf-8') as f:
-						json.dump(gists_collection, f, indent=2)
+					save_json(save, gists_collection, args.compression, args.pretty)
 					print("[+] Gist(s) successfully saved to file '%s'."%(save))
 					print()
 				except Exception as e:
@@ -791,13 +1486,148 @@ if __name__ == '__main__':
 
 			if verbosity >= 2:
 				print("[+] Metadata: ")
-				print(json.dumps(gists_store, indent=2))
+				print(json.dumps(gists_store, indent=2, default=encode_record))
+
+		elif args.subcommand == 'coordinator':
+			verbosity = args.verbosity
+
+			if not (args.usernames or args.username_file or args.gists_id or args.gist_file or args.query):
+				parser.error("at least one of the following arguments is required: --username/-u, --username-list, --gists/-g, --gist-list, --query/-q")
+
+			with open_queue(args.queue) as queue:
+				if args.usernames or args.username_file:
+					added = 0
+					for batch in read_batches(args.usernames, args.username_file, args.batch_size):
+						added += queue.put('user', batch)
+					print("[+] Queued %s new username(s)."%(added))
+
+				if args.gists_id or args.gist_file:
+					added = 0
+					for batch in read_batches(args.gists_id, args.gist_file, args.batch_size):
+						added += queue.put('gist', batch)
+					print("[+] Queued %s new gist id(s)."%(added))
+
+				if args.query:
+					shards = [encode_search_shard(args.query, page, args.language, args.sort, args.order)
+						for page in range(args.page, args.page + args.maximum_pages)]
+					added = queue.put('search', shards)
+					print("[+] Queued %s new search page(s)."%(added))
+
+				stats = queue.stats()
+				print("[+] Queue has %s pending, %s leased, %s done and %s failed item(s)."%(stats['pending'], stats['leased'], stats['done'], stats['failed']))
+
+		elif args.subcommand == 'worker':
+			verbosity = args.verbosity
+
+			session = g.create_session()
+
+			worker_id = get_worker_id()
+			print("[+] Starting worker '%s'."%(worker_id))
+			print()
+
+			with open_queue(args.queue, args.lease) as queue:
+				if args.progress:
+					progress = g.create_progress(None, 'items')
+					progress.start()
+				gists_store = run_worker(g, queue, session, worker_id, args.maximum, args.batch_size, store, seen, args.wait, verbosity=verbosity, progress=progress,
+					max_attempts=args.max_attempts, retry_delay=args.retry_delay)
+				stats = queue.stats()
+
+			print("[+] Worker processed %s gist(s). Queue has %s pending, %s leased, %s done and %s failed item(s)."%(
+				len(gists_store), stats['pending'], stats['leased'], stats['done'], stats['failed']))
+
+			if args.save_metadata:
+				try:
+					print("[+] Saving metadata to file '%s'."%(args.save_metadata))
+					save_json(args.save_metadata, gists_store, args.compression, args.pretty, encode_record)
+					print("[+] Gist Metadata successfully saved to file '%s'."%(args.save_metadata))
+					print()
+				except Exception as e:
+					print("[-] An exception occurred while writing the metadata to file: ", e)
+
+		elif args.subcommand == 'watch':
+			verbosity = args.verbosity
+
+			if not args.public and not (args.usernames or args.username_file):
+				parser.error("--no-public requires --username/-u or --username-list/-L")
+
+			if args.username_file and args.username_file != '-' and not (os.path.exists(args.username_file) and os.path.isfile(args.username_file)):
+				exit("[-] Username file '%s' does not exists."%(args.username_file))
+
+			usernames = [username for batch in read_batches(args.usernames, args.username_file) for username in batch]
+
+			session = g.create_session()
+
+			output = open_output(args.output, 'a', args.compression) if args.output else None
+			try:
+				feeds = []
+				if args.public:
+					feeds.append('the public gists')
+				if usernames:
+					feeds.append('the gists of %s user(s)'%(len(usernames)))
+				print("[+] Watching %s."%(' and '.join(feeds)))
+				print()
+				if args.progress:
+					progress = g.create_progress(args.max_polls or None, 'polls')
+					progress.start()
+				processed = run_watch(g, session, usernames, args.public, args.interval, args.window, args.maximum_pages,
+					store, seen, output, args.max_polls, verbosity, progress)
+				print("[+] %s gist(s) were processed."%(processed))
+			finally:
+				if output is not None:
+					output.close()
+
+		elif args.subcommand == 'query':
+			verbosity = args.verbosity
+
+			if not (os.path.exists(args.store) and os.path.isfile(args.store)):
+				exit("[-] Store file '%s' does not exists."%(args.store))
+
+			t1 = time.time()
+			with ArtifactStore(args.store) as query_store:
+				if args.email:
+					rows = query_store.find_emails(args.email)
+				elif args.url:
+					rows = query_store.find_urls(args.url)
+				elif args.phone:
+					rows = query_store.find_phone_numbers(args.phone)
+				else:
+					rows = query_store.find_owner(args.owner)
+			t2 = time.time()
+
+			for row in rows:
+				print('\t'.join(str(col) for col in row))
+
+			if verbosity > 0:
+				print()
+				print("[+] %s match(es) found in %s seconds."%(len(rows), t2-t1))
 
 		else:
 			parser.print_usage()
 
+		if g is not None and args.verbosity > 0:
+			print_concurrency(g.controllers)
+			print_metrics()
+
 	except Exception as e:
 		print("[-] An exception occurred: ", e)
 	except KeyboardInterrupt:
 			print()
-			print("[+] Exiting now.")
\ No newline at end of file
+			print("[+] Exiting now.")
+	finally:
+		if progress is not None:
+			progress.stop()
+		if profiler is not None:
+			profiler.stop()
+			set_profiler(None)
+			try:
+				profiler.write(args.profile)
+				print("[+] Profile saved to file '%s'."%(args.profile))
+			except Exception as e:
+				print("[-] An exception occurred while writing the profile to file: ", e)
+		if metrics_writer is not None:
+			metrics_writer.stop()
+		if store is not None:
+			store.close()
+		if seen is not None:
+			seen.close()
\ No newline at end of file
@@ -0,0 +1,240 @@
+import mimetypes
+import time
+from datetime import datetime
+from urllib.parse import quote, urlsplit
+
+from file_helpers import MAX_FILE_SIZE
+from http_helpers import classify_status
+
+GRAPHQL_ENDPOINT = 'https://api.github.com/graphql'
+
+# The fields fetched per gist. GitHub truncates large file texts, such files
+# are downloaded from their raw url instead.
+GIST_FIELDS = """
+	name
+	description
+	isPublic
+	createdAt
+	updatedAt
+	url
+	owner { login }
+	files(limit: %(file_limit)s) {
+		name
+		encodedName
+		size
+		isImage
+		isTruncated
+		language { name }
+		text
+	}
+"""
+
+class GraphQLError(Exception):
+	"""
+	Raised when a GraphQL query fails as a whole.
+	"""
+
+def split_gist_id(value):
+	"""
+	Returns the (owner, gist_id) of a gist list entry, which is either a bare
+	gist id, `owner/gist_id` or a gist url. The owner is None for bare ids.
+	@param value: the entry
+	@type value: str
+	@rtype tuple
+	"""
+	value = value.strip()
+	if '://' in value:
+		value = urlsplit(value).path
+
+	parts = [part for part in value.split('/') if part]
+	if len(parts) >= 2:
+		return parts[-2], parts[-1]
+	return None, parts[-1] if parts else value
+
+def parse_timestamp(value):
+	"""
+	Returns a GraphQL DateTime as the naive UTC datetime PyGithub uses, so both
+	paths record the same revision.
+	"""
+	if not value:
+		return None
+	return datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ')
+
+def build_gists_query(count, file_limit=100):
+	"""
+	Returns a query fetching `count` gists, aliased `g0`, `g1` and so on. Gists
+	are looked up by owner, so the variables `o<i>` and `n<i>` hold the owner
+	login and gist id of gist `i`.
+	"""
+	variables = ', '.join('$o%s: String!, $n%s: String!'%(i, i) for i in range(count))
+	fields = GIST_FIELDS%({'file_limit': file_limit})
+	aliases = '\n'.join('g%s: user(login: $o%s) { gist(name: $n%s) { %s } }'%(i, i, i, fields) for i in range(count))
+	return 'query(%s) {\n%s\n}'%(variables, aliases)
+
+def guess_file_type(filename, is_image=False):
+	"""
+	Returns a mime type for a gist file in place of the `type` of the REST API,
+	which GraphQL does not expose. Like REST, files of unknown types that are
+	not images are reported as text/plain, so both paths select the same files
+	for download; binaries among them are rejected by `looks_binary()`.
+	@param filename: the name of the file
+	@type filename: str
+	@param is_image: specifies if GitHub reported the file as an image
+	@type is_image: bool
+	@rtype str
+	"""
+	ftype = mimetypes.guess_type(filename or '')[0]
+	if ftype:
+		return ftype
+	return 'application/octet-stream' if is_image else 'text/plain'
+
+class GraphQLOwner:
+	__slots__ = ('login',)
+
+	def __init__(self, login):
+		self.login = login
+
+class GraphQLGistFile:
+	"""
+	A gist file with the attributes of PyGithub's GistFile. `text` holds the
+	content when it came with the query, otherwise the file is downloaded from
+	`raw_url` like any other. GraphQL does not expose file revisions, so unlike
+	REST raw urls `raw_url` points at the latest revision of the file.
+	"""
+	__slots__ = ('filename', 'raw_url', 'type', 'language', 'size', 'text')
+
+	def __init__(self, filename, raw_url, ftype, language, size, text=None):
+		self.filename = filename
+		self.raw_url = raw_url
+		self.type = ftype
+		self.language = language
+		self.size = size
+		self.text = text
+
+class GraphQLGist:
+	"""
+	A gist fetched over GraphQL with the attributes of PyGithub's Gist used by
+	the rest of the program. `raw_data` has the shape of the REST response.
+	"""
+	def __init__(self, node, max_size=MAX_FILE_SIZE):
+		self.id = node['name']
+		self.owner = GraphQLOwner((node.get('owner') or {}).get('login'))
+		self.public = node.get('isPublic')
+		self.created_at = parse_timestamp(node.get('createdAt'))
+		self.updated_at = parse_timestamp(node.get('updatedAt'))
+		self.description = node.get('description')
+		self.html_url = node.get('url')
+
+		self.files = {}
+		raw_files = {}
+		for file in node.get('files') or []:
+			raw_url = 'https://gist.githubusercontent.com/%s/%s/raw/%s'%(self.owner.login, self.id, file.get('encodedName') or quote(file['name']))
+			ftype = guess_file_type(file['name'], file.get('isImage'))
+			language = (file.get('language') or {}).get('name')
+			size = file.get('size') or 0
+
+			text = None
+			if not file.get('isTruncated') and not file.get('isImage') and size <= max_size:
+				text = file.get('text')
+
+			self.files[file['name']] = GraphQLGistFile(file['name'], raw_url, ftype, language, size, text)
+			raw_files[file['name']] = {
+				'filename': file['name'],
+				'type': ftype,
+				'language': language,
+				'raw_url': raw_url,
+				'size': size,
+				'truncated': file.get('isTruncated'),
+			}
+
+		self.raw_data = {
+			'id': self.id,
+			'html_url': self.html_url,
+			'public': self.public,
+			'description': self.description,
+			'created_at': node.get('createdAt'),
+			'updated_at': node.get('updatedAt'),
+			'owner': {'login': self.owner.login},
+			'files': raw_files,
+		}
+
+class GraphQLGistFetcher:
+	"""
+	Fetches gists with their file metadata and small file contents, `batch_size`
+	gists per GraphQL query instead of one REST call per gist and one more per file.
+	GraphQL looks gists up by owner, so only `owner/gist_id` entries can be
+	fetched this way; the caller falls back to REST for the others and for gists
+	the query did not return. A token is required.
+	"""
+	def __init__(self, session, token, endpoint=GRAPHQL_ENDPOINT, policy=None, batch_size=50, file_limit=100, max_size=MAX_FILE_SIZE):
+		self.session = session
+		self.token = token
+		self.endpoint = endpoint
+		self.policy = policy
+		self.batch_size = batch_size
+		self.file_limit = file_limit
+		self.max_size = max_size
+		self.requests = 0
+		self.fetched = 0
+
+	def query(self, query, variables):
+		"""
+		Runs `query` and returns its `data`. Throttling and server errors are
+		retried with the policy's backoff; since queries are POSTed, the session
+		does not retry them itself.
+		"""
+		attempts = self.policy.total if self.policy is not None else 0
+		headers = {'Authorization': 'bearer %s'%(self.token)}
+
+		attempt = 0
+		while True:
+			attempt += 1
+			self.requests += 1
+			try:
+				with self.session.post(self.endpoint, json={'query': query, 'variables': variables}, headers=headers) as response:
+					status = response.status_code
+					if status == 200:
+						result = response.json()
+						if result.get('data') is None:
+							raise GraphQLError('; '.join(error.get('message', '') for error in result.get('errors') or []) or 'The query returned no data.')
+						return result['data']
+					error = GraphQLError("The query failed with status code %s."%(status))
+					retry = classify_status(status, response.headers) == 'retry'
+			except GraphQLError:
+				raise
+			except Exception as e:
+				error = e
+				retry = True
+
+			if not retry or attempt > attempts:
+				raise error
+			time.sleep(self.policy.backoff(attempt))
+
+	def fetch(self, entries):
+		"""
+		Returns a dict mapping the `owner/gist_id` entries in `entries` to their
+		GraphQLGist, or to None where the gist was not returned. Entries without
+		an owner are left out.
+		"""
+		pairs = []
+		for entry in entries:
+			owner, gist_id = split_gist_id(entry)
+			if owner:
+				pairs.append((entry, owner, gist_id))
+
+		gists = {}
+		for start in range(0, len(pairs), self.batch_size):
+			batch = pairs[start:start + self.batch_size]
+
+			variables = {}
+			for i, (_, owner, gist_id) in enumerate(batch):
+				variables['o%s'%(i)] = owner
+				variables['n%s'%(i)] = gist_id
+
+			data = self.query(build_gists_query(len(batch), self.file_limit), variables)
+			for i, (entry, _, _) in enumerate(batch):
+				node = (data.get('g%s'%(i)) or {}).get('gist')
+				gists[entry] = GraphQLGist(node, self.max_size) if node else None
+				self.fetched += bool(node)
+
+		return gists
@@ -0,0 +1,360 @@
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+from metrics import RATE_LIMIT, RATE_LIMIT_REMAINING, REQUEST_SECONDS, REQUESTS
+
+# requests and urllib3 are imported where they are first needed, see gisthub.py.
+
+# Statuses worth retrying: throttling and transient server or gateway errors.
+RETRYABLE_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504, 520, 521, 522, 523, 524})
+
+# Statuses that will not change on a retry.
+FATAL_STATUSES = frozenset({400, 401, 404, 405, 410, 411, 413, 414, 415, 422, 451})
+
+def get_header(headers, name):
+	"""
+	Returns the header `name` from `headers`, whose keys may be in any case:
+	PyGithub lowercases the names of the headers it keeps.
+	@param headers: the response headers
+	@type headers: dict
+	@param name: the header name
+	@type name: str
+	@rtype str
+	"""
+	if not headers:
+		return None
+	value = headers.get(name)
+	if value is None:
+		value = headers.get(name.lower())
+	return value
+
+def classify_status(status, headers=None):
+	"""
+	Returns 'ok', 'retry' or 'fatal' for an HTTP status. A 403 is only retryable
+	when it is GitHub's rate limiting, i.e. it carries a Retry-After header or an
+	exhausted X-RateLimit-Remaining.
+	@param status: the status code
+	@type status: int
+	@param headers: the response headers
+	@type headers: dict
+	@rtype str
+	"""
+	if status is None:
+		return 'retry'
+	if status < 400:
+		return 'ok'
+	if status in FATAL_STATUSES:
+		return 'fatal'
+	if status in RETRYABLE_STATUSES:
+		return 'retry'
+	if status == 403 and headers:
+		if get_header(headers, 'Retry-After') or get_header(headers, 'X-RateLimit-Remaining') == '0':
+			return 'retry'
+	if status >= 500:
+		return 'retry'
+	return 'fatal'
+
+def record_rate_limit(host, remaining, limit):
+	"""
+	Records the rate limit a response from `host` reported, if any, in the
+	gisthub_rate_limit and gisthub_rate_limit_remaining metrics.
+	"""
+	try:
+		remaining, limit = int(remaining), int(limit)
+	except (TypeError, ValueError):
+		return
+	if limit >= 0:
+		RATE_LIMIT_REMAINING.set(remaining, host=host)
+		RATE_LIMIT.set(limit, host=host)
+
+class CircuitOpenError(Exception):
+	"""
+	Raised instead of making a request to a host whose circuit breaker is open.
+	"""
+	def __init__(self, host, retry_in):
+		super().__init__("Circuit breaker for '%s' is open, retrying in %.1f seconds."%(host, retry_in))
+		self.host = host
+		self.retry_in = retry_in
+
+class CircuitBreaker:
+	"""
+	Stops requests to a host after `failure_threshold` consecutive failures.
+	Once `reset_timeout` seconds have passed a single trial request is let
+	through; its success closes the breaker and its failure opens it again for
+	twice as long, up to `max_reset_timeout`.
+	"""
+	def __init__(self, host, failure_threshold=5, reset_timeout=30, max_reset_timeout=600):
+		self.host = host
+		self.failure_threshold = failure_threshold
+		self.base_reset_timeout = reset_timeout
+		self.reset_timeout = reset_timeout
+		self.max_reset_timeout = max_reset_timeout
+
+		self.failures = 0
+		self.opened_at = None
+		self.trial = False
+		self.lock = threading.Lock()
+
+	@property
+	def state(self):
+		if self.opened_at is None:
+			return 'closed'
+		if time.monotonic() - self.opened_at >= self.reset_timeout:
+			return 'half-open'
+		return 'open'
+
+	def before_request(self):
+		"""
+		Raises CircuitOpenError if requests to the host should not be made now.
+		"""
+		with self.lock:
+			if self.opened_at is None:
+				return
+
+			elapsed = time.monotonic() - self.opened_at
+			if elapsed < self.reset_timeout or self.trial:
+				raise CircuitOpenError(self.host, max(0, self.reset_timeout - elapsed))
+			self.trial = True
+
+	def record_success(self):
+		with self.lock:
+			self.failures = 0
+			self.opened_at = None
+			self.trial = False
+			self.reset_timeout = self.base_reset_timeout
+
+	def record_failure(self):
+		with self.lock:
+			self.failures += 1
+			if self.trial:
+				self.reset_timeout = min(self.reset_timeout * 2, self.max_reset_timeout)
+				self.opened_at = time.monotonic()
+				self.trial = False
+			elif self.failures >= self.failure_threshold:
+				self.opened_at = time.monotonic()
+
+	def record_status(self, status, headers=None):
+		if classify_status(status, headers) == 'retry':
+			self.record_failure()
+		else:
+			self.record_success()
+
+class CircuitBreakers:
+	"""
+	The circuit breakers of every host, created on first use.
+	"""
+	def __init__(self, failure_threshold=5, reset_timeout=30):
+		self.failure_threshold = failure_threshold
+		self.reset_timeout = reset_timeout
+		self.breakers = {}
+		self.lock = threading.Lock()
+
+	def get(self, host):
+		breaker = self.breakers.get(host)
+		if breaker is None:
+			with self.lock:
+				breaker = self.breakers.setdefault(host, CircuitBreaker(host, self.failure_threshold, self.reset_timeout))
+		return breaker
+
+	def for_url(self, url):
+		return self.get(urlsplit(url).hostname or '')
+
+class RetryPolicy:
+	"""
+	The retry policy shared by every request path: the scraping session, raw
+	file downloads and the PyGithub requester. Failed requests are retried up to
+	`total` times with exponential backoff and full jitter, capped at
+	`backoff_max` seconds; Retry-After headers are honoured up to `max_wait`.
+	GitHub answers an exhausted rate limit with a 403 which urllib3 does not
+	retry, so `call()` and the sessions wait for its reset themselves, see
+	`rate_limit_wait()`.
+	"""
+	def __init__(self, total=5, backoff_factor=0.5, backoff_max=60, max_wait=300, timeout=10):
+		self.total = total
+		self.backoff_factor = backoff_factor
+		self.backoff_max = backoff_max
+		self.max_wait = max_wait
+		self.timeout = timeout
+
+	def backoff(self, attempt):
+		"""
+		Returns the jittered delay before retry number `attempt`, counting from 1.
+		"""
+		cap = min(self.backoff_max, self.backoff_factor * (2 ** (attempt - 1)))
+		return random.uniform(0, cap)
+
+	def urllib3_retry(self):
+		"""
+		Returns the policy as a urllib3 Retry, for use with HTTPAdapter and PyGithub.
+		"""
+		from urllib3.util.retry import Retry
+
+		policy = self
+
+		class JitterRetry(Retry):
+			def get_backoff_time(self):
+				backoff = super().get_backoff_time()
+				if backoff <= 0:
+					return 0
+				return random.uniform(0, min(backoff, policy.backoff_max))
+
+			def get_retry_after(self, response):
+				retry_after = super().get_retry_after(response)
+				if retry_after is None and response.headers.get('X-RateLimit-Remaining') == '0':
+					reset = response.headers.get('X-RateLimit-Reset')
+					if reset and reset.isdigit():
+						retry_after = max(0, int(reset) - time.time())
+				if retry_after is not None:
+					retry_after = min(retry_after, policy.max_wait)
+				return retry_after
+
+			def is_retry(self, method, status_code, has_retry_after=False):
+				if status_code == 403 and has_retry_after:
+					return self.total is None or self.total > 0
+				return super().is_retry(method, status_code, has_retry_after)
+
+		return JitterRetry(
+			total=self.total,
+			backoff_factor=self.backoff_factor,
+			status_forcelist=RETRYABLE_STATUSES,
+			allowed_methods=frozenset({'GET', 'HEAD', 'OPTIONS'}),
+			raise_on_status=False,
+			respect_retry_after_header=True,
+		)
+
+	def wait_for(self, breaker):
+		"""
+		Waits until `breaker` lets a request through. Raises CircuitOpenError if
+		that would take longer than `max_wait`.
+		"""
+		while True:
+			try:
+				breaker.before_request()
+				return
+			except CircuitOpenError as e:
+				if e.retry_in > self.max_wait:
+					raise
+				time.sleep(max(e.retry_in, 1))
+
+	def rate_limit_wait(self, status, headers):
+		"""
+		Returns the seconds to wait before retrying a response with `status` and
+		`headers` which reports an exhausted rate limit, i.e. a 403 with
+		X-RateLimit-Remaining at 0, until its X-RateLimit-Reset. Returns None for
+		other responses and for waits longer than `max_wait`.
+		"""
+		if status != 403 or get_header(headers, 'X-RateLimit-Remaining') != '0':
+			return None
+
+		reset = get_header(headers, 'X-RateLimit-Reset')
+		if not reset or not reset.isdigit():
+			return None
+
+		# A second more, as the reset time is rounded down to the second.
+		wait = max(0, int(reset) - time.time()) + 1
+		return wait if wait <= self.max_wait else None
+
+	def call(self, breaker, func, *args, controller=None, **kwargs):
+		"""
+		Calls `func` behind `breaker` and, when given, the concurrency `controller`,
+		waiting for an open breaker rather than dropping the call. Used for PyGithub
+		calls, whose transport already retries with `urllib3_retry()`; here the
+		outcome is recorded, in the breaker, the controller and the metrics, and
+		calls hitting an exhausted rate limit are retried once it resets.
+		"""
+		attempt = 0
+		while True:
+			try:
+				return self.call_once(breaker, func, *args, controller=controller, **kwargs)
+			except Exception as e:
+				wait = self.rate_limit_wait(getattr(e, 'status', None), getattr(e, 'headers', None))
+				if wait is None or attempt >= self.total:
+					raise
+				attempt += 1
+				time.sleep(wait)
+
+	def call_once(self, breaker, func, *args, controller=None, **kwargs):
+		self.wait_for(breaker)
+		start = controller.acquire() if controller is not None else None
+		t1 = time.perf_counter()
+		try:
+			result = func(*args, **kwargs)
+		except Exception as e:
+			status = getattr(e, 'status', None)
+			REQUEST_SECONDS.observe(time.perf_counter() - t1, host=breaker.host)
+			REQUESTS.inc(host=breaker.host, status=status or 'error')
+			if status is not None and classify_status(status, getattr(e, 'headers', None)) == 'fatal':
+				breaker.record_success()
+			else:
+				breaker.record_failure()
+			if controller is not None:
+				controller.release(start, status, failed=status is None)
+			raise
+		REQUEST_SECONDS.observe(time.perf_counter() - t1, host=breaker.host)
+		REQUESTS.inc(host=breaker.host, status=200)
+		breaker.record_success()
+		if controller is not None:
+			controller.release(start, 200)
+		return result
+
+def create_session(policy, breakers, user_agent=None, pool_size=10, controllers=None):
+	"""
+	Returns a requests session which retries according to `policy`, checks the
+	per-host `breakers` before every request and applies the policy timeout to
+	requests made without one. With `controllers`, every request also waits for
+	a slot from its host's concurrency controller.
+	"""
+	import requests
+	from requests.adapters import HTTPAdapter
+
+	class PolicyAdapter(HTTPAdapter):
+		def send(self, request, **kwargs):
+			response = self.send_once(request, **kwargs)
+
+			# urllib3 does not retry GitHub's rate limit 403s, see RetryPolicy.
+			attempt = 0
+			while attempt < policy.total:
+				wait = policy.rate_limit_wait(response.status_code, response.headers)
+				if wait is None:
+					break
+				attempt += 1
+				response.close()
+				time.sleep(wait)
+				response = self.send_once(request, **kwargs)
+			return response
+
+		def send_once(self, request, **kwargs):
+			if kwargs.get('timeout') is None:
+				kwargs['timeout'] = policy.timeout
+
+			breaker = breakers.for_url(request.url)
+			breaker.before_request()
+			controller = controllers.for_url(request.url) if controllers is not None else None
+			start = controller.acquire() if controller is not None else None
+			t1 = time.perf_counter()
+			try:
+				response = super().send(request, **kwargs)
+			except requests.RequestException:
+				REQUEST_SECONDS.observe(time.perf_counter() - t1, host=breaker.host)
+				REQUESTS.inc(host=breaker.host, status='error')
+				breaker.record_failure()
+				if controller is not None:
+					controller.release(start, failed=True)
+				raise
+			REQUEST_SECONDS.observe(time.perf_counter() - t1, host=breaker.host)
+			REQUESTS.inc(host=breaker.host, status=response.status_code)
+			record_rate_limit(breaker.host, response.headers.get('X-RateLimit-Remaining'), response.headers.get('X-RateLimit-Limit'))
+			breaker.record_status(response.status_code, response.headers)
+			if controller is not None:
+				controller.release(start, response.status_code)
+			return response
+
+	session = requests.Session()
+	adapter = PolicyAdapter(max_retries=policy.urllib3_retry(), pool_connections=pool_size, pool_maxsize=pool_size)
+	session.mount('https://', adapter)
+	session.mount('http://', adapter)
+	if user_agent:
+		session.headers.update({'User-Agent': user_agent})
+	return session
@@ -0,0 +1,234 @@
+import gzip
+import io
+import json
+import sys
+
+from seen_set import SeenSet
+
+READ_BUFFER_SIZE = 1024 * 1024
+
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# Values of the --compression flag. `auto` picks the codec from the file extension.
+COMPRESSIONS = ('auto', 'gzip', 'zstd', 'none')
+
+# Levels favouring speed: on large crawls writing is a real share of the runtime.
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+def import_zstandard():
+	try:
+		import zstandard
+	except ImportError:
+		raise RuntimeError("zstd compression requires the zstandard package, install it with `pip install zstandard`.")
+	return zstandard
+
+def get_compression(path, compression='auto'):
+	"""
+	Returns the codec to write `path` with, 'gzip', 'zstd' or None. With
+	`compression` set to `auto` it is chosen from the extension, `.gz` or `.zst`.
+	@param path: the file to write
+	@type path: str
+	@param compression: one of COMPRESSIONS
+	@type compression: str
+	@rtype str
+	"""
+	if compression and compression != 'auto':
+		return None if compression == 'none' else compression
+
+	if path.endswith('.gz'):
+		return 'gzip'
+	if path.endswith(('.zst', '.zstd')):
+		return 'zstd'
+	return None
+
+def open_input(path):
+	"""
+	Returns a binary file object for `path`. `-` reads from stdin; gzip and zstd
+	input are detected from their leading bytes, whatever the extension.
+	@param path: the file to read, or `-` for stdin
+	@type path: str
+	@rtype io.BufferedIOBase
+	"""
+	if path == '-':
+		f = sys.stdin.buffer
+	else:
+		f = open(path, 'rb', buffering=READ_BUFFER_SIZE)
+
+	head = f.peek(len(ZSTD_MAGIC))
+	if head[:len(GZIP_MAGIC)] == GZIP_MAGIC:
+		return io.BufferedReader(gzip.GzipFile(fileobj=f), buffer_size=READ_BUFFER_SIZE)
+	if head[:len(ZSTD_MAGIC)] == ZSTD_MAGIC:
+		zstandard = import_zstandard()
+		return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True), buffer_size=READ_BUFFER_SIZE)
+	return f
+
+def open_output(path, mode='w', compression='auto'):
+	"""
+	Returns a text file object writing UTF-8 to `path`, compressed according to
+	`compression`, see `get_compression()`. Files opened in append mode gain a
+	new gzip member or zstd frame, which readers handle transparently.
+	@param path: the file to write
+	@type path: str
+	@param mode: `w` to truncate or `a` to append
+	@type mode: str
+	@param compression: one of COMPRESSIONS
+	@type compression: str
+	@rtype io.TextIOBase
+	"""
+	codec = get_compression(path, compression)
+
+	if codec == 'gzip':
+		return gzip.open(path, mode + 't', compresslevel=GZIP_LEVEL, encoding='utf-8')
+
+	if codec == 'zstd':
+		zstandard = import_zstandard()
+		f = open(path, mode + 'b')
+		return io.TextIOWrapper(zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(f), encoding='utf-8')
+
+	return open(path, mode + 't', encoding='utf-8', buffering=WRITE_BUFFER_SIZE)
+
+def iter_compact_json(data, default=None):
+	"""
+	Yields `data` as compact JSON. Each item of a top-level list or dict is
+	encoded in a single call, which the C encoder handles much faster than
+	`json.dump()`'s many small writes, without building the whole document in
+	memory.
+	"""
+	def dumps(value):
+		return json.dumps(value, separators=(',', ':'), default=default)
+
+	if isinstance(data, dict):
+		yield '{'
+		for index, (key, value) in enumerate(data.items()):
+			yield (',' if index else '') + dumps(str(key)) + ':' + dumps(value)
+		yield '}'
+	elif isinstance(data, (list, tuple)):
+		yield '['
+		for index, value in enumerate(data):
+			yield (',' if index else '') + dumps(value)
+		yield ']'
+	else:
+		yield dumps(data)
+
+def save_json(path, data, compression='auto', pretty=False, default=None):
+	"""
+	Writes `data` to `path` as JSON, with compact separators unless `pretty`
+	is set, and compressed according to `compression`.
+	"""
+	with open_output(path, 'w', compression) as f:
+		if pretty:
+			json.dump(data, f, indent=2, default=default)
+		else:
+			f.writelines(iter_compact_json(data, default))
+
+def iter_entries(path):
+	"""
+	Yields the entries in a flat file, one per line. Blank lines and lines
+	starting with `#` or `//` are skipped.
+	@param path: the file to read, or `-` for stdin
+	@type path: str
+	"""
+	f = open_input(path)
+	try:
+		for line in f:
+			line = line.strip()
+			if not line or line.startswith((b'#', b'//')):
+				continue
+			yield line.decode('utf-8', errors='replace')
+	finally:
+		if path != '-':
+			f.close()
+
+class Deduper:
+	"""
+	Remembers the values it has been given so repeated values can be dropped.
+	Values are kept in a set until `max_memory_items` is reached, after which
+	they spill to a temporary on-disk `SeenSet` so memory stays bounded on
+	arbitrarily large inputs.
+	"""
+	def __init__(self, max_memory_items=1000000):
+		self.max_memory_items = max_memory_items
+		self.memory = set()
+		self.disk = None
+
+	def add(self, value):
+		"""
+		Returns True if `value` was not seen before, otherwise False.
+		"""
+		if value in self.memory:
+			return False
+
+		if self.disk is not None:
+			if self.disk.contains(value):
+				return False
+			self.disk.add(value)
+			return True
+
+		self.memory.add(value)
+		if len(self.memory) >= self.max_memory_items:
+			self.disk = SeenSet(None, capacity=max(self.max_memory_items * 10, 10000000), name='dedup')
+		return True
+
+	def close(self):
+		if self.disk is not None:
+			self.disk.close()
+			self.disk = None
+		self.memory = set()
+
+def read_batches(values=(), path=None, batch_size=100, max_memory_items=1000000):
+	"""
+	Yields lists of at most `batch_size` distinct entries, first from `values`
+	and then streamed from `path`. Duplicates are dropped across the whole input,
+	not just within a batch.
+	@param values: entries given directly, e.g. on the command line
+	@type values: list
+	@param path: the file to read, `-` for stdin, or None
+	@type path: str
+	@param batch_size: the number of entries per batch
+	@type batch_size: int
+	@param max_memory_items: the number of distinct entries kept in memory
+	before spilling to disk
+	@type max_memory_items: int
+	"""
+	deduper = Deduper(max_memory_items)
+	batch = []
+
+	def entries():
+		yield from values
+		if path:
+			yield from iter_entries(path)
+
+	try:
+		for entry in entries():
+			if deduper.add(entry):
+				batch.append(entry)
+				if len(batch) >= batch_size:
+					yield batch
+					batch = []
+
+		if batch:
+			yield batch
+	finally:
+		deduper.close()
+
+def batched(values, batch_size=100):
+	"""
+	Yields lists of at most `batch_size` consecutive entries of `values`.
+	@param values: any iterable, e.g. a generator streaming a file
+	@type values: iterable
+	@param batch_size: the number of entries per batch
+	@type batch_size: int
+	"""
+	batch = []
+	for value in values:
+		batch.append(value)
+		if len(batch) >= batch_size:
+			yield batch
+			batch = []
+
+	if batch:
+		yield batch
@@ -0,0 +1,232 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the latency histogram buckets.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class Metric:
+	"""
+	A metric with a value per combination of label values. Label values are
+	passed as keyword arguments named after `labelnames`.
+	"""
+	type = None
+
+	def __init__(self, name, help, labelnames=()):
+		self.name = name
+		self.help = help
+		self.labelnames = tuple(labelnames)
+		self.values = {}
+		self.lock = threading.Lock()
+
+	def _key(self, labels):
+		return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+	def samples(self):
+		with self.lock:
+			return [(dict(zip(self.labelnames, key)), value) for key, value in sorted(self.values.items())]
+
+class Counter(Metric):
+	type = 'counter'
+
+	def inc(self, value=1, **labels):
+		key = self._key(labels)
+		with self.lock:
+			self.values[key] = self.values.get(key, 0) + value
+
+class Gauge(Metric):
+	type = 'gauge'
+
+	def set(self, value, **labels):
+		key = self._key(labels)
+		with self.lock:
+			self.values[key] = value
+
+class Histogram(Metric):
+	"""
+	Counts observations into buckets of `buckets` upper bounds and keeps their
+	sum, as Prometheus histograms do.
+	"""
+	type = 'histogram'
+
+	def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+		super().__init__(name, help, labelnames)
+		self.buckets = tuple(sorted(buckets))
+
+	def observe(self, value, **labels):
+		key = self._key(labels)
+		with self.lock:
+			entry = self.values.get(key)
+			if entry is None:
+				entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+			for index, bound in enumerate(self.buckets):
+				if value <= bound:
+					entry[0][index] += 1
+					break
+			entry[1] += value
+			entry[2] += 1
+
+	@contextmanager
+	def time(self, **labels):
+		"""
+		Observes the seconds spent in the `with` block.
+		"""
+		t1 = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.observe(time.perf_counter() - t1, **labels)
+
+	def samples(self):
+		with self.lock:
+			return [(dict(zip(self.labelnames, key)), {'buckets': list(entry[0]), 'sum': entry[1], 'count': entry[2]})
+				for key, entry in sorted(self.values.items())]
+
+def escape_label(value):
+	return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels, extra=None):
+	items = list(labels.items()) + list((extra or {}).items())
+	if not items:
+		return ''
+	return '{%s}'%(','.join('%s="%s"'%(name, escape_label(str(value))) for name, value in items))
+
+def format_value(value):
+	if value == float('inf'):
+		return '+Inf'
+	if isinstance(value, float) and value.is_integer():
+		return str(int(value))
+	return repr(value) if isinstance(value, float) else str(value)
+
+class MetricsRegistry:
+	"""
+	The metrics of a process, exported as Prometheus text or as a JSON snapshot.
+	"""
+	def __init__(self):
+		self.metrics = {}
+		self.lock = threading.Lock()
+
+	def _register(self, cls, name, help, labelnames, **kwargs):
+		with self.lock:
+			metric = self.metrics.get(name)
+			if metric is None:
+				metric = self.metrics[name] = cls(name, help, labelnames, **kwargs)
+			return metric
+
+	def counter(self, name, help, labelnames=()):
+		return self._register(Counter, name, help, labelnames)
+
+	def gauge(self, name, help, labelnames=()):
+		return self._register(Gauge, name, help, labelnames)
+
+	def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+		return self._register(Histogram, name, help, labelnames, buckets=buckets)
+
+	def to_prometheus(self):
+		"""
+		Returns the metrics in the Prometheus text exposition format.
+		"""
+		lines = []
+		for name, metric in sorted(self.metrics.items()):
+			lines.append('# HELP %s %s'%(name, metric.help))
+			lines.append('# TYPE %s %s'%(name, metric.type))
+			for labels, value in metric.samples():
+				if metric.type != 'histogram':
+					lines.append('%s%s %s'%(name, format_labels(labels), format_value(value)))
+					continue
+
+				cumulative = 0
+				for bound, count in zip(metric.buckets, value['buckets']):
+					cumulative += count
+					lines.append('%s_bucket%s %s'%(name, format_labels(labels, {'le': format_value(float(bound))}), cumulative))
+				lines.append('%s_bucket%s %s'%(name, format_labels(labels, {'le': '+Inf'}), value['count']))
+				lines.append('%s_sum%s %s'%(name, format_labels(labels), format_value(value['sum'])))
+				lines.append('%s_count%s %s'%(name, format_labels(labels), value['count']))
+		return '\n'.join(lines) + '\n'
+
+	def snapshot(self):
+		"""
+		Returns the metrics as a dict, for JSON snapshots.
+		"""
+		metrics = {}
+		for name, metric in sorted(self.metrics.items()):
+			entry = {'type': metric.type, 'help': metric.help, 'samples': []}
+			if metric.type == 'histogram':
+				entry['buckets'] = list(metric.buckets)
+			for labels, value in metric.samples():
+				entry['samples'].append({'labels': labels, 'value': value})
+			metrics[name] = entry
+		return {'timestamp': time.time(), 'metrics': metrics}
+
+	def write(self, path):
+		"""
+		Writes the metrics to `path`, as Prometheus text for `.prom` files and
+		as JSON otherwise. The file is replaced atomically, so a collector
+		reading it, e.g. node_exporter's textfile collector, never sees half
+		a snapshot.
+		"""
+		if path.endswith('.prom'):
+			content = self.to_prometheus()
+		else:
+			content = json.dumps(self.snapshot(), indent=2)
+
+		temp_path = '%s.%s.tmp'%(path, os.getpid())
+		with open(temp_path, 'wt', encoding='utf-8') as f:
+			f.write(content)
+		os.replace(temp_path, path)
+
+class MetricsWriter:
+	"""
+	Writes the registry to `path` every `interval` seconds from a background
+	thread, and a last time on `stop()`.
+	"""
+	def __init__(self, registry, path, interval=60):
+		self.registry = registry
+		self.path = path
+		self.interval = interval
+		self.stopped = threading.Event()
+		self.thread = None
+
+	def __enter__(self):
+		self.start()
+		return self
+
+	def __exit__(self, *exc):
+		self.stop()
+
+	def start(self):
+		if self.interval:
+			self.thread = threading.Thread(target=self._run, daemon=True)
+			self.thread.start()
+
+	def _run(self):
+		while not self.stopped.wait(self.interval):
+			self.write()
+
+	def write(self):
+		try:
+			self.registry.write(self.path)
+		except OSError as e:
+			print("[-] An exception occurred while writing metrics: ", e)
+
+	def stop(self):
+		self.stopped.set()
+		if self.thread is not None:
+			self.thread.join()
+			self.thread = None
+		self.write()
+
+REGISTRY = MetricsRegistry()
+
+REQUESTS = REGISTRY.counter('gisthub_requests_total', 'HTTP requests by host and status, or error for requests without a response.', ('host', 'status'))
+REQUEST_SECONDS = REGISTRY.histogram('gisthub_request_seconds', 'HTTP request latency by host.', ('host',))
+DOWNLOADED_BYTES = REGISTRY.counter('gisthub_downloaded_bytes_total', 'Bytes of gist file content downloaded, by host.', ('host',))
+CACHE_LOOKUPS = REGISTRY.counter('gisthub_cache_lookups_total', 'Lookups in the seen set, the store revisions and the watch window, by result.', ('cache', 'result'))
+EXTRACT_SECONDS = REGISTRY.histogram('gisthub_extract_seconds', 'Time spent per text by each extractor.', ('extractor',))
+STAGE_SECONDS = REGISTRY.histogram('gisthub_stage_seconds', 'Time spent per item in each pipeline stage.', ('stage',))
+ITEMS = REGISTRY.counter('gisthub_items_total', 'Items through each pipeline stage, by outcome.', ('stage', 'outcome'))
+RATE_LIMIT = REGISTRY.gauge('gisthub_rate_limit', 'The request budget per rate limit window, by host, as last reported.', ('host',))
+RATE_LIMIT_REMAINING = REGISTRY.gauge('gisthub_rate_limit_remaining', 'The requests left in the rate limit window, by host, as last reported.', ('host',))
+CONCURRENCY_LIMIT = REGISTRY.gauge('gisthub_concurrency_limit', 'The adaptive limit of requests in flight, by host.', ('host',))
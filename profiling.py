@@ -0,0 +1,283 @@
+"""
+Profiling of production runs, scoped to the stages of the pipeline. With
+`--profile FILE` every stage gets its own cProfile profile, its wall and CPU
+time are measured per thread, so network wait shows as the difference, and
+tracemalloc records the peak memory and where it was allocated. The report is
+JSON with machine independent paths, so reports of two versions can be compared:
+
+	python profiling.py before.json after.json
+"""
+import cProfile
+import json
+import os
+import platform
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import nullcontext
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# The number of functions and allocation sites kept in the report.
+TOP_FUNCTIONS = 30
+TOP_ALLOCATIONS = 20
+
+_profiler = None
+_null_stage = nullcontext()
+
+def get_profiler():
+	return _profiler
+
+def set_profiler(profiler):
+	global _profiler
+	_profiler = profiler
+
+def profile_stage(name):
+	"""
+	Returns a context manager profiling the `with` block as stage `name` when
+	a profiler is set, and doing nothing otherwise.
+	"""
+	if _profiler is None:
+		return _null_stage
+	return _profiler.stage(name)
+
+def short_path(path):
+	"""
+	Returns `path` relative to the repository or to site-packages, so reports
+	made on different machines can be compared.
+	"""
+	if path.startswith(ROOT_DIR + os.sep):
+		return os.path.relpath(path, ROOT_DIR)
+	for marker in ('site-packages' + os.sep, 'dist-packages' + os.sep):
+		index = path.find(marker)
+		if index != -1:
+			return path[index + len(marker):]
+	if path.startswith(sys.prefix) or path.startswith(sys.base_prefix):
+		return os.path.join('<python>', os.path.basename(path))
+	return path
+
+class StageProfile:
+	def __init__(self):
+		self.calls = 0
+		self.wall = 0.0
+		self.cpu = 0.0
+		self.profiles = []
+
+class _StageContext:
+	def __init__(self, profiler, name):
+		self.profiler = profiler
+		self.name = name
+
+	def __enter__(self):
+		self.profiler._enter(self.name)
+
+	def __exit__(self, *exc):
+		self.profiler._exit(self.name)
+
+class Profiler:
+	"""
+	Profiles the stages entered with `stage()` from any thread. cProfile only
+	follows the thread it is enabled in, so every thread gets a profile per
+	stage and they are merged in the report. A profile covers its stage
+	exclusively: entering a nested stage, e.g. an extractor while recording
+	a gist, pauses the outer stage's profile. Wall and CPU times include
+	nested stages.
+
+	From Python 3.12 on cProfile allows a single enabled profile per process,
+	so only the main thread's stages are profiled there, and their functions
+	also include calls made on other threads meanwhile. Stages run on pool
+	threads, e.g. downloads, still get their wall and CPU times.
+	"""
+	def __init__(self, trace_memory=True):
+		self.trace_memory = trace_memory
+		self.profile_threads = sys.version_info < (3, 12)
+		self.stages = {}
+		self.lock = threading.Lock()
+		self.local = threading.local()
+		self.started = None
+		self.wall = 0.0
+		self.cpu = 0.0
+		self.memory = None
+
+	def start(self):
+		if self.trace_memory and not tracemalloc.is_tracing():
+			tracemalloc.start()
+		self.started = (time.perf_counter(), time.process_time())
+
+	def stop(self):
+		if self.started is None:
+			return
+		self.wall = time.perf_counter() - self.started[0]
+		self.cpu = time.process_time() - self.started[1]
+		self.started = None
+
+		if tracemalloc.is_tracing():
+			current, peak = tracemalloc.get_traced_memory()
+			top = tracemalloc.take_snapshot().statistics('lineno')[:TOP_ALLOCATIONS]
+			tracemalloc.stop()
+			self.memory = {
+				'peak_bytes': peak,
+				'current_bytes': current,
+				'top': [{
+					'location': '%s:%s'%(short_path(stat.traceback[0].filename), stat.traceback[0].lineno),
+					'bytes': stat.size,
+					'blocks': stat.count,
+				} for stat in top],
+			}
+
+	def stage(self, name):
+		return _StageContext(self, name)
+
+	def _thread_state(self):
+		state = getattr(self.local, 'state', None)
+		if state is None:
+			state = self.local.state = {'stack': [], 'profiles': {}}
+		return state
+
+	def _enable(self, state, name):
+		"""
+		Enables the profile of stage `name` in the calling thread and returns it,
+		or returns None where the thread cannot be profiled.
+		"""
+		if not self.profile_threads and threading.current_thread() is not threading.main_thread():
+			return None
+
+		profile = state['profiles'].get(name) or cProfile.Profile()
+		try:
+			profile.enable()
+		except ValueError:
+			# Another profiler, e.g. a debugger, holds the process-wide slot.
+			return None
+
+		if name not in state['profiles']:
+			state['profiles'][name] = profile
+			with self.lock:
+				self.stages[name].profiles.append(profile)
+		return profile
+
+	def _enter(self, name):
+		state = self._thread_state()
+		stack = state['stack']
+		if stack and stack[-1][1] is not None:
+			stack[-1][1].disable()
+
+		with self.lock:
+			self.stages.setdefault(name, StageProfile())
+		profile = self._enable(state, name)
+		stack.append((name, profile, time.perf_counter(), time.thread_time()))
+
+	def _exit(self, name):
+		state = self._thread_state()
+		stack = state['stack']
+		_, profile, wall, cpu = stack.pop()
+		if profile is not None:
+			profile.disable()
+		wall = time.perf_counter() - wall
+		cpu = time.thread_time() - cpu
+
+		with self.lock:
+			stage = self.stages[name]
+			stage.calls += 1
+			stage.wall += wall
+			stage.cpu += cpu
+
+		if stack:
+			outer_name, outer_profile, outer_wall, outer_cpu = stack[-1]
+			if outer_profile is not None:
+				stack[-1] = (outer_name, self._enable(state, outer_name), outer_wall, outer_cpu)
+
+	def report(self):
+		"""
+		Returns the report as a dict: the wall, CPU and wait time of every stage
+		with its most expensive functions, and the memory peak.
+		"""
+		stages = {}
+		with self.lock:
+			items = sorted(self.stages.items())
+
+		for name, stage in items:
+			functions = []
+			profiles = [profile for profile in stage.profiles if profile.getstats()]
+			if profiles:
+				stats = pstats.Stats(profiles[0])
+				for profile in profiles[1:]:
+					stats.add(profile)
+
+				rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:TOP_FUNCTIONS]
+				for (filename, lineno, function), (_, calls, total, cumulative, _) in rows:
+					functions.append({
+						'function': '%s:%s(%s)'%(short_path(filename), lineno, function) if lineno else function,
+						'calls': calls,
+						'total_seconds': total,
+						'cumulative_seconds': cumulative,
+					})
+
+			stages[name] = {
+				'calls': stage.calls,
+				'wall_seconds': stage.wall,
+				'cpu_seconds': stage.cpu,
+				'wait_seconds': max(0.0, stage.wall - stage.cpu),
+				'functions': functions,
+			}
+
+		return {
+			'timestamp': time.time(),
+			'python': platform.python_version(),
+			'platform': platform.platform(),
+			'argv': sys.argv[1:],
+			'wall_seconds': self.wall,
+			'cpu_seconds': self.cpu,
+			'memory': self.memory,
+			'stages': stages,
+		}
+
+	def write(self, path):
+		with open(path, 'wt', encoding='utf-8') as f:
+			json.dump(self.report(), f, indent=2, sort_keys=True)
+
+def format_change(old, new):
+	if not old:
+		return ''
+	return '%+6.1f%%'%((new / old - 1) * 100)
+
+def compare_reports(old, new):
+	"""
+	Prints the wall, CPU and wait time of every stage of report `new` next to
+	its change from report `old`, and the change of the memory peak.
+	"""
+	print("%-22s %7s %10s %8s %10s %8s %10s %8s"%('stage', 'calls', 'wall s', '', 'cpu s', '', 'wait s', ''))
+	names = sorted(set(old['stages']) | set(new['stages']))
+	for name in names:
+		before = old['stages'].get(name) or {}
+		after = new['stages'].get(name)
+		if after is None:
+			print("%-22s %7s"%(name, 'removed'))
+			continue
+		print("%-22s %7s %10.3f %8s %10.3f %8s %10.3f %8s"%(name, after['calls'],
+			after['wall_seconds'], format_change(before.get('wall_seconds'), after['wall_seconds']),
+			after['cpu_seconds'], format_change(before.get('cpu_seconds'), after['cpu_seconds']),
+			after['wait_seconds'], format_change(before.get('wait_seconds'), after['wait_seconds'])))
+
+	print()
+	print("%-22s %7s %10.3f %8s %10.3f %8s"%('total', '', new['wall_seconds'], format_change(old['wall_seconds'], new['wall_seconds']),
+		new['cpu_seconds'], format_change(old['cpu_seconds'], new['cpu_seconds'])))
+	if old.get('memory') and new.get('memory'):
+		print("%-22s %7s %10.1f %8s"%('peak memory MB', '', new['memory']['peak_bytes'] / 1e6,
+			format_change(old['memory']['peak_bytes'], new['memory']['peak_bytes'])))
+
+def main():
+	if len(sys.argv) != 3:
+		print("usage: python profiling.py OLD_REPORT NEW_REPORT")
+		return 1
+
+	reports = []
+	for path in sys.argv[1:]:
+		with open(path, 'rt', encoding='utf-8') as f:
+			reports.append(json.load(f))
+	compare_reports(*reports)
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
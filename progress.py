@@ -0,0 +1,143 @@
+import sys
+import threading
+import time
+
+from metrics import DOWNLOADED_BYTES, ITEMS, RATE_LIMIT, RATE_LIMIT_REMAINING
+
+# Seconds between progress lines when the output is not a terminal.
+LOG_INTERVAL = 30
+
+def format_duration(seconds):
+	seconds = int(seconds)
+	if seconds >= 3600:
+		return '%dh%02dm'%(seconds // 3600, seconds % 3600 // 60)
+	if seconds >= 60:
+		return '%dm%02ds'%(seconds // 60, seconds % 60)
+	return '%ds'%(seconds)
+
+def format_bytes(count):
+	for unit in ('B', 'KB', 'MB', 'GB'):
+		if count < 1000:
+			return '%.1f %s'%(count, unit)
+		count /= 1000
+	return '%.1f TB'%(count)
+
+def metric_total(metric, **labels):
+	return sum(value for sample_labels, value in metric.samples() if all(sample_labels.get(name) == str(label) for name, label in labels.items()))
+
+class ProgressReporter:
+	"""
+	Reports how far a run is from a background thread: the `unit` items done
+	out of `total`, the gists recorded and bytes downloaded per second, the
+	requests in flight, the API rate limit left and an ETA. The figures are read
+	from the metrics and the concurrency `controllers`, so the pipeline only
+	calls `advance()` once per item.
+
+	On a terminal the report is a status line on stderr redrawn every `interval`
+	seconds; otherwise a log line is printed every LOG_INTERVAL seconds instead.
+	"""
+	def __init__(self, total=None, unit='items', controllers=None, rate_limit_host=None, interval=1.0, stream=None):
+		self.total = total
+		self.unit = unit
+		self.controllers = controllers
+		self.rate_limit_host = rate_limit_host
+		self.stream = stream or sys.stderr
+		self.tty = self.stream.isatty()
+		self.interval = interval if self.tty else max(interval, LOG_INTERVAL)
+
+		self.done = 0
+		self.started = None
+		self.last = None
+		self.stopped = threading.Event()
+		self.thread = None
+
+	def __enter__(self):
+		self.start()
+		return self
+
+	def __exit__(self, *exc):
+		self.stop()
+
+	def advance(self, count=1):
+		self.done += count
+
+	def count(self, batches):
+		"""
+		Yields the lists of entries in `batches`, setting `total` to the number
+		of entries as soon as the last batch has been read. Until then the
+		total is unknown, so input streamed from a file is only read once.
+		"""
+		total = 0
+		previous = None
+		for batch in batches:
+			if previous is not None:
+				yield previous
+			total += len(batch)
+			previous = batch
+		self.total = total
+		if previous is not None:
+			yield previous
+
+	def start(self):
+		self.started = time.monotonic()
+		self.last = (self.started, 0, 0)
+		self.thread = threading.Thread(target=self._run, daemon=True)
+		self.thread.start()
+
+	def stop(self):
+		self.stopped.set()
+		if self.thread is not None:
+			self.thread.join()
+			self.thread = None
+			self.report(final=True)
+
+	def _run(self):
+		while not self.stopped.wait(self.interval):
+			self.report()
+
+	def status(self):
+		"""
+		Returns the current progress as a line of text.
+		"""
+		now = time.monotonic()
+		gists = metric_total(ITEMS, stage='record') + metric_total(ITEMS, stage='search_gist', outcome='ok')
+		downloaded = metric_total(DOWNLOADED_BYTES)
+
+		# Rates are over the last refresh, the ETA over the whole run.
+		last_time, last_gists, last_bytes = self.last
+		self.last = (now, gists, downloaded)
+		elapsed = max(now - last_time, 1e-6)
+
+		parts = []
+		if self.total:
+			parts.append('%s %s/%s (%.1f%%)'%(self.unit, self.done, self.total, min(100.0, self.done * 100 / self.total)))
+		else:
+			parts.append('%s %s'%(self.unit, self.done))
+		parts.append('%s gists, %.1f/s'%(gists, (gists - last_gists) / elapsed))
+		parts.append('%s/s'%(format_bytes((downloaded - last_bytes) / elapsed)))
+
+		if self.controllers is not None:
+			in_flight = sum(snapshot['in_flight'] for snapshot in self.controllers.snapshot().values())
+			parts.append('%s in flight'%(in_flight))
+
+		if self.rate_limit_host is not None:
+			remaining = metric_total(RATE_LIMIT_REMAINING, host=self.rate_limit_host)
+			limit = metric_total(RATE_LIMIT, host=self.rate_limit_host)
+			if limit:
+				parts.append('rate limit %s/%s'%(remaining, limit))
+
+		run_time = now - self.started
+		if self.total and self.done:
+			remaining_items = max(0, self.total - self.done)
+			parts.append('ETA %s'%(format_duration(remaining_items * run_time / self.done)))
+		parts.append('elapsed %s'%(format_duration(run_time)))
+		return ' | '.join(parts)
+
+	def report(self, final=False):
+		line = self.status()
+		if self.tty:
+			# Redraw the status line in place; the last one is kept.
+			self.stream.write('\r\x1b[K' + line + ('\n' if final else ''))
+		else:
+			self.stream.write('[+] Progress: ' + line + '\n')
+		self.stream.flush()
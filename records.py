@@ -0,0 +1,72 @@
+import sys
+
+EMPTY = ()
+
+def intern_all(values, existing=EMPTY):
+	"""
+	Returns the distinct strings in `existing` and `values` as a tuple of interned
+	strings, so artifacts repeated across gists (common urls, shared emails) are
+	stored once. A tuple costs a fraction of a set and the empty tuple is shared.
+	"""
+	merged = set(existing)
+	merged.update(sys.intern(value) for value in values if value)
+	if len(merged) == len(existing):
+		return existing
+	return tuple(merged) or EMPTY
+
+class GistRecord:
+	"""
+	The metadata and artifacts of a gist, or of all the gists of an owner.
+	Artifacts are deduplicated through sets on the way in and stored as tuples,
+	and only the owner login is kept rather than the PyGithub user object.
+	"""
+	__slots__ = ('id', 'owner', 'url', 'is_public', 'files', 'emails', 'phone_numbers', 'urls')
+
+	def __init__(self, id=None, owner=None, url=None, is_public=None, files=(), emails=(), phone_numbers=(), urls=()):
+		self.id = id
+		self.owner = sys.intern(owner) if owner else owner
+		self.url = url
+		self.is_public = is_public
+		self.files = tuple(sys.intern(file) for file in files if file)
+		self.emails = intern_all(emails)
+		self.phone_numbers = intern_all(phone_numbers)
+		self.urls = intern_all(urls)
+
+	def add_files(self, files):
+		known = set(self.files)
+		self.files += tuple(sys.intern(file) for file in files if file and file not in known)
+
+	def update(self, emails=(), phone_numbers=(), urls=()):
+		"""
+		Merges extracted artifacts into the record.
+		"""
+		self.emails = intern_all(emails, self.emails)
+		self.phone_numbers = intern_all(phone_numbers, self.phone_numbers)
+		self.urls = intern_all(urls, self.urls)
+
+	def to_dict(self):
+		"""
+		Returns the record in the layout used by the metadata files. The `id` key
+		is left out of owner records.
+		"""
+		data = {}
+		if self.id is not None:
+			data['id'] = self.id
+		data.update({
+			'owner': self.owner,
+			'url': self.url,
+			'is_public': self.is_public,
+			'files': list(self.files),
+			'emails': sorted(self.emails),
+			'phone_numbers': sorted(self.phone_numbers),
+			'urls': sorted(self.urls),
+		})
+		return data
+
+def encode_record(obj):
+	"""
+	A `default` hook for `json.dump()` which serializes records directly.
+	"""
+	if isinstance(obj, GistRecord):
+		return obj.to_dict()
+	raise TypeError("Object of type %s is not JSON serializable"%(type(obj).__name__))
@@ -0,0 +1,299 @@
+import hashlib
+import math
+import mmap
+import os
+import shutil
+import sqlite3
+import struct
+import tempfile
+from collections import deque
+
+from metrics import CACHE_LOOKUPS
+
+BLOOM_MAGIC = b'GHBF'
+BLOOM_HEADER = struct.Struct('<4sIQQ')
+
+# SeenSet.add() records a gist under its id and under its id and revision.
+KEYS_PER_GIST = 2
+
+class BloomFilter:
+	"""
+	A bloom filter whose bit array lives in a memory-mapped file, so only the
+	pages being touched are resident no matter how many keys were added.
+	The file is created on first use and sized for `capacity` keys at a false
+	positive rate of `error_rate`.
+	"""
+	def __init__(self, path, capacity=100000000, error_rate=0.01):
+		self.path = path
+
+		if os.path.exists(path) and os.path.getsize(path) > BLOOM_HEADER.size:
+			with open(path, 'rb') as f:
+				magic, self.k, self.m, _ = BLOOM_HEADER.unpack(f.read(BLOOM_HEADER.size))
+			if magic != BLOOM_MAGIC:
+				raise ValueError("'%s' is not a bloom filter file."%(path))
+		else:
+			self.m = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+			self.k = max(1, round(self.m / capacity * math.log(2)))
+			with open(path, 'wb') as f:
+				f.write(BLOOM_HEADER.pack(BLOOM_MAGIC, self.k, self.m, 0))
+				f.truncate(BLOOM_HEADER.size + (self.m + 7) // 8)
+
+		self.file = open(path, 'r+b')
+		self.bits = mmap.mmap(self.file.fileno(), 0)
+
+	@property
+	def synced(self):
+		"""
+		The last SQLite row id folded into the filter.
+		"""
+		return BLOOM_HEADER.unpack_from(self.bits)[3]
+
+	@synced.setter
+	def synced(self, rowid):
+		BLOOM_HEADER.pack_into(self.bits, 0, BLOOM_MAGIC, self.k, self.m, rowid)
+
+	def _positions(self, key):
+		digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+		h1 = int.from_bytes(digest[:8], 'little')
+		h2 = int.from_bytes(digest[8:], 'little') | 1
+		m = self.m
+		return [(h1 + i * h2) % m for i in range(self.k)]
+
+	def add(self, key):
+		bits = self.bits
+		offset = BLOOM_HEADER.size
+		for pos in self._positions(key):
+			index = offset + (pos >> 3)
+			bits[index] |= 1 << (pos & 7)
+
+	def __contains__(self, key):
+		bits = self.bits
+		offset = BLOOM_HEADER.size
+		for pos in self._positions(key):
+			if not bits[offset + (pos >> 3)] & (1 << (pos & 7)):
+				return False
+		return True
+
+	def flush(self):
+		self.bits.flush()
+
+	def close(self):
+		if self.bits is not None:
+			self.bits.flush()
+			self.bits.close()
+			self.file.close()
+			self.bits = None
+
+class SeenSet:
+	"""
+	A persistent set of processed gists keyed by gist id and revision.
+	Membership is first tested against a bloom filter, which answers almost
+	every unseen key without touching disk; positives are confirmed against an
+	exact SQLite index so a false positive never drops a gist. The filter is
+	sized for `capacity` gists, each added under two keys.
+
+	`path` is the SQLite file; the bloom filter is kept in `bloom_path`, by
+	default `path + '.bloom'`. Both can be shared between runs and between
+	processes on one host only, not over a network filesystem: the SQLite file
+	is in WAL mode and the filter is memory-mapped. Runs on several nodes share
+	a `RedisSeenSet` instead. Added keys are kept in
+	memory until the next commit, which writes them to SQLite and folds every
+	row the filter does not hold yet, from this process or another, into the
+	filter. Commits hold SQLite's write lock throughout, so processes never
+	update the filter at the same time. With `path` set to None both files
+	are created in a temporary directory which is removed on `close()`.
+
+	Lookups are counted in the gisthub_cache_lookups_total metric under `name`.
+	"""
+	def __init__(self, path, capacity=100000000, error_rate=0.01, commit_every=1000, bloom_path=None, name='seen'):
+		self.name = name
+		self.temp_dir = None
+		if path is None:
+			self.temp_dir = tempfile.mkdtemp(prefix='gisthub-seen-')
+			path = os.path.join(self.temp_dir, 'seen.db')
+
+		self.path = path
+		self.commit_every = commit_every
+		self.pending = 0
+		self.recent = set()
+
+		self.conn = sqlite3.connect(path, timeout=60)
+		self.conn.execute("PRAGMA journal_mode=WAL")
+		self.conn.execute("PRAGMA synchronous=NORMAL")
+		self.conn.execute("CREATE TABLE IF NOT EXISTS seen (id INTEGER PRIMARY KEY, key TEXT NOT NULL UNIQUE)")
+		self.conn.commit()
+
+		self.bloom = BloomFilter(bloom_path or path + '.bloom', capacity * KEYS_PER_GIST, error_rate)
+		self.commit()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	@staticmethod
+	def make_key(gist_id, revision=None):
+		if revision:
+			return '%s@%s'%(gist_id, revision)
+		return str(gist_id)
+
+	def contains(self, gist_id, revision=None):
+		"""
+		Returns True if the gist was processed before. Without a `revision`,
+		any processed revision of the gist counts.
+		"""
+		key = self.make_key(gist_id, revision)
+		if key in self.recent:
+			CACHE_LOOKUPS.inc(cache=self.name, result='hit')
+			return True
+		if key not in self.bloom:
+			CACHE_LOOKUPS.inc(cache=self.name, result='miss')
+			return False
+		found = self.conn.execute("SELECT 1 FROM seen WHERE key = ?", (key,)).fetchone() is not None
+		CACHE_LOOKUPS.inc(cache=self.name, result='hit' if found else 'false_positive')
+		return found
+
+	def add(self, gist_id, revision=None):
+		"""
+		Marks the gist as processed, both as a whole and at `revision`.
+		Keys are written to SQLite and the filter in bulk on the next commit.
+		"""
+		self.recent.add(self.make_key(gist_id))
+		if revision:
+			self.recent.add(self.make_key(gist_id, revision))
+
+		self.pending += 1
+		if self.pending >= self.commit_every:
+			self.commit()
+
+	def sync(self):
+		"""
+		Adds the keys written to SQLite since the last sync to the bloom filter.
+		Only called within the write transaction of `commit()`.
+		"""
+		synced = self.bloom.synced
+		for rowid, key in self.conn.execute("SELECT id, key FROM seen WHERE id > ? ORDER BY id", (synced,)):
+			self.bloom.add(key)
+			synced = rowid
+		self.bloom.synced = synced
+
+	def commit(self):
+		# The write lock taken up front also guards the shared filter.
+		self.conn.execute("BEGIN IMMEDIATE")
+		try:
+			self.conn.executemany("INSERT OR IGNORE INTO seen (key) VALUES (?)", [(key,) for key in self.recent])
+			self.sync()
+			self.conn.commit()
+		except BaseException:
+			self.conn.rollback()
+			raise
+		self.recent.clear()
+		self.pending = 0
+
+	def close(self):
+		if self.conn is not None:
+			self.commit()
+			self.conn.close()
+			self.bloom.close()
+			self.conn = None
+
+			if self.temp_dir is not None:
+				shutil.rmtree(self.temp_dir, ignore_errors=True)
+				self.temp_dir = None
+
+class RedisSeenSet:
+	"""
+	A set of processed gists with the interface of `SeenSet`, kept in the Redis
+	set `prefix` so that runs on several nodes skip each other's gists. Every
+	lookup is a round trip to the server and every key is held in its memory,
+	about 100 bytes per key, two per gist. `client` is any object with the
+	redis-py interface, such as a fakeredis client in tests.
+
+	Added keys are kept in memory until the next commit, which sends them in
+	pipelined batches.
+	"""
+	def __init__(self, url=None, prefix='gisthub:seen', commit_every=1000, client=None, name='seen'):
+		if client is None:
+			import redis
+			client = redis.Redis.from_url(url)
+
+		self.redis = client
+		self.prefix = prefix
+		self.commit_every = commit_every
+		self.name = name
+		self.pending = 0
+		self.recent = set()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	make_key = staticmethod(SeenSet.make_key)
+
+	def contains(self, gist_id, revision=None):
+		key = self.make_key(gist_id, revision)
+		found = key in self.recent or bool(self.redis.sismember(self.prefix, key))
+		CACHE_LOOKUPS.inc(cache=self.name, result='hit' if found else 'miss')
+		return found
+
+	def add(self, gist_id, revision=None):
+		self.recent.add(self.make_key(gist_id))
+		if revision:
+			self.recent.add(self.make_key(gist_id, revision))
+
+		self.pending += 1
+		if self.pending >= self.commit_every:
+			self.commit()
+
+	def commit(self, batch_size=1000):
+		keys = list(self.recent)
+		if keys:
+			pipe = self.redis.pipeline(transaction=False)
+			for start in range(0, len(keys), batch_size):
+				pipe.sadd(self.prefix, *keys[start:start + batch_size])
+			pipe.execute()
+		self.recent.clear()
+		self.pending = 0
+
+	def close(self):
+		self.commit()
+
+def open_seen_set(location):
+	"""
+	Returns the seen set at `location`, a `redis://` url or a SQLite file path.
+	"""
+	if location.startswith(('redis://', 'rediss://', 'unix://')):
+		return RedisSeenSet(location)
+	return SeenSet(location)
+
+class SeenWindow:
+	"""
+	The last `size` keys seen, for dropping the items a polled feed returns
+	again on every poll. Once `size` keys are held the oldest is forgotten, so
+	memory stays flat however long the feed is watched.
+	"""
+	def __init__(self, size=10000):
+		self.keys = deque(maxlen=size)
+		self.members = set()
+
+	def __contains__(self, key):
+		return key in self.members
+
+	def __len__(self):
+		return len(self.members)
+
+	def add(self, key):
+		"""
+		Returns True if `key` was not in the window, otherwise False.
+		"""
+		if key in self.members:
+			return False
+
+		if len(self.keys) == self.keys.maxlen:
+			self.members.discard(self.keys[0])
+		self.keys.append(key)
+		self.members.add(key)
+		return True
@@ -0,0 +1,46 @@
+import json
+
+from records import encode_record
+
+# Sinks receive every gist the pipeline records, see `iter_user_gists()`,
+# `iter_gists()` and `iter_search()` in gisthub.py. A sink is any object with
+# an `add(record, data)` method, `record` being the GistRecord of the gist and
+# `data` its API representation, or its .json view for search results.
+
+class CollectSink:
+	"""
+	Keeps the data of every distinct gist, in the order they were recorded,
+	e.g. for saving with `save_json()`.
+	"""
+	def __init__(self):
+		self.data = []
+		self.ids = set()
+
+	def add(self, record, data):
+		if record.id in self.ids:
+			return
+		self.ids.add(record.id)
+		self.data.append(data)
+
+class JsonLinesSink:
+	"""
+	Writes every record to `output` as a compact JSON line.
+	"""
+	def __init__(self, output):
+		self.output = output
+
+	def add(self, record, data):
+		self.output.write(json.dumps(record, separators=(',', ':'), default=encode_record) + '\n')
+
+	def flush(self):
+		self.output.flush()
+
+class CallbackSink:
+	"""
+	Calls `func` with the record and data of every gist.
+	"""
+	def __init__(self, func):
+		self.func = func
+
+	def add(self, record, data):
+		self.func(record, data)
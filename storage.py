@@ -0,0 +1,310 @@
+import sqlite3
+import time
+from urllib.parse import urlparse
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS owners (
+	login TEXT PRIMARY KEY,
+	first_seen REAL,
+	last_seen REAL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS gists (
+	id TEXT PRIMARY KEY,
+	owner TEXT,
+	url TEXT,
+	is_public INTEGER,
+	created_at TEXT,
+	updated_at TEXT,
+	fetched_at REAL,
+	version TEXT
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS gists_owner ON gists (owner);
+
+CREATE TABLE IF NOT EXISTS files (
+	gist_id TEXT,
+	filename TEXT,
+	raw_url TEXT,
+	type TEXT,
+	language TEXT,
+	size INTEGER,
+	extracted INTEGER NOT NULL DEFAULT 0,
+	PRIMARY KEY (gist_id, filename)
+) WITHOUT ROWID;
+
+-- The artifacts of every file, so that a gist whose files partly changed only
+-- needs the changed files downloaded again.
+CREATE TABLE IF NOT EXISTS file_artifacts (
+	gist_id TEXT,
+	filename TEXT,
+	kind TEXT,
+	value TEXT,
+	PRIMARY KEY (gist_id, filename, kind, value)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS emails (
+	value TEXT,
+	gist_id TEXT,
+	owner TEXT,
+	domain_rev TEXT,
+	PRIMARY KEY (value, gist_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS emails_domain ON emails (domain_rev);
+CREATE INDEX IF NOT EXISTS emails_owner ON emails (owner);
+CREATE INDEX IF NOT EXISTS emails_gist ON emails (gist_id);
+
+CREATE TABLE IF NOT EXISTS phone_numbers (
+	value TEXT,
+	gist_id TEXT,
+	owner TEXT,
+	PRIMARY KEY (value, gist_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS phone_numbers_owner ON phone_numbers (owner);
+CREATE INDEX IF NOT EXISTS phone_numbers_gist ON phone_numbers (gist_id);
+
+CREATE TABLE IF NOT EXISTS urls (
+	value TEXT,
+	gist_id TEXT,
+	owner TEXT,
+	host_rev TEXT,
+	PRIMARY KEY (value, gist_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS urls_host ON urls (host_rev);
+CREATE INDEX IF NOT EXISTS urls_owner ON urls (owner);
+CREATE INDEX IF NOT EXISTS urls_gist ON urls (gist_id);
+"""
+
+def reverse_host(host):
+	"""
+	Returns `host` lowercased with its labels reversed and a trailing dot, e.g.
+	`api.example.com` becomes `com.example.api.`. Reversed hosts sort subdomains
+	next to their parent so that wildcard lookups become index range scans.
+	@param host: the host to reverse
+	@type host: str
+	@rtype str
+	"""
+	if not host:
+		return None
+
+	labels = host.strip('.').lower().split('.')
+	return '.'.join(reversed(labels)) + '.'
+
+def get_url_host(url):
+	"""
+	Returns the lowercased host of `url`, or None if it has none.
+	@param url: the url to parse
+	@type url: str
+	@rtype str
+	"""
+	try:
+		if '//' not in url:
+			url = '//' + url
+		return urlparse(url).hostname
+	except ValueError:
+		return None
+
+def host_range(pattern):
+	"""
+	Returns the (exact, prefix) pair of reversed hosts matching `pattern`.
+	`example.com` only matches that host while `*.example.com` also matches
+	every subdomain of it.
+	@param pattern: the host or wildcard pattern
+	@type pattern: str
+	@rtype tuple
+	"""
+	wildcard = pattern.startswith('*')
+	rev = reverse_host(pattern.lstrip('*.'))
+	return rev, (rev if wildcard else None)
+
+class ArtifactStore:
+	"""
+	An indexed SQLite store for gists and the artifacts extracted from them.
+	Gists are written as they are crawled and committed every `commit_every`
+	gists, so a store stays usable even if a crawl is interrupted. The same
+	file can be reused across runs.
+	"""
+	def __init__(self, path, commit_every=100):
+		self.path = path
+		self.commit_every = commit_every
+		self.pending = 0
+
+		self.conn = sqlite3.connect(path)
+		self.conn.execute("PRAGMA journal_mode=WAL")
+		self.conn.execute("PRAGMA synchronous=NORMAL")
+		self.conn.executescript(SCHEMA)
+		self._migrate()
+
+	def _migrate(self):
+		# Stores written before revision tracking lack these columns.
+		columns = {
+			'gists': [('version', 'TEXT')],
+			'files': [('extracted', 'INTEGER NOT NULL DEFAULT 0')],
+		}
+		for table, added in columns.items():
+			existing = {row[1] for row in self.conn.execute("PRAGMA table_info(%s)"%(table))}
+			for name, definition in added:
+				if name not in existing:
+					self.conn.execute("ALTER TABLE %s ADD COLUMN %s %s"%(table, name, definition))
+		self.conn.commit()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def get_revision(self, id):
+		"""
+		Returns what the store knows about the revision of gist `id`: a dict with
+		its `updated_at`, `version` and `files`, which maps every filename to its
+		(raw_url, size, extracted) triple. Returns None for unknown gists.
+		"""
+		id = str(id)
+		row = self.conn.execute("SELECT updated_at, version FROM gists WHERE id = ?", (id,)).fetchone()
+		if row is None:
+			return None
+
+		files = {filename: (raw_url, size, bool(extracted)) for filename, raw_url, size, extracted in
+			self.conn.execute("SELECT filename, raw_url, size, extracted FROM files WHERE gist_id = ?", (id,))}
+		return {'updated_at': row[0], 'version': row[1], 'files': files}
+
+	def get_file_artifacts(self, id, filenames):
+		"""
+		Returns the (emails, phone_numbers, urls) sets recorded for the files of
+		gist `id` named in `filenames`.
+		"""
+		artifacts = {'email': set(), 'phone_number': set(), 'url': set()}
+		filenames = list(filenames)
+		for start in range(0, len(filenames), 500):
+			chunk = filenames[start:start + 500]
+			rows = self.conn.execute("SELECT kind, value FROM file_artifacts WHERE gist_id = ? AND filename IN (%s)"%(', '.join('?' * len(chunk))),
+				[str(id)] + chunk)
+			for kind, value in rows:
+				artifacts[kind].add(value)
+		return artifacts['email'], artifacts['phone_number'], artifacts['url']
+
+	def add_gist(self, id, owner, url=None, is_public=None, files=(), emails=(), phone_numbers=(), urls=(), created_at=None, updated_at=None, version=None, file_artifacts=None):
+		"""
+		Adds a gist and its artifacts to the store. `emails`, `phone_numbers` and
+		`urls` are all the artifacts of the gist, including those of files that
+		were not downloaded again, and replace the ones recorded before, so that
+		artifacts removed from the gist drop out of queries.
+		@param files: the gist files, either filenames or dicts with `filename`,
+		`raw_url`, `type`, `language` and `size` keys
+		@type files: list
+		@param file_artifacts: the (emails, phone_numbers, urls) extracted from each
+		file that was downloaded, by filename. Files missing from it keep their
+		recorded artifacts as long as their raw url and size are unchanged.
+		@type file_artifacts: dict
+		"""
+		now = time.time()
+		id = str(id)
+		cur = self.conn.cursor()
+
+		if owner:
+			cur.execute("INSERT INTO owners (login, first_seen, last_seen) VALUES (?, ?, ?) "
+				"ON CONFLICT (login) DO UPDATE SET last_seen = excluded.last_seen", (owner, now, now))
+
+		cur.execute("INSERT OR REPLACE INTO gists (id, owner, url, is_public, created_at, updated_at, fetched_at, version) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+			(id, owner, url, None if is_public is None else int(is_public),
+			None if created_at is None else str(created_at), None if updated_at is None else str(updated_at), now, version))
+
+		file_artifacts = file_artifacts or {}
+
+		rows = []
+		for file in files:
+			if isinstance(file, dict):
+				filename = file.get('filename')
+				rows.append((id, filename, file.get('raw_url'), file.get('type'), file.get('language'), file.get('size'), int(filename in file_artifacts)))
+			else:
+				rows.append((id, file, None, None, None, None, int(file in file_artifacts)))
+		# A file stays extracted while its raw url, which carries its revision, and its size are unchanged.
+		cur.executemany("INSERT INTO files (gist_id, filename, raw_url, type, language, size, extracted) VALUES (?, ?, ?, ?, ?, ?, ?) "
+			"ON CONFLICT (gist_id, filename) DO UPDATE SET raw_url = excluded.raw_url, type = excluded.type, language = excluded.language, size = excluded.size, "
+			"extracted = CASE WHEN excluded.extracted THEN 1 WHEN files.raw_url IS excluded.raw_url AND files.size IS excluded.size THEN files.extracted ELSE 0 END", rows)
+
+		if rows and all(isinstance(file, dict) for file in files):
+			# The full file list is known, so files deleted from the gist are dropped.
+			filenames = [row[1] for row in rows]
+			placeholders = ', '.join('?' * len(filenames))
+			cur.execute("DELETE FROM files WHERE gist_id = ? AND filename NOT IN (%s)"%(placeholders), [id] + filenames)
+			cur.execute("DELETE FROM file_artifacts WHERE gist_id = ? AND filename NOT IN (%s)"%(placeholders), [id] + filenames)
+
+		for filename, (file_emails, file_phone_numbers, file_urls) in file_artifacts.items():
+			cur.execute("DELETE FROM file_artifacts WHERE gist_id = ? AND filename = ?", (id, filename))
+			cur.executemany("INSERT OR IGNORE INTO file_artifacts (gist_id, filename, kind, value) VALUES (?, ?, ?, ?)",
+				[(id, filename, 'email', value) for value in file_emails] +
+				[(id, filename, 'phone_number', value) for value in file_phone_numbers] +
+				[(id, filename, 'url', value) for value in file_urls])
+
+		for table in ('emails', 'phone_numbers', 'urls'):
+			cur.execute("DELETE FROM %s WHERE gist_id = ?"%(table), (id,))
+
+		cur.executemany("INSERT OR IGNORE INTO emails (value, gist_id, owner, domain_rev) VALUES (?, ?, ?, ?)",
+			[(email, id, owner, reverse_host(email.rsplit('@', 1)[-1])) for email in emails])
+		cur.executemany("INSERT OR IGNORE INTO phone_numbers (value, gist_id, owner) VALUES (?, ?, ?)",
+			[(pn, id, owner) for pn in phone_numbers])
+		cur.executemany("INSERT OR IGNORE INTO urls (value, gist_id, owner, host_rev) VALUES (?, ?, ?, ?)",
+			[(url, id, owner, reverse_host(get_url_host(url))) for url in urls])
+
+		self.pending += 1
+		if self.pending >= self.commit_every:
+			self.commit()
+
+	def commit(self):
+		self.conn.commit()
+		self.pending = 0
+
+	def close(self):
+		if self.conn is not None:
+			self.commit()
+			self.conn.close()
+			self.conn = None
+
+	def _select(self, table, where, params):
+		sql = ("SELECT a.gist_id, a.owner, g.url, a.value FROM %s a LEFT JOIN gists g ON g.id = a.gist_id "
+			"WHERE %s ORDER BY a.gist_id"%(table, where))
+		return self.conn.execute(sql, params).fetchall()
+
+	def _host_where(self, column, pattern):
+		exact, prefix = host_range(pattern)
+		if prefix:
+			# '/' sorts right after '.', so this is the range of every key starting with `prefix`.
+			return "%s >= ? AND %s < ?"%(column, column), (prefix, prefix[:-1] + '/')
+		return "%s = ?"%(column), (exact,)
+
+	def find_emails(self, pattern):
+		"""
+		Returns (gist_id, owner, gist_url, email) rows for `pattern`, which is
+		either an email address or a domain such as `example.com`, `@example.com`
+		or `*.example.com`.
+		"""
+		if '@' in pattern and not pattern.startswith(('@', '*@')):
+			return self._select('emails', "a.value = ?", (pattern,))
+
+		where, params = self._host_where('a.domain_rev', pattern.split('@')[-1])
+		return self._select('emails', where, params)
+
+	def find_urls(self, pattern):
+		"""
+		Returns (gist_id, owner, gist_url, url) rows for urls whose host matches
+		`pattern`, e.g. `example.com` or `*.example.com`.
+		"""
+		where, params = self._host_where('a.host_rev', pattern)
+		return self._select('urls', where, params)
+
+	def find_phone_numbers(self, value):
+		"""
+		Returns (gist_id, owner, gist_url, phone_number) rows for `value`.
+		"""
+		return self._select('phone_numbers', "a.value = ?", (value,))
+
+	def find_owner(self, login):
+		"""
+		Returns (gist_id, owner, gist_url, kind, value) rows for every artifact of `login`.
+		"""
+		rows = []
+		for table, kind in (('emails', 'email'), ('phone_numbers', 'phone_number'), ('urls', 'url')):
+			for gist_id, owner, url, value in self._select(table, "a.owner = ?", (login,)):
+				rows.append((gist_id, owner, url, kind, value))
+		return rows
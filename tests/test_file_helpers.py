@@ -0,0 +1,115 @@
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from file_helpers import DownloadError, download_text, get_extension, is_text_candidate, is_text_type, looks_binary
+from metrics import DOWNLOADED_BYTES
+
+FILES = {
+	'/notes.txt': b'mail alice@example.com\n' * 10000,
+	'/image.txt': b'\x89PNG\r\n\x1a\n' + b'\x00' * 200000,
+}
+
+class FileServer:
+	"""
+	A local server for the raw files in FILES, sent as text/plain whatever
+	their content, like a mislabelled gist file.
+	"""
+	def __init__(self):
+		class Handler(BaseHTTPRequestHandler):
+			def log_message(self, *args):
+				pass
+
+			def do_GET(self):
+				body = FILES.get(self.path)
+				if body is None:
+					self.send_error(404)
+					return
+				self.send_response(200)
+				self.send_header('Content-Type', 'text/plain; charset=utf-8')
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				try:
+					self.wfile.write(body)
+				except OSError:
+					pass
+
+		self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+		self.url = 'http://127.0.0.1:%s'%(self.server.server_port)
+		self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+		self.thread.start()
+
+	def close(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+class LooksBinaryTests(unittest.TestCase):
+	def test_text(self):
+		self.assertFalse(looks_binary(b''))
+		self.assertFalse(looks_binary(b'password = "hunter2"\r\n\tport: 22\n'))
+		self.assertFalse(looks_binary('naïve café\n'.encode('utf-8')))
+		# Byte-order marks win over the NULs of UTF-16.
+		self.assertFalse(looks_binary('\ufeffkey=value'.encode('utf-16')))
+
+	def test_binary(self):
+		self.assertTrue(looks_binary(b'\x89PNG\r\n\x1a\n' + b'rest'))
+		self.assertTrue(looks_binary(b'PK\x03\x04' + b'a' * 100))
+		self.assertTrue(looks_binary(b'text with a \x00 byte'))
+		self.assertTrue(looks_binary(bytes(range(1, 32)) * 4))
+
+class IsTextCandidateTests(unittest.TestCase):
+	def test_extensions(self):
+		self.assertEqual(get_extension('Config.YML'), '.yml')
+		self.assertEqual(get_extension('.bashrc'), '.bashrc')
+		self.assertEqual(get_extension('Makefile'), '')
+
+	def test_types(self):
+		self.assertTrue(is_text_type('text/plain; charset=utf-8'))
+		self.assertTrue(is_text_type('application/vnd.api+json'))
+		self.assertFalse(is_text_type('image/png'))
+		self.assertIsNone(is_text_type('application/x-unknown'))
+
+	def test_metadata_decides(self):
+		self.assertTrue(is_text_candidate('deploy.sh'))
+		self.assertTrue(is_text_candidate('Makefile', language='Makefile'))
+		self.assertTrue(is_text_candidate('notes', ftype='text/plain'))
+		self.assertFalse(is_text_candidate('logo.png', ftype='text/plain'))
+		self.assertFalse(is_text_candidate('blob', ftype='application/octet-stream'))
+		self.assertFalse(is_text_candidate('dump.sql', size=6 * 1024 * 1024))
+
+	def test_unknown_files_depend_on_strict(self):
+		self.assertFalse(is_text_candidate('blob', ftype='application/x-unknown'))
+		self.assertTrue(is_text_candidate('blob', ftype='application/x-unknown', strict=False))
+
+def downloaded_bytes():
+	return sum(value for _, value in DOWNLOADED_BYTES.samples())
+
+class DownloadTextTests(unittest.TestCase):
+	def setUp(self):
+		self.files = FileServer()
+		self.session = requests.Session()
+
+	def tearDown(self):
+		self.session.close()
+		self.files.close()
+
+	def test_downloads_text(self):
+		self.assertEqual(download_text(self.session, self.files.url + '/notes.txt'), FILES['/notes.txt'].decode('utf-8'))
+
+	def test_binaries_are_dropped_after_the_first_chunk(self):
+		before = downloaded_bytes()
+		self.assertIsNone(download_text(self.session, self.files.url + '/image.txt', chunk_size=1024))
+		self.assertEqual(downloaded_bytes() - before, 1024)
+
+	def test_large_files_are_dropped(self):
+		self.assertIsNone(download_text(self.session, self.files.url + '/notes.txt', max_size=1000))
+
+	def test_failures_raise(self):
+		with self.assertRaises(DownloadError) as context:
+			download_text(self.session, self.files.url + '/missing.txt')
+		self.assertEqual(context.exception.status, 404)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,174 @@
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from file_helpers import is_text_candidate
+from gisthub import get_changed_files
+from graphql_helpers import GraphQLError, GraphQLGistFetcher, split_gist_id
+from http_helpers import CircuitBreakers, RetryPolicy, create_session
+
+GISTS = {
+	('alice', 'aaa111'): {
+		'name': 'aaa111',
+		'owner': {'login': 'alice'},
+		'isPublic': True,
+		'createdAt': '2020-01-02T03:04:05Z',
+		'updatedAt': '2021-01-02T03:04:05Z',
+		'description': 'notes',
+		'url': 'https://gist.github.com/alice/aaa111',
+		'files': [
+			{'name': 'notes.md', 'encodedName': 'notes.md', 'language': {'name': 'Markdown'}, 'size': 22, 'isTruncated': False, 'isImage': False, 'text': 'mail alice@example.com'},
+			{'name': 'big.log', 'encodedName': 'big.log', 'language': None, 'size': 900000, 'isTruncated': True, 'isImage': False, 'text': 'cut'},
+		],
+	},
+	('bob', 'bbb222'): {
+		'name': 'bbb222',
+		'owner': {'login': 'bob'},
+		'isPublic': False,
+		'createdAt': '2020-05-06T07:08:09Z',
+		'updatedAt': '2020-05-06T07:08:09Z',
+		'files': [
+			{'name': 'Procfile', 'encodedName': 'Procfile', 'language': None, 'size': 600000, 'isTruncated': True, 'isImage': False, 'text': 'cut'},
+			{'name': 'logo', 'encodedName': 'logo', 'language': None, 'size': 2048, 'isTruncated': False, 'isImage': True, 'text': None},
+		],
+	},
+}
+
+class GraphQLStub:
+	"""
+	A local GraphQL endpoint answering the gist queries of GraphQLGistFetcher
+	from GISTS. Statuses queued in `failures` are returned, one per request,
+	before queries are answered.
+	"""
+	def __init__(self):
+		self.requests = []
+		self.failures = []
+		stub = self
+
+		class Handler(BaseHTTPRequestHandler):
+			def log_message(self, *args):
+				pass
+
+			def do_POST(self):
+				body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+				stub.requests.append((self.headers.get('Authorization'), body))
+
+				if stub.failures:
+					self.reply(stub.failures.pop(0), {'message': 'failure'})
+					return
+
+				variables = body['variables']
+				if 'broken' in variables.values():
+					self.reply(200, {'data': None, 'errors': [{'message': 'Something went wrong'}]})
+					return
+
+				data = {}
+				for name, owner in variables.items():
+					if name.startswith('o'):
+						index = name[1:]
+						gist = GISTS.get((owner, variables['n' + index]))
+						data['g' + index] = {'gist': gist} if gist else None
+				self.reply(200, {'data': data})
+
+			def reply(self, status, data):
+				payload = json.dumps(data).encode('utf-8')
+				self.send_response(status)
+				self.send_header('Content-Type', 'application/json')
+				self.send_header('Content-Length', str(len(payload)))
+				self.end_headers()
+				self.wfile.write(payload)
+
+		self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+		self.url = 'http://127.0.0.1:%s/graphql'%(self.server.server_port)
+		self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+		self.thread.start()
+
+	def close(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+class SplitGistIdTests(unittest.TestCase):
+	def test_entries(self):
+		self.assertEqual(split_gist_id('aaa111'), (None, 'aaa111'))
+		self.assertEqual(split_gist_id('alice/aaa111'), ('alice', 'aaa111'))
+		self.assertEqual(split_gist_id(' https://gist.github.com/alice/aaa111/ '), ('alice', 'aaa111'))
+
+class GraphQLGistFetcherTests(unittest.TestCase):
+	def setUp(self):
+		self.stub = GraphQLStub()
+		policy = RetryPolicy(total=2, backoff_factor=0)
+		self.fetcher = GraphQLGistFetcher(create_session(policy, CircuitBreakers()), 'secret', self.stub.url, policy, batch_size=2)
+
+	def tearDown(self):
+		self.stub.close()
+
+	def test_fetches_owner_entries_in_batches(self):
+		entries = ['alice/aaa111', 'https://gist.github.com/bob/bbb222', 'carol/ccc333', 'ddd444']
+		gists = self.fetcher.fetch(entries)
+
+		self.assertEqual(set(gists), set(entries[:3]))
+		self.assertIsNone(gists['carol/ccc333'])
+		self.assertEqual((self.fetcher.requests, self.fetcher.fetched), (2, 2))
+		self.assertEqual([len(body['variables']) for _, body in self.stub.requests], [4, 2])
+		self.assertEqual(self.stub.requests[0][0], 'bearer secret')
+
+	def test_gists_look_like_rest_gists(self):
+		gist = self.fetcher.fetch(['alice/aaa111'])['alice/aaa111']
+
+		self.assertEqual((gist.id, gist.owner.login, gist.public), ('aaa111', 'alice', True))
+		self.assertEqual(str(gist.updated_at), '2021-01-02 03:04:05')
+		self.assertEqual(gist.files['notes.md'].text, 'mail alice@example.com')
+		self.assertEqual(gist.files['notes.md'].raw_url, 'https://gist.githubusercontent.com/alice/aaa111/raw/notes.md')
+		# Truncated files are left to be downloaded.
+		self.assertIsNone(gist.files['big.log'].text)
+		self.assertEqual(gist.raw_data['files']['big.log']['truncated'], True)
+
+	def test_truncated_files_of_changed_gists_are_downloaded_again(self):
+		gist = self.fetcher.fetch(['alice/aaa111'])['alice/aaa111']
+		big = gist.files['big.log']
+		files = {'notes.md': (gist.files['notes.md'].raw_url, 22, True), 'big.log': (big.raw_url, big.size, True)}
+
+		# The raw url carries no revision, so an edit keeping the size is only
+		# caught by the gist's own timestamp.
+		revision = {'updated_at': str(gist.updated_at), 'version': None, 'files': files}
+		self.assertEqual(get_changed_files(gist, revision), ['notes.md'])
+		revision['updated_at'] = '2020-12-31 00:00:00'
+		self.assertEqual(get_changed_files(gist, revision), ['notes.md', 'big.log'])
+
+	def test_files_are_selected_as_over_rest(self):
+		gist = self.fetcher.fetch(['bob/bbb222'])['bob/bbb222']
+		procfile, logo = gist.files['Procfile'], gist.files['logo']
+
+		# Without a language or extension, the type decides in strict mode.
+		self.assertEqual((procfile.type, logo.type), ('text/plain', 'application/octet-stream'))
+		self.assertTrue(is_text_candidate(procfile.filename, procfile.type, procfile.language, procfile.size, strict=True))
+		self.assertFalse(is_text_candidate(logo.filename, logo.type, logo.language, logo.size, strict=True))
+		self.assertEqual(procfile.type, gist.raw_data['files']['Procfile']['type'])
+
+	def test_retries_throttling_and_server_errors(self):
+		self.stub.failures = [502, 429]
+		gists = self.fetcher.fetch(['bob/bbb222'])
+
+		self.assertEqual(gists['bob/bbb222'].id, 'bbb222')
+		self.assertEqual(self.fetcher.requests, 3)
+
+	def test_gives_up_after_the_policy_retries(self):
+		self.stub.failures = [503, 503, 503]
+		with self.assertRaises(GraphQLError):
+			self.fetcher.fetch(['bob/bbb222'])
+		self.assertEqual(self.fetcher.requests, 3)
+
+	def test_does_not_retry_fatal_statuses(self):
+		self.stub.failures = [401]
+		with self.assertRaises(GraphQLError):
+			self.fetcher.fetch(['bob/bbb222'])
+		self.assertEqual(self.fetcher.requests, 1)
+
+	def test_raises_query_errors(self):
+		with self.assertRaises(GraphQLError) as context:
+			self.fetcher.fetch(['alice/broken'])
+		self.assertIn('Something went wrong', str(context.exception))
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,147 @@
+import time
+import unittest
+from unittest import mock
+
+from http_helpers import CircuitBreaker, CircuitBreakers, CircuitOpenError, RetryPolicy, classify_status, get_header
+
+class HTTPError(Exception):
+	"""
+	Stands in for PyGithub's GithubException, which carries `status` and `headers`.
+	"""
+	def __init__(self, status, headers=None):
+		super().__init__("HTTP %s"%(status))
+		self.status = status
+		self.headers = headers or {}
+
+class ClassifyStatusTests(unittest.TestCase):
+	def test_statuses(self):
+		self.assertEqual(classify_status(200), 'ok')
+		self.assertEqual(classify_status(304), 'ok')
+		self.assertEqual(classify_status(None), 'retry')
+		for status in (429, 502, 503, 520, 599):
+			self.assertEqual(classify_status(status), 'retry', status)
+		for status in (400, 401, 404, 422, 418):
+			self.assertEqual(classify_status(status), 'fatal', status)
+
+	def test_only_rate_limit_403s_are_retried(self):
+		self.assertEqual(classify_status(403), 'fatal')
+		self.assertEqual(classify_status(403, {'X-RateLimit-Remaining': '12'}), 'fatal')
+		self.assertEqual(classify_status(403, {'x-ratelimit-remaining': '0'}), 'retry')
+		self.assertEqual(classify_status(403, {'Retry-After': '60'}), 'retry')
+
+	def test_headers_in_any_case(self):
+		self.assertEqual(get_header({'retry-after': '5'}, 'Retry-After'), '5')
+		self.assertIsNone(get_header(None, 'Retry-After'))
+
+class CircuitBreakerTests(unittest.TestCase):
+	def test_opens_after_consecutive_failures(self):
+		breaker = CircuitBreaker('api.github.com', failure_threshold=3, reset_timeout=60)
+		breaker.record_failure()
+		breaker.record_failure()
+		breaker.record_success()
+		breaker.record_failure()
+		breaker.record_failure()
+		self.assertEqual(breaker.state, 'closed')
+
+		breaker.record_failure()
+		self.assertEqual(breaker.state, 'open')
+		with self.assertRaises(CircuitOpenError):
+			breaker.before_request()
+
+	def test_lets_one_trial_through_once_half_open(self):
+		breaker = CircuitBreaker('api.github.com', failure_threshold=1, reset_timeout=0.05)
+		breaker.record_failure()
+		time.sleep(0.06)
+		self.assertEqual(breaker.state, 'half-open')
+
+		breaker.before_request()
+		with self.assertRaises(CircuitOpenError):
+			breaker.before_request()
+
+		# A failed trial opens the breaker again for twice as long.
+		breaker.record_failure()
+		self.assertEqual((breaker.state, breaker.reset_timeout), ('open', 0.1))
+
+		time.sleep(0.11)
+		breaker.before_request()
+		breaker.record_success()
+		self.assertEqual((breaker.state, breaker.reset_timeout), ('closed', 0.05))
+		breaker.before_request()
+
+	def test_only_retryable_statuses_count_as_failures(self):
+		breaker = CircuitBreaker('api.github.com', failure_threshold=2)
+		breaker.record_status(404)
+		breaker.record_status(403, {'X-RateLimit-Remaining': '5'})
+		self.assertEqual(breaker.failures, 0)
+		breaker.record_status(503)
+		breaker.record_status(429)
+		self.assertEqual(breaker.state, 'open')
+
+	def test_breakers_are_per_host(self):
+		breakers = CircuitBreakers()
+		self.assertIs(breakers.for_url('https://api.github.com/gists'), breakers.get('api.github.com'))
+		self.assertIsNot(breakers.get('api.github.com'), breakers.get('gist.github.com'))
+
+class RetryPolicyTests(unittest.TestCase):
+	def test_backoff_is_jittered_and_capped(self):
+		policy = RetryPolicy(backoff_factor=1, backoff_max=5)
+		for attempt in range(1, 10):
+			delay = policy.backoff(attempt)
+			self.assertGreaterEqual(delay, 0)
+			self.assertLessEqual(delay, min(5, 2 ** (attempt - 1)))
+
+	def test_rate_limit_wait(self):
+		policy = RetryPolicy(max_wait=300)
+		reset = str(int(time.time()) + 60)
+		wait = policy.rate_limit_wait(403, {'x-ratelimit-remaining': '0', 'x-ratelimit-reset': reset})
+		self.assertTrue(59 <= wait <= 62)
+		self.assertIsNone(policy.rate_limit_wait(403, {'X-RateLimit-Remaining': '3', 'X-RateLimit-Reset': reset}))
+		self.assertIsNone(policy.rate_limit_wait(429, {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': reset}))
+		# Resets too far away are not waited for.
+		far = str(int(time.time()) + 3600)
+		self.assertIsNone(policy.rate_limit_wait(403, {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': far}))
+
+	@mock.patch('http_helpers.time.sleep')
+	def test_call_waits_out_exhausted_rate_limits(self, sleep):
+		policy = RetryPolicy(total=3)
+		breaker = CircuitBreaker('api.github.com')
+		headers = {'x-ratelimit-remaining': '0', 'x-ratelimit-reset': str(int(time.time()) + 10)}
+		outcomes = [HTTPError(403, headers), HTTPError(403, headers), 'gist']
+
+		def func():
+			outcome = outcomes.pop(0)
+			if isinstance(outcome, Exception):
+				raise outcome
+			return outcome
+
+		self.assertEqual(policy.call(breaker, func), 'gist')
+		self.assertEqual(sleep.call_count, 2)
+
+	def test_call_does_not_retry_other_errors(self):
+		policy = RetryPolicy(total=3)
+		breaker = CircuitBreaker('api.github.com', failure_threshold=1)
+		calls = []
+
+		def func():
+			calls.append(1)
+			raise HTTPError(404)
+
+		with self.assertRaises(HTTPError):
+			policy.call(breaker, func)
+		self.assertEqual(len(calls), 1)
+		# Fatal statuses say nothing about the host's health.
+		self.assertEqual(breaker.state, 'closed')
+
+	def test_urllib3_retry_honours_rate_limit_resets(self):
+		retry = RetryPolicy(total=2, max_wait=30).urllib3_retry()
+		self.assertTrue(retry.is_retry('GET', 403, has_retry_after=True))
+		self.assertFalse(retry.is_retry('GET', 403))
+		self.assertTrue(retry.is_retry('GET', 503))
+		self.assertFalse(retry.is_retry('POST', 503))
+
+		# The wait for a reset an hour away is capped at max_wait.
+		response = mock.Mock(headers={'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': str(int(time.time()) + 3600)})
+		self.assertEqual(retry.get_retry_after(response), 30)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,81 @@
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from io_helpers import Deduper, batched, open_output, read_batches
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+LINES = ['alice', '', '# a comment', 'bob', '// another', '  carol  ', 'alice', 'bob', 'dave']
+
+class ReadBatchesTests(unittest.TestCase):
+	def setUp(self):
+		self.temp_dir = tempfile.mkdtemp(prefix='gisthub-test-')
+
+	def tearDown(self):
+		shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+	def write(self, name, lines=LINES):
+		path = os.path.join(self.temp_dir, name)
+		with open_output(path) as f:
+			f.write('\n'.join(lines) + '\n')
+		return path
+
+	def read(self, *args, **kwargs):
+		return list(read_batches(*args, **kwargs))
+
+	def test_dedups_across_values_and_batches(self):
+		path = self.write('users.txt')
+		batches = self.read(['dave', 'erin'], path, batch_size=2)
+		self.assertEqual(batches, [['dave', 'erin'], ['alice', 'bob'], ['carol']])
+
+	def test_reads_gzip_whatever_the_extension(self):
+		path = self.write('users.gz')
+		os.rename(path, path + '.txt')
+		self.assertEqual(self.read(path=path + '.txt', batch_size=10), [['alice', 'bob', 'carol', 'dave']])
+
+	def test_reads_appended_gzip_members(self):
+		path = self.write('users.gz', ['alice', 'bob'])
+		with open_output(path, 'a') as f:
+			f.write('bob\ncarol\n')
+		self.assertEqual(self.read(path=path, batch_size=10), [['alice', 'bob', 'carol']])
+
+	@unittest.skipIf(zstandard is None, "zstandard is not installed")
+	def test_reads_zstd(self):
+		path = self.write('users.zst')
+		self.assertEqual(self.read(path=path, batch_size=10), [['alice', 'bob', 'carol', 'dave']])
+
+	def test_reads_gzip_from_stdin(self):
+		stdin = SimpleNamespace(buffer=io.BufferedReader(io.BytesIO(gzip.compress('\n'.join(LINES).encode('utf-8')))))
+		with mock.patch('sys.stdin', stdin):
+			self.assertEqual(self.read(['alice'], '-', batch_size=10), [['alice', 'bob', 'carol', 'dave']])
+
+	def test_dedup_spills_to_disk(self):
+		lines = ['user%s'%(i % 50) for i in range(200)]
+		path = self.write('users.txt', lines)
+		batches = self.read(path=path, batch_size=20, max_memory_items=10)
+		self.assertEqual([entry for batch in batches for entry in batch], ['user%s'%(i) for i in range(50)])
+
+class DeduperTests(unittest.TestCase):
+	def test_drops_repeated_values_before_and_after_spilling(self):
+		deduper = Deduper(max_memory_items=2)
+		self.addCleanup(deduper.close)
+
+		self.assertEqual([deduper.add(value) for value in ['a', 'b', 'a', 'c', 'b', 'c', 'd']], [True, True, False, True, False, False, True])
+		self.assertIsNotNone(deduper.disk)
+
+class BatchedTests(unittest.TestCase):
+	def test_batches(self):
+		self.assertEqual(list(batched(range(5), 2)), [[0, 1], [2, 3], [4]])
+		self.assertEqual(list(batched([], 2)), [])
+
+if __name__ == '__main__':
+	unittest.main()
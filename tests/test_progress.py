@@ -0,0 +1,30 @@
+import io
+import unittest
+
+from progress import ProgressReporter
+
+class ProgressReporterTests(unittest.TestCase):
+	def test_count_sets_the_total_once_the_last_batch_is_read(self):
+		progress = ProgressReporter(stream=io.StringIO())
+		batches = progress.count(iter([['a', 'b'], ['c'], ['d', 'e']]))
+
+		self.assertEqual(next(batches), ['a', 'b'])
+		self.assertEqual(next(batches), ['c'])
+		self.assertIsNone(progress.total)
+		# The total is known by the time the last batch is handed out.
+		self.assertEqual(next(batches), ['d', 'e'])
+		self.assertEqual(progress.total, 5)
+		self.assertEqual(list(batches), [])
+
+	def test_status_shows_the_total_when_known(self):
+		progress = ProgressReporter(unit='users', stream=io.StringIO())
+		progress.start()
+		progress.advance(2)
+		self.assertIn('users 2 |', progress.status())
+
+		progress.total = 4
+		self.assertIn('users 2/4 (50.0%)', progress.status())
+		progress.stop()
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,143 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from seen_set import BloomFilter, RedisSeenSet, SeenSet, SeenWindow
+
+try:
+	import fakeredis
+except ImportError:
+	fakeredis = None
+
+class BloomFilterTests(unittest.TestCase):
+	def setUp(self):
+		self.temp_dir = tempfile.mkdtemp(prefix='gisthub-test-')
+		self.path = os.path.join(self.temp_dir, 'seen.bloom')
+
+	def tearDown(self):
+		shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+	def test_keys_persist_in_the_file(self):
+		bloom = BloomFilter(self.path, capacity=1000)
+		for i in range(500):
+			bloom.add('gist%s'%(i))
+		bloom.synced = 500
+		bloom.close()
+
+		bloom = BloomFilter(self.path, capacity=10)
+		self.addCleanup(bloom.close)
+		# The filter keeps the geometry it was created with.
+		self.assertGreater(bloom.m, 1000)
+		self.assertEqual(bloom.synced, 500)
+		self.assertTrue(all('gist%s'%(i) in bloom for i in range(500)))
+		false_positives = sum('other%s'%(i) in bloom for i in range(1000))
+		self.assertLess(false_positives, 50)
+
+	def test_rejects_other_files(self):
+		with open(self.path, 'wb') as f:
+			f.write(b'x' * 100)
+		with self.assertRaises(ValueError):
+			BloomFilter(self.path)
+
+class SeenSetTests(unittest.TestCase):
+	def setUp(self):
+		self.temp_dir = tempfile.mkdtemp(prefix='gisthub-test-')
+		self.path = os.path.join(self.temp_dir, 'seen.db')
+
+	def tearDown(self):
+		shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+	def test_gists_are_seen_by_id_and_revision(self):
+		with SeenSet(self.path, capacity=1000) as seen:
+			seen.add('aaa111', '2021-01-02 03:04:05')
+			self.assertTrue(seen.contains('aaa111'))
+			self.assertTrue(seen.contains('aaa111', '2021-01-02 03:04:05'))
+			self.assertFalse(seen.contains('aaa111', '2022-01-01 00:00:00'))
+			self.assertFalse(seen.contains('bbb222'))
+
+	def test_keys_persist_across_runs(self):
+		with SeenSet(self.path, capacity=1000) as seen:
+			seen.add('aaa111')
+
+		with SeenSet(self.path, capacity=1000) as seen:
+			self.assertTrue(seen.contains('aaa111'))
+			self.assertFalse(seen.contains('bbb222'))
+
+	def test_commits_reach_other_processes_and_their_filter(self):
+		seen = SeenSet(self.path, capacity=1000)
+		other = SeenSet(self.path, capacity=1000)
+		self.addCleanup(other.close)
+		self.addCleanup(seen.close)
+
+		seen.add('aaa111')
+		self.assertFalse(other.contains('aaa111'))
+		seen.commit()
+		self.assertTrue(other.contains('aaa111'))
+		self.assertIn('aaa111', other.bloom)
+
+	def test_a_missing_filter_is_rebuilt_from_sqlite(self):
+		with SeenSet(self.path, capacity=1000) as seen:
+			seen.add('aaa111')
+		os.remove(self.path + '.bloom')
+
+		with SeenSet(self.path, capacity=1000) as seen:
+			self.assertIn('aaa111', seen.bloom)
+			self.assertTrue(seen.contains('aaa111'))
+
+	def test_temporary_sets_are_removed_on_close(self):
+		seen = SeenSet(None, capacity=1000)
+		seen.add('aaa111')
+		self.assertTrue(seen.contains('aaa111'))
+		temp_dir = seen.temp_dir
+		seen.close()
+		self.assertFalse(os.path.exists(temp_dir))
+
+class SeenWindowTests(unittest.TestCase):
+	def test_forgets_the_oldest_keys(self):
+		window = SeenWindow(size=2)
+		self.assertTrue(window.add('a'))
+		self.assertFalse(window.add('a'))
+		window.add('b')
+		window.add('c')
+		self.assertEqual(len(window), 2)
+		self.assertNotIn('a', window)
+		self.assertIn('c', window)
+
+@unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+class RedisSeenSetTests(unittest.TestCase):
+	def setUp(self):
+		self.server = fakeredis.FakeServer()
+
+	def make_seen(self, **kwargs):
+		return RedisSeenSet(client=fakeredis.FakeRedis(server=self.server), **kwargs)
+
+	def test_added_gists_are_shared_once_committed(self):
+		seen = self.make_seen()
+		other = self.make_seen()
+		seen.add('aaa111', '2021-01-02 03:04:05')
+
+		self.assertTrue(seen.contains('aaa111'))
+		self.assertFalse(other.contains('aaa111'))
+
+		seen.commit()
+		self.assertTrue(other.contains('aaa111'))
+		self.assertTrue(other.contains('aaa111', '2021-01-02 03:04:05'))
+		self.assertFalse(other.contains('aaa111', '2022-01-01 00:00:00'))
+		self.assertFalse(other.contains('bbb222'))
+
+	def test_commits_in_batches(self):
+		seen = self.make_seen(commit_every=5)
+		for i in range(12):
+			seen.add('gist%s'%(i))
+
+		# Two automatic commits went out, the last two keys are still local.
+		self.assertEqual(self.server_keys(), 10)
+		seen.commit(batch_size=1)
+		self.assertEqual(self.server_keys(), 12)
+
+	def server_keys(self):
+		return fakeredis.FakeRedis(server=self.server).scard('gisthub:seen')
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+from gisthub import get_changed_files
+from storage import ArtifactStore
+
+SHA1 = 'a' * 40
+SHA2 = 'b' * 40
+
+def make_file(name, revision, size):
+	return SimpleNamespace(filename=name, raw_url='https://gist.githubusercontent.com/alice/aaa111/raw/%s/%s'%(revision, name), type='text/plain', language=None, size=size, text=None)
+
+def make_gist(updated_at, version, *files):
+	return SimpleNamespace(id='aaa111', updated_at=updated_at, files={file.filename: file for file in files},
+		raw_data={'history': [{'version': version}]})
+
+def file_dicts(gist):
+	return [{'filename': file.filename, 'raw_url': file.raw_url, 'type': file.type, 'language': file.language, 'size': file.size} for file in gist.files.values()]
+
+class RevisionTests(unittest.TestCase):
+	def setUp(self):
+		self.temp_dir = tempfile.mkdtemp(prefix='gisthub-test-')
+		self.store = ArtifactStore(os.path.join(self.temp_dir, 'artifacts.db'))
+		self.gist = make_gist('2021-01-02 03:04:05', 'v1', make_file('a.env', SHA1, 10), make_file('b.txt', SHA1, 20))
+		self.store.add_gist('aaa111', 'alice', files=file_dicts(self.gist), emails=['alice@example.com', 'bob@example.com'],
+			updated_at=self.gist.updated_at, version='v1', file_artifacts={
+				'a.env': (['alice@example.com'], [], []),
+				'b.txt': (['bob@example.com'], [], []),
+			})
+
+	def tearDown(self):
+		self.store.close()
+		shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+	def test_unknown_gists_need_every_file(self):
+		self.assertIsNone(self.store.get_revision('zzz999'))
+		self.assertIsNone(get_changed_files(self.gist, None))
+
+	def test_unchanged_gists_need_no_file(self):
+		revision = self.store.get_revision('aaa111')
+		self.assertEqual(revision['files']['a.env'], (self.gist.files['a.env'].raw_url, 10, True))
+		self.assertEqual(get_changed_files(self.gist, revision), [])
+		self.assertEqual(self.store.get_file_artifacts('aaa111', ['a.env']), ({'alice@example.com'}, set(), set()))
+
+	def test_only_files_with_a_new_revision_or_size_are_needed(self):
+		gist = make_gist('2021-02-01 00:00:00', 'v2', make_file('a.env', SHA2, 10), make_file('b.txt', SHA1, 20))
+		self.assertEqual(get_changed_files(gist, self.store.get_revision('aaa111')), ['a.env'])
+
+		gist = make_gist('2021-02-01 00:00:00', 'v2', make_file('a.env', SHA1, 10), make_file('b.txt', SHA1, 21))
+		self.assertEqual(get_changed_files(gist, self.store.get_revision('aaa111')), ['b.txt'])
+
+	def test_files_that_failed_are_needed_again(self):
+		# b.txt failed to download, so it has no artifacts to reuse.
+		self.store.add_gist('aaa111', 'alice', files=file_dicts(self.gist), updated_at=self.gist.updated_at, version='v1',
+			file_artifacts={'a.env': (['alice@example.com'], [], [])})
+		gist = make_gist('2021-02-01 00:00:00', 'v2', make_file('a.env', SHA2, 10), make_file('b.txt', SHA2, 20))
+		self.store.add_gist('aaa111', 'alice', files=file_dicts(gist), updated_at=gist.updated_at, version='v2', file_artifacts={})
+
+		revision = self.store.get_revision('aaa111')
+		self.assertEqual(revision['files']['b.txt'][2], False)
+		# A new revision resets the extracted flag until its artifacts are recorded.
+		self.assertEqual(revision['files']['a.env'][2], False)
+		self.assertEqual(get_changed_files(gist, revision), ['a.env', 'b.txt'])
+
+	def test_artifacts_are_replaced_and_deleted_files_dropped(self):
+		gist = make_gist('2021-02-01 00:00:00', 'v2', make_file('a.env', SHA1, 10))
+		emails, _, _ = self.store.get_file_artifacts('aaa111', ['a.env'])
+		self.store.add_gist('aaa111', 'alice', files=file_dicts(gist), emails=emails, updated_at=gist.updated_at, version='v2', file_artifacts={})
+
+		self.assertEqual(set(self.store.get_revision('aaa111')['files']), {'a.env'})
+		self.assertEqual([row[3] for row in self.store.find_emails('@example.com')], ['alice@example.com'])
+		self.assertEqual(self.store.get_file_artifacts('aaa111', ['b.txt']), (set(), set(), set()))
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+
+from web_helpers import normalize_host, normalize_percent_encoding, normalize_url
+
+class NormalizeUrlTests(unittest.TestCase):
+	def test_scheme_host_and_default_ports(self):
+		self.assertEqual(normalize_url('HTTP://Example.COM:80'), 'http://example.com/')
+		self.assertEqual(normalize_url('https://example.com:443/'), 'https://example.com/')
+		self.assertEqual(normalize_url('http://user:pw@[::1]:443/x'), 'http://user:pw@[::1]:443/x')
+
+	def test_missing_schemes_are_added(self):
+		self.assertEqual(normalize_url('example.com./a'), 'http://example.com/a')
+		self.assertEqual(normalize_url('//host:8080?q=1'), 'http://host:8080/?q=1')
+		self.assertEqual(normalize_url('example.com', default_scheme='https'), 'https://example.com/')
+
+	def test_variants_of_one_url_compare_equal(self):
+		variants = ['example.com/a~b', 'http://EXAMPLE.com./a%7eb', 'http://example.com:80/a%7Eb#top']
+		self.assertEqual({normalize_url(url) for url in variants}, {'http://example.com/a~b'})
+
+	def test_idn_hosts_are_punycoded(self):
+		self.assertEqual(normalize_host('Bücher.Example.'), 'xn--bcher-kva.example')
+		self.assertEqual(normalize_url('https://bücher.example/path'), 'https://xn--bcher-kva.example/path')
+		self.assertEqual(normalize_url('https://xn--bcher-kva.example/path'), 'https://xn--bcher-kva.example/path')
+
+	def test_percent_encoding(self):
+		self.assertEqual(normalize_percent_encoding('a%7eb%2fc'), 'a~b%2Fc')
+		self.assertEqual(normalize_percent_encoding('plain'), 'plain')
+
+	def test_unparsable_urls(self):
+		self.assertIsNone(normalize_url('http://example.com:99999'))
+		self.assertIsNone(normalize_url('http:///nohost'))
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,240 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from gisthub import run_worker
+from work_queue import RedisQueue, SQLiteQueue, decode_search_shard, encode_search_shard, open_queue
+
+try:
+	import fakeredis
+except ImportError:
+	fakeredis = None
+
+class QueueTests:
+	"""
+	Lease, expiry and acknowledgement checks run against every backend.
+	"""
+	def make_queue(self, lease_seconds=300):
+		raise NotImplementedError
+
+	def test_put_queues_every_item_once(self):
+		queue = self.make_queue()
+		self.assertEqual(queue.put('user', ['alice', 'bob', 'alice']), 2)
+		self.assertEqual(queue.put('user', ['bob', 'carol']), 1)
+		self.assertEqual(queue.stats(), {'pending': 3, 'leased': 0, 'done': 0, 'failed': 0})
+
+	def test_put_rejects_unknown_kinds(self):
+		queue = self.make_queue()
+		with self.assertRaises(ValueError):
+			queue.put('repository', ['x'])
+
+	def test_lease_hands_out_every_item_once(self):
+		queue = self.make_queue()
+		queue.put('gist', ['a', 'b', 'c'])
+
+		first = queue.lease('w1', 2)
+		second = queue.lease('w2', 2)
+		self.assertEqual([item.value for item in first], ['a', 'b'])
+		self.assertEqual([item.value for item in second], ['c'])
+		self.assertEqual(queue.lease('w3', 2), [])
+		self.assertEqual(queue.stats(), {'pending': 0, 'leased': 3, 'done': 0, 'failed': 0})
+
+	def test_ack_marks_items_done(self):
+		queue = self.make_queue()
+		queue.put('user', ['alice'])
+
+		item, = queue.lease('w1')
+		self.assertTrue(queue.ack('w1', item))
+		self.assertFalse(queue.ack('w1', item))
+		self.assertEqual(queue.lease('w1'), [])
+		self.assertEqual(queue.stats(), {'pending': 0, 'leased': 0, 'done': 1, 'failed': 0})
+
+	def test_release_returns_items_to_the_queue(self):
+		queue = self.make_queue()
+		queue.put('user', ['alice'])
+
+		item, = queue.lease('w1')
+		queue.release('w1', item)
+		self.assertEqual(queue.stats(), {'pending': 1, 'leased': 0, 'done': 0, 'failed': 0})
+
+		item, = queue.lease('w2')
+		self.assertEqual((item.value, item.attempts), ('alice', 2))
+
+	def test_release_can_delay_the_next_lease(self):
+		queue = self.make_queue()
+		queue.put('user', ['alice'])
+
+		item, = queue.lease('w1')
+		queue.release('w1', item, delay=0.1)
+		self.assertEqual(queue.stats(), {'pending': 1, 'leased': 0, 'done': 0, 'failed': 0})
+		self.assertEqual(queue.lease('w2'), [])
+
+		time.sleep(0.15)
+		item, = queue.lease('w2')
+		self.assertEqual((item.value, item.attempts), ('alice', 2))
+
+	def test_failed_items_are_not_leased_again(self):
+		queue = self.make_queue()
+		queue.put('user', ['alice'])
+
+		item, = queue.lease('w1')
+		self.assertFalse(queue.fail('w2', item))
+		self.assertTrue(queue.fail('w1', item))
+		self.assertEqual(queue.lease('w1'), [])
+		self.assertEqual(queue.stats(), {'pending': 0, 'leased': 0, 'done': 0, 'failed': 1})
+
+	def test_expired_leases_go_to_the_next_worker(self):
+		queue = self.make_queue(lease_seconds=0.05)
+		queue.put('user', ['alice'])
+
+		stale, = queue.lease('w1')
+		time.sleep(0.1)
+		self.assertEqual(queue.stats(), {'pending': 1, 'leased': 0, 'done': 0, 'failed': 0})
+
+		item, = queue.lease('w2')
+		self.assertEqual((item.value, item.attempts), ('alice', 2))
+
+		# The worker whose lease expired can no longer acknowledge the item.
+		self.assertFalse(queue.ack('w1', stale))
+		self.assertTrue(queue.ack('w2', item))
+		self.assertEqual(queue.stats(), {'pending': 0, 'leased': 0, 'done': 1, 'failed': 0})
+
+	def test_search_shards_round_trip(self):
+		queue = self.make_queue()
+		queue.put('search', [encode_search_shard('cat', 2, language='Python')])
+
+		item, = queue.lease('w1')
+		shard = decode_search_shard(item.value)
+		self.assertEqual((shard['query'], shard['page'], shard['language']), ('cat', 2, 'Python'))
+
+class SQLiteQueueTests(QueueTests, unittest.TestCase):
+	def setUp(self):
+		self.temp_dir = tempfile.mkdtemp(prefix='gisthub-test-')
+		self.queues = []
+
+	def tearDown(self):
+		for queue in self.queues:
+			queue.close()
+		shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+	def make_queue(self, lease_seconds=300):
+		queue = SQLiteQueue(os.path.join(self.temp_dir, 'queue.db'), lease_seconds)
+		self.queues.append(queue)
+		return queue
+
+	def test_workers_share_the_file(self):
+		queue = self.make_queue()
+		other = self.make_queue()
+		queue.put('user', ['alice', 'bob'])
+
+		self.assertEqual([item.value for item in other.lease('w2')], ['alice'])
+		self.assertEqual([item.value for item in queue.lease('w1', 5)], ['bob'])
+
+	def test_open_queue_picks_sqlite_for_paths(self):
+		queue = open_queue(os.path.join(self.temp_dir, 'other.db'))
+		self.queues.append(queue)
+		self.assertIsInstance(queue, SQLiteQueue)
+
+class FailingClient:
+	"""
+	Stands in for `Gist`, failing every user lookup with `status`.
+	"""
+	def __init__(self, status):
+		self.status = status
+		self.calls = 0
+
+	def get_gists(self, username, maximum):
+		self.calls += 1
+		error = Exception("HTTP %s"%(self.status))
+		error.status = self.status
+		raise error
+
+class FailingSearchClient:
+	"""
+	Stands in for `Gist`, reporting every search page as failed to `on_error`
+	the way `Gist.get_search_links()` does.
+	"""
+	def __init__(self):
+		self.calls = 0
+
+	def get_search_links(self, query, page, language, sort, order, max_gists, max_pages, verbosity=0, on_error=None):
+		self.calls += 1
+		on_error(query, Exception("Connection refused"))
+		return []
+
+	def map(self, fn, values):
+		return []
+
+class Progress:
+	def __init__(self):
+		self.done = 0
+
+	def advance(self, count=1):
+		self.done += count
+
+class RunWorkerTests(unittest.TestCase):
+	def setUp(self):
+		self.temp_dir = tempfile.mkdtemp(prefix='gisthub-test-')
+		self.queue = SQLiteQueue(os.path.join(self.temp_dir, 'queue.db'))
+		self.queue.put('user', ['alice'])
+
+	def tearDown(self):
+		self.queue.close()
+		shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+	def test_failing_items_are_retried_with_backoff_then_failed(self):
+		client = FailingClient(403)
+		progress = Progress()
+		started = time.time()
+		run_worker(client, self.queue, None, 'w1', poll_interval=0.01, progress=progress, max_attempts=3, retry_delay=0.05)
+
+		# Retried after 0.05 and 0.1 seconds, then given up on.
+		self.assertEqual(client.calls, 3)
+		self.assertGreaterEqual(time.time() - started, 0.15)
+		self.assertEqual(self.queue.stats(), {'pending': 0, 'leased': 0, 'done': 0, 'failed': 1})
+		self.assertEqual(progress.done, 1)
+
+	def test_items_whose_pages_fail_are_not_acknowledged(self):
+		queue = SQLiteQueue(os.path.join(self.temp_dir, 'search.db'))
+		self.addCleanup(queue.close)
+		queue.put('search', [encode_search_shard('cat', 1)])
+
+		client = FailingSearchClient()
+		run_worker(client, queue, None, 'w1', poll_interval=0.01, max_attempts=2, retry_delay=0.01)
+
+		self.assertEqual(client.calls, 2)
+		self.assertEqual(queue.stats(), {'pending': 0, 'leased': 0, 'done': 0, 'failed': 1})
+
+	def test_missing_items_are_acknowledged(self):
+		client = FailingClient(404)
+		run_worker(client, self.queue, None, 'w1', poll_interval=0.01)
+
+		self.assertEqual(client.calls, 1)
+		self.assertEqual(self.queue.stats(), {'pending': 0, 'leased': 0, 'done': 1, 'failed': 0})
+
+@unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+class RedisQueueTests(QueueTests, unittest.TestCase):
+	def setUp(self):
+		self.server = fakeredis.FakeServer()
+
+	def make_queue(self, lease_seconds=300):
+		return RedisQueue(lease_seconds=lease_seconds, client=fakeredis.FakeRedis(server=self.server))
+
+	def test_workers_share_the_server(self):
+		queue = self.make_queue()
+		other = self.make_queue()
+		queue.put('user', ['alice', 'bob'])
+
+		self.assertEqual([item.value for item in other.lease('w2')], ['alice'])
+		self.assertEqual([item.value for item in queue.lease('w1', 5)], ['bob'])
+
+	def test_put_sends_pipelined_batches(self):
+		queue = self.make_queue()
+		values = ['u%s'%(i % 7) for i in range(20)]
+		self.assertEqual(queue.put('user', values, batch_size=2, pipeline_size=2), 7)
+		self.assertEqual([item.value for item in queue.lease('w1', 10)], ['u%s'%(i) for i in range(7)])
+
+if __name__ == '__main__':
+	unittest.main()
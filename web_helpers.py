@@ -1,13 +1,19 @@
 import os
 import re
 import string
+from functools import lru_cache
 from ipaddress import ip_address
-from urllib.parse import ParseResult, urlparse
-
-import tldextract
+from urllib.parse import ParseResult, SplitResult, urlparse, urlsplit
 
 MAIN_DIR = os.path.dirname(__file__)
 
+DEFAULT_PORTS = {'http': 80, 'https': 443, 'ftp': 21, 'ws': 80, 'wss': 443}
+
+UNRESERVED_CHARS = frozenset(string.ascii_letters + string.digits + '-._~')
+
+_SCHEME_PATTERN = re.compile(r'^[a-zA-Z][a-zA-Z0-9+.-]*://')
+_PERCENT_PATTERN = re.compile(r'%([0-9A-Fa-f]{2})')
+
 def is_subdomain(domain,subdomain):
 	"""
 	Returns True if `subdomain` is a subdomain of `domain`, otherwise False.
@@ -17,6 +23,8 @@ def is_subdomain(domain,subdomain):
 	@type subdomain: str
 	@rtype bool
 	"""
+	import tldextract
+
 	_domain_component = tldextract.extract(subdomain)
 	
 	_domain = _domain_component.domain
@@ -105,6 +113,8 @@ def is_domain(addr):
 			if char not in allowed_chars:
 				return False
 
+	import tldextract
+
 	_domain_component = tldextract.extract(addr)
 
 	_domain = _domain_component.domain
@@ -279,9 +289,34 @@ def get_protocol(url):
 			return protocol
 	return None
 
-def is_valid_domain(domain_name):
+@lru_cache(maxsize=None)
+def get_tlds():
+	"""
+	Returns the set of lowercased TLDs listed in `tlds.txt`, or None if the file
+	is missing. The file is only read once.
+	@rtype set
+	"""
 	tld_file = os.path.join(MAIN_DIR, 'tlds.txt')
+	if not os.path.isfile(tld_file):
+		return None
 
+	tlds = set()
+	with open(tld_file, 'rt') as f:
+		for line in f:
+			line = line.strip()
+			if line and not line.startswith('#') and not line.startswith('//'):
+				tlds.add(line.lower())
+	return tlds
+
+def is_valid_domain(domain_name):
+	"""
+	Returns True if the TLD of `domain_name` is listed in `tlds.txt`, otherwise False.
+	Without a `tlds.txt` every TLD is accepted, leaving the public suffix check in
+	`is_domain()` as the only filter.
+	@param domain_name: the domain to check
+	@type domain_name: str
+	@rtype bool
+	"""
 	domain_name_parts = domain_name.rsplit('.', 1)
 
 	if len(domain_name_parts) < 2:
@@ -289,10 +324,92 @@ def is_valid_domain(domain_name):
 	else:
 		tld = domain_name_parts[1].lower()
 
-	with open(tld_file, 'rt') as f:
-		for line in f:
-			line = line.strip()
-			if line and not line.startswith('#') and not line.startswith('//'):
-				if line.lower() == tld:
-					return True
-	return False
+	tlds = get_tlds()
+	if tlds is None:
+		return True
+	return tld in tlds
+
+def normalize_percent_encoding(text):
+	"""
+	Returns `text` with percent-encoded unreserved characters decoded and the
+	remaining escapes uppercased, so `%7e` and `~` or `%2f` and `%2F` compare equal.
+	@param text: the url component to normalize
+	@type text: str
+	@rtype str
+	"""
+	if '%' not in text:
+		return text
+
+	def replace(match):
+		char = chr(int(match.group(1), 16))
+		if char in UNRESERVED_CHARS:
+			return char
+		return '%' + match.group(1).upper()
+
+	return _PERCENT_PATTERN.sub(replace, text)
+
+def normalize_host(host):
+	"""
+	Returns `host` lowercased, without trailing dots and with internationalized
+	labels converted to their ASCII (punycode) form.
+	@param host: the host to normalize
+	@type host: str
+	@rtype str
+	"""
+	host = host.strip().rstrip('.').lower()
+	if not host.isascii():
+		try:
+			host = host.encode('idna').decode('ascii')
+		except UnicodeError:
+			pass
+	return host
+
+def normalize_url(url, default_scheme='http'):
+	"""
+	Returns the normalized form of `url`, or None if it cannot be parsed. A scheme
+	is added when missing, the scheme and host are lowercased, default ports,
+	trailing dots in the host and fragments are dropped, IDN hosts are punycoded,
+	percent-encoding is normalized and an empty path becomes `/`.
+	@param url: the url to normalize
+	@type url: str
+	@param default_scheme: the scheme to use for urls without one. The default is http
+	@type default_scheme: str
+	@rtype str
+	"""
+	url = url.strip()
+	if url.startswith('//'):
+		url = default_scheme + ':' + url
+	elif url.startswith('://'):
+		url = default_scheme + url
+	elif not _SCHEME_PATTERN.match(url):
+		url = default_scheme + '://' + url
+
+	try:
+		parts = urlsplit(url)
+		port = parts.port
+	except ValueError:
+		return None
+
+	scheme = parts.scheme.lower()
+	host = parts.hostname
+	if not host:
+		return None
+
+	host = normalize_host(host)
+	if ':' in host:
+		host = '[' + host + ']'
+
+	netloc = host
+	if port is not None and DEFAULT_PORTS.get(scheme) != port:
+		netloc += ':' + str(port)
+
+	if parts.username is not None:
+		userinfo = parts.username
+		if parts.password is not None:
+			userinfo += ':' + parts.password
+		netloc = userinfo + '@' + netloc
+
+	path = normalize_percent_encoding(parts.path) or '/'
+	query = normalize_percent_encoding(parts.query)
+
+	return SplitResult(scheme, netloc, path, query, '').geturl()
@@ -0,0 +1,318 @@
+import json
+import os
+import socket
+import sqlite3
+import time
+import uuid
+
+# Kinds of work item. `user` and `gist` items hold a username or gist id,
+# `search` items hold a JSON encoded search shard (query, page and filters).
+ITEM_KINDS = ('user', 'gist', 'search')
+
+def get_worker_id():
+	"""
+	Returns an id unique to this process across nodes.
+	"""
+	return '%s:%s:%s'%(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+
+def encode_search_shard(query, page, language=None, sort=None, order=None):
+	return json.dumps({'query': query, 'page': page, 'language': language, 'sort': sort, 'order': order}, sort_keys=True)
+
+def decode_search_shard(value):
+	return json.loads(value)
+
+class WorkItem:
+	__slots__ = ('id', 'kind', 'value', 'attempts')
+
+	def __init__(self, id, kind, value, attempts=0):
+		self.id = id
+		self.kind = kind
+		self.value = value
+		self.attempts = attempts
+
+	def __repr__(self):
+		return "WorkItem(id=%r, kind=%r, value=%r)"%(self.id, self.kind, self.value)
+
+class SQLiteQueue:
+	"""
+	A work queue in a SQLite file which the processes of one host may share;
+	the file is in WAL mode, which does not work on network filesystems, so
+	workers on several nodes need a RedisQueue instead. Items are unique per
+	(kind, value), so loading the same input twice queues nothing new. Workers
+	lease items for `lease_seconds`; leases that expire before being
+	acknowledged go back to the queue. Leasing happens in an immediate
+	transaction, so two workers never hold the same item.
+	"""
+	def __init__(self, path, lease_seconds=300):
+		self.path = path
+		self.lease_seconds = lease_seconds
+
+		self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+		self.conn.execute("PRAGMA journal_mode=WAL")
+		self.conn.execute("""
+			CREATE TABLE IF NOT EXISTS items (
+				id INTEGER PRIMARY KEY,
+				kind TEXT NOT NULL,
+				value TEXT NOT NULL,
+				state TEXT NOT NULL DEFAULT 'pending',
+				worker TEXT,
+				lease_until REAL,
+				attempts INTEGER NOT NULL DEFAULT 0,
+				UNIQUE (kind, value)
+			)""")
+		self.conn.execute("CREATE INDEX IF NOT EXISTS items_state ON items (state, lease_until)")
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def put(self, kind, values):
+		"""
+		Queues `values` as items of `kind`. Returns the number of new items.
+		"""
+		if kind not in ITEM_KINDS:
+			raise ValueError("Unknown work item kind '%s'."%(kind))
+
+		added = 0
+		batch = []
+		for value in values:
+			batch.append((kind, value))
+			if len(batch) >= 1000:
+				added += self._insert(batch)
+				batch = []
+		if batch:
+			added += self._insert(batch)
+		return added
+
+	def _insert(self, rows):
+		with self.conn:
+			before = self.conn.total_changes
+			self.conn.executemany("INSERT OR IGNORE INTO items (kind, value) VALUES (?, ?)", rows)
+			return self.conn.total_changes - before
+
+	def lease(self, worker, count=1):
+		"""
+		Leases up to `count` pending or expired items to `worker`.
+		"""
+		now = time.time()
+		self.conn.execute("BEGIN IMMEDIATE")
+		try:
+			# Released items wait in `pending` until their `lease_until`, if set.
+			rows = self.conn.execute("SELECT id, kind, value, attempts FROM items "
+				"WHERE (state = 'pending' AND (lease_until IS NULL OR lease_until <= ?)) OR (state = 'leased' AND lease_until < ?) "
+				"ORDER BY id LIMIT ?", (now, now, count)).fetchall()
+			self.conn.executemany("UPDATE items SET state = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+				[(worker, now + self.lease_seconds, row[0]) for row in rows])
+			self.conn.execute("COMMIT")
+		except BaseException:
+			self.conn.execute("ROLLBACK")
+			raise
+		return [WorkItem(id, kind, value, attempts + 1) for id, kind, value, attempts in rows]
+
+	def ack(self, worker, item):
+		"""
+		Marks `item` as done. Returns False if the lease was lost to another worker.
+		"""
+		with self.conn:
+			cur = self.conn.execute("UPDATE items SET state = 'done', lease_until = NULL WHERE id = ? AND worker = ? AND state = 'leased'", (item.id, worker))
+			return cur.rowcount == 1
+
+	def release(self, worker, item, delay=0):
+		"""
+		Returns `item` to the queue, e.g. after a failure. With `delay` set, the
+		item is only leased again once that many seconds have passed.
+		"""
+		lease_until = time.time() + delay if delay else None
+		with self.conn:
+			self.conn.execute("UPDATE items SET state = 'pending', worker = NULL, lease_until = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+				(lease_until, item.id, worker))
+
+	def fail(self, worker, item):
+		"""
+		Marks `item` as failed, so that it is not leased again.
+		"""
+		with self.conn:
+			cur = self.conn.execute("UPDATE items SET state = 'failed', lease_until = NULL WHERE id = ? AND worker = ? AND state = 'leased'", (item.id, worker))
+			return cur.rowcount == 1
+
+	def stats(self):
+		"""
+		Returns the number of items per state, counting expired leases as pending.
+		"""
+		counts = {'pending': 0, 'leased': 0, 'done': 0, 'failed': 0}
+		now = time.time()
+		rows = self.conn.execute("SELECT CASE WHEN state = 'leased' AND lease_until < ? THEN 'pending' ELSE state END, COUNT(*) "
+			"FROM items GROUP BY 1", (now,)).fetchall()
+		for state, count in rows:
+			counts[state] = count
+		return counts
+
+	def close(self):
+		if self.conn is not None:
+			self.conn.close()
+			self.conn = None
+
+# Put, lease, ack and release run as scripts so that each is atomic on the
+# server: a crash mid-put never leaves an item known but not queued, a worker
+# dying mid-lease never loses an item, and a stale worker can never
+# acknowledge an item that has since been leased to someone else.
+REDIS_PUT_SCRIPT = """
+local added = 0
+for _, id in ipairs(ARGV) do
+	if redis.call('SADD', KEYS[2], id) == 1 then
+		redis.call('RPUSH', KEYS[1], id)
+		added = added + 1
+	end
+end
+return added
+"""
+
+REDIS_LEASE_SCRIPT = """
+local now, expiry, count, worker = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), ARGV[4]
+for _, key in ipairs({KEYS[2], KEYS[5]}) do
+	for _, id in ipairs(redis.call('ZRANGEBYSCORE', key, 0, now)) do
+		redis.call('ZREM', key, id)
+		redis.call('RPUSH', KEYS[1], id)
+	end
+end
+local ids = {}
+for i = 1, count do
+	local id = redis.call('LPOP', KEYS[1])
+	if not id then break end
+	redis.call('ZADD', KEYS[2], expiry, id)
+	redis.call('HSET', KEYS[3], id, worker)
+	redis.call('HINCRBY', KEYS[4], id, 1)
+	ids[#ids + 1] = id
+end
+return ids
+"""
+
+REDIS_FINISH_SCRIPT = """
+local id, worker, outcome, release_at = ARGV[1], ARGV[2], ARGV[3], tonumber(ARGV[4])
+if redis.call('HGET', KEYS[2], id) ~= worker then return 0 end
+if redis.call('ZREM', KEYS[1], id) == 0 then return 0 end
+redis.call('HDEL', KEYS[2], id)
+if outcome == 'done' then
+	redis.call('SADD', KEYS[3], id)
+elseif outcome == 'failed' then
+	redis.call('SADD', KEYS[5], id)
+elseif release_at > 0 then
+	redis.call('ZADD', KEYS[6], release_at, id)
+else
+	redis.call('LPUSH', KEYS[4], id)
+end
+return 1
+"""
+
+class RedisQueue:
+	"""
+	A work queue in Redis with the same semantics as `SQLiteQueue`. `client` is
+	any object with the redis-py interface, so a local stand-in such as
+	fakeredis can be passed for testing.
+
+	Ids of waiting items are kept in the `<prefix>:pending` list and leased ids
+	in the `<prefix>:leases` sorted set scored by lease expiry. Items released
+	with a delay wait in the `<prefix>:delayed` sorted set, scored by the time
+	they may be leased again. An item id is `<kind>:<value>`, which doubles as
+	the uniqueness key in `<prefix>:known`.
+	"""
+	def __init__(self, url=None, lease_seconds=300, prefix='gisthub:queue', client=None):
+		if client is None:
+			import redis
+			client = redis.Redis.from_url(url)
+
+		self.redis = client
+		self.lease_seconds = lease_seconds
+		self.prefix = prefix
+
+		self.put_script = self.redis.register_script(REDIS_PUT_SCRIPT)
+		self.lease_script = self.redis.register_script(REDIS_LEASE_SCRIPT)
+		self.finish_script = self.redis.register_script(REDIS_FINISH_SCRIPT)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def _key(self, name):
+		return '%s:%s'%(self.prefix, name)
+
+	def put(self, kind, values, batch_size=1000, pipeline_size=10):
+		"""
+		Queues `values` as items of `kind` in batches of `batch_size`, sending
+		`pipeline_size` batches per round trip. Returns the number of new items.
+		"""
+		if kind not in ITEM_KINDS:
+			raise ValueError("Unknown work item kind '%s'."%(kind))
+
+		keys = [self._key('pending'), self._key('known')]
+		added = 0
+		pipe = self.redis.pipeline(transaction=False)
+		queued = 0
+		batch = []
+		for value in values:
+			batch.append('%s:%s'%(kind, value))
+			if len(batch) >= batch_size:
+				self.put_script(keys=keys, args=batch, client=pipe)
+				batch = []
+				queued += 1
+				if queued >= pipeline_size:
+					added += sum(pipe.execute())
+					queued = 0
+		if batch:
+			self.put_script(keys=keys, args=batch, client=pipe)
+			queued += 1
+		if queued:
+			added += sum(pipe.execute())
+		return added
+
+	def lease(self, worker, count=1):
+		now = time.time()
+		keys = [self._key('pending'), self._key('leases'), self._key('workers'), self._key('attempts'), self._key('delayed')]
+		ids = self.lease_script(keys=keys, args=[now, now + self.lease_seconds, count, worker])
+
+		items = []
+		for item_id in ids:
+			if isinstance(item_id, bytes):
+				item_id = item_id.decode('utf-8')
+			kind, value = item_id.split(':', 1)
+			attempts = int(self.redis.hget(self._key('attempts'), item_id) or 1)
+			items.append(WorkItem(item_id, kind, value, attempts))
+		return items
+
+	def _finish(self, worker, item, outcome, release_at=0):
+		keys = [self._key('leases'), self._key('workers'), self._key('done'), self._key('pending'), self._key('failed'), self._key('delayed')]
+		return bool(self.finish_script(keys=keys, args=[item.id, worker, outcome, release_at]))
+
+	def ack(self, worker, item):
+		return self._finish(worker, item, 'done')
+
+	def release(self, worker, item, delay=0):
+		self._finish(worker, item, 'release', time.time() + delay if delay else 0)
+
+	def fail(self, worker, item):
+		return self._finish(worker, item, 'failed')
+
+	def stats(self):
+		now = time.time()
+		expired = self.redis.zcount(self._key('leases'), 0, now)
+		return {
+			'pending': self.redis.llen(self._key('pending')) + self.redis.zcard(self._key('delayed')) + expired,
+			'leased': self.redis.zcard(self._key('leases')) - expired,
+			'done': self.redis.scard(self._key('done')),
+			'failed': self.redis.scard(self._key('failed')),
+		}
+
+	def close(self):
+		pass
+
+def open_queue(location, lease_seconds=300):
+	"""
+	Returns the queue at `location`, a `redis://` url or a SQLite file path.
+	"""
+	if location.startswith(('redis://', 'rediss://', 'unix://')):
+		return RedisQueue(location, lease_seconds)
+	return SQLiteQueue(location, lease_seconds)